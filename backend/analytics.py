@@ -0,0 +1,296 @@
+"""Columnar snapshots of orders and customers for vectorized admin reports"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
+from pymongo import MongoClient
+
+from sales_rollups import PAID_STATUSES
+
+
+logger = logging.getLogger(__name__)
+
+PERIOD_UNITS = {"day": "D", "week": "W", "month": "M"}
+NO_COUPON = ""
+
+
+def _to_datetime64(values: List[Any]) -> np.ndarray:
+    """UTC ISO strings (as stored by prepare_for_mongo) to datetime64[s]"""
+    return np.array([str(v)[:19] if v else "NaT" for v in values], dtype="datetime64[s]")
+
+
+def _encode(values: List[Any], labels: Optional[List[str]] = None):
+    """Dictionary-encode a column into int32 codes and a label list"""
+    labels = list(labels or [])
+    index = {label: i for i, label in enumerate(labels)}
+    codes = np.empty(len(values), dtype=np.int32)
+    for i, value in enumerate(values):
+        value = getattr(value, "value", value)
+        value = "" if value is None else str(value)
+        code = index.get(value)
+        if code is None:
+            code = index[value] = len(labels)
+            labels.append(value)
+        codes[i] = code
+    return codes, labels
+
+
+@dataclass
+class Snapshot:
+    """Orders, line items and customers held as parallel NumPy columns"""
+    built_at: float = 0.0
+    # orders
+    order_created: np.ndarray = field(default_factory=lambda: np.empty(0, dtype="datetime64[s]"))
+    order_customer: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.int32))
+    order_total: np.ndarray = field(default_factory=lambda: np.empty(0))
+    order_discount: np.ndarray = field(default_factory=lambda: np.empty(0))
+    order_coupon: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.int32))
+    coupon_labels: List[str] = field(default_factory=list)
+    # line items
+    item_order: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.int64))
+    item_category: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.int32))
+    item_total: np.ndarray = field(default_factory=lambda: np.empty(0))
+    item_quantity: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.int64))
+    category_labels: List[str] = field(default_factory=list)
+    # customers, indexed by the codes in order_customer
+    customer_labels: List[str] = field(default_factory=list)
+    customer_segment: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.int32))
+    segment_labels: List[str] = field(default_factory=list)
+
+    @property
+    def order_count(self) -> int:
+        return len(self.order_total)
+
+
+def build_snapshot(orders: Dict[str, list], items: Dict[str, list], categories: Dict[str, str], users: Dict[str, list]) -> Snapshot:
+    """Turn the raw column lists read from Mongo into a Snapshot (CPU bound)"""
+    snapshot = Snapshot(built_at=time.time())
+    snapshot.order_created = _to_datetime64(orders["created_at"])
+    snapshot.order_total = np.asarray(orders["total_amount"], dtype=np.float64)
+    snapshot.order_discount = np.asarray(orders["discount_amount"], dtype=np.float64)
+    snapshot.order_coupon, snapshot.coupon_labels = _encode(orders["coupon_code"], [NO_COUPON])
+    snapshot.order_customer, snapshot.customer_labels = _encode(orders["customer_id"], users["id"])
+
+    snapshot.item_order = np.asarray(items["order"], dtype=np.int64)
+    snapshot.item_total = np.asarray(items["total"], dtype=np.float64)
+    snapshot.item_quantity = np.asarray(items["quantity"], dtype=np.int64)
+    snapshot.item_category, snapshot.category_labels = _encode(
+        [categories.get(product_id, "uncategorized") for product_id in items["product_id"]]
+    )
+
+    # Customers seen only on orders (e.g. deleted users) fall into the "new" segment
+    segments = users["segment"] + ["new"] * (len(snapshot.customer_labels) - len(users["id"]))
+    snapshot.customer_segment, snapshot.segment_labels = _encode(segments)
+    return snapshot
+
+
+def load_snapshot(db, batch_size: int = 5000) -> Snapshot:
+    """Read hot and archived orders, users and product categories and build the columns.
+
+    Takes a synchronous pymongo database and runs in a worker thread, so
+    neither the cursors nor the per-order loop hold up the event loop.
+    """
+    orders = {"created_at": [], "customer_id": [], "total_amount": [], "discount_amount": [], "coupon_code": []}
+    items = {"order": [], "product_id": [], "total": [], "quantity": []}
+    projection = {"_id": 0, "created_at": 1, "customer_id": 1, "total_amount": 1, "discount_amount": 1,
+                  "coupon_code": 1, "items.product_id": 1, "items.total": 1, "items.quantity": 1}
+    for collection in (db.orders, db.orders_archive):
+        cursor = collection.find({"status": {"$in": list(PAID_STATUSES)}}, projection).batch_size(batch_size)
+        for order in cursor:
+            position = len(orders["created_at"])
+            orders["created_at"].append(order.get("created_at"))
+            orders["customer_id"].append(order.get("customer_id"))
+            orders["total_amount"].append(order.get("total_amount", 0.0))
+            orders["discount_amount"].append(order.get("discount_amount", 0.0))
+            orders["coupon_code"].append(order.get("coupon_code") or NO_COUPON)
+            for item in order.get("items", []):
+                items["order"].append(position)
+                items["product_id"].append(item.get("product_id"))
+                items["total"].append(item.get("total", 0.0))
+                items["quantity"].append(item.get("quantity", 0))
+
+    users = {"id": [], "segment": []}
+    for user in db.users.find({}, {"_id": 0, "id": 1, "segment": 1}).batch_size(batch_size):
+        users["id"].append(user["id"])
+        users["segment"].append(user.get("segment") or "new")
+
+    categories = {}
+    for product in db.products.find({}, {"_id": 0, "id": 1, "category": 1}):
+        categories[product["id"]] = getattr(product["category"], "value", product["category"])
+
+    return build_snapshot(orders, items, categories, users)
+
+
+def _periods(created: np.ndarray, granularity: str) -> np.ndarray:
+    if granularity == "week":
+        # NumPy weeks start on Thursday (the epoch's weekday); shift to ISO Mondays
+        days = created.astype("datetime64[D]")
+        return (days + 3).astype("datetime64[W]").astype("datetime64[D]") - 3
+    return created.astype(f"datetime64[{PERIOD_UNITS[granularity]}]")
+
+
+def cohort_retention(snapshot: Snapshot, max_months: int = 12) -> List[Dict[str, Any]]:
+    """Share of each first-order-month cohort that ordered again k months later"""
+    if snapshot.order_count == 0:
+        return []
+    month = snapshot.order_created.astype("datetime64[M]").astype(np.int64)
+    customers = snapshot.order_customer
+    first_month = np.full(len(snapshot.customer_labels), np.iinfo(np.int64).max)
+    np.minimum.at(first_month, customers, month)
+    cohort = first_month[customers]
+    offset = month - cohort
+
+    keep = offset <= max_months
+    # One row per distinct (cohort, offset, customer)
+    active = np.unique(np.stack([cohort[keep], offset[keep], customers[keep]], axis=1), axis=0)
+    pairs, counts = np.unique(active[:, :2], axis=0, return_counts=True)
+
+    report = {}
+    for (cohort_month, month_offset), count in zip(pairs, counts):
+        row = report.setdefault(int(cohort_month), {})
+        row[int(month_offset)] = int(count)
+    result = []
+    for cohort_month, row in sorted(report.items()):
+        size = row.get(0, 0)
+        result.append({
+            "cohort": str(np.datetime64(cohort_month, "M")),
+            "customers": size,
+            "retention": [round(row.get(k, 0) / size, 4) if size else 0.0 for k in range(max_months + 1)],
+        })
+    return result
+
+
+def revenue_by_category(snapshot: Snapshot, granularity: str = "month") -> List[Dict[str, Any]]:
+    if len(snapshot.item_total) == 0:
+        return []
+    period = _periods(snapshot.order_created[snapshot.item_order], granularity)
+    period_values, period_codes = np.unique(period, return_inverse=True)
+    n_categories = len(snapshot.category_labels)
+    key = period_codes * n_categories + snapshot.item_category
+    size = len(period_values) * n_categories
+    revenue = np.bincount(key, weights=snapshot.item_total, minlength=size).reshape(-1, n_categories)
+    units = np.bincount(key, weights=snapshot.item_quantity, minlength=size).reshape(-1, n_categories)
+    return [
+        {
+            "period": str(period_values[i]),
+            "categories": {
+                label: {"revenue": round(float(revenue[i, c]), 2), "units": int(units[i, c])}
+                for c, label in enumerate(snapshot.category_labels)
+                if units[i, c]
+            },
+        }
+        for i in range(len(period_values))
+    ]
+
+
+def aov_by_segment(snapshot: Snapshot) -> List[Dict[str, Any]]:
+    if snapshot.order_count == 0:
+        return []
+    segment = snapshot.customer_segment[snapshot.order_customer]
+    n = len(snapshot.segment_labels)
+    orders = np.bincount(segment, minlength=n)
+    revenue = np.bincount(segment, weights=snapshot.order_total, minlength=n)
+    return [
+        {
+            "segment": label,
+            "orders": int(orders[i]),
+            "revenue": round(float(revenue[i]), 2),
+            "average_order_value": round(float(revenue[i] / orders[i]), 2) if orders[i] else 0.0,
+        }
+        for i, label in enumerate(snapshot.segment_labels)
+        if orders[i]
+    ]
+
+
+def discount_impact(snapshot: Snapshot) -> Dict[str, Any]:
+    if snapshot.order_count == 0:
+        return {"baseline_average_order_value": 0.0, "coupons": []}
+    n = len(snapshot.coupon_labels)
+    coupon = snapshot.order_coupon
+    orders = np.bincount(coupon, minlength=n)
+    revenue = np.bincount(coupon, weights=snapshot.order_total, minlength=n)
+    discount = np.bincount(coupon, weights=snapshot.order_discount, minlength=n)
+    baseline = float(revenue[0] / orders[0]) if orders[0] else 0.0
+    coupons = []
+    for i in np.argsort(-revenue):
+        if i == 0 or not orders[i]:
+            continue
+        aov = float(revenue[i] / orders[i])
+        coupons.append({
+            "coupon_code": snapshot.coupon_labels[i],
+            "orders": int(orders[i]),
+            "revenue": round(float(revenue[i]), 2),
+            "total_discount": round(float(discount[i]), 2),
+            "average_order_value": round(aov, 2),
+            "aov_lift": round(aov / baseline - 1, 4) if baseline else None,
+        })
+    return {"baseline_average_order_value": round(baseline, 2), "coupons": coupons}
+
+
+class AnalyticsEngine:
+    """Keeps a periodically refreshed snapshot and runs reports against it.
+
+    Snapshots are read with the engine's own synchronous client in the
+    threadpool, the way the Parquet exporter reads with its own.
+    """
+
+    def __init__(self, mongo_url: str, db_name: str, refresh_interval: float = 300.0):
+        self.mongo_url = mongo_url
+        self.db_name = db_name
+        self.refresh_interval = refresh_interval
+        self.snapshot = Snapshot()
+        self._client = None
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def database(self):
+        if self._client is None:
+            self._client = MongoClient(self.mongo_url)
+        return self._client[self.db_name]
+
+    async def refresh(self) -> Snapshot:
+        async with self._lock:
+            started = time.monotonic()
+            self.snapshot = await run_in_threadpool(load_snapshot, self.database)
+            logger.info("Analytics snapshot: %d orders in %.2fs", self.snapshot.order_count, time.monotonic() - started)
+            return self.snapshot
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception:
+                logger.exception("Analytics snapshot refresh failed")
+            await asyncio.sleep(self.refresh_interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    async def report(self, func, *args):
+        """Run a report on the current snapshot in the threadpool"""
+        if not self.snapshot.built_at:
+            await self.refresh()
+        return await run_in_threadpool(func, self.snapshot, *args)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "built_at": self.snapshot.built_at or None,
+            "age_seconds": round(time.time() - self.snapshot.built_at, 1) if self.snapshot.built_at else None,
+            "orders": self.snapshot.order_count,
+            "line_items": len(self.snapshot.item_total),
+            "customers": len(self.snapshot.customer_labels),
+        }
@@ -0,0 +1,154 @@
+"""Moves finished orders out of the hot orders collection into a compressed archive"""
+import asyncio
+import logging
+from datetime import datetime, timezone, timedelta
+from typing import Any, Dict, List, Optional
+
+from pymongo import ReplaceOne
+from pymongo.errors import CollectionInvalid
+
+from sales_rollups import counts_as_sale
+
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = ("delivered", "cancelled", "refunded")
+STATS_ID = "totals"
+
+
+def stats_increments(orders: List[Dict[str, Any]], sign: int = 1) -> Dict[str, float]:
+    """$inc for the archived-order totals that get_admin_stats adds to the hot ones"""
+    inc: Dict[str, float] = {}
+
+    def add(key, value):
+        inc[key] = inc.get(key, 0) + value * sign
+
+    for order in orders:
+        status = getattr(order.get("status"), "value", order.get("status"))
+        add("orders", 1)
+        add(f"statuses.{status}.orders", 1)
+        add(f"statuses.{status}.revenue", order.get("total_amount", 0.0))
+        if not counts_as_sale(status):
+            continue
+        for item in order.get("items", []):
+            add(f"products.{item['product_id']}.quantity", item["quantity"])
+            add(f"products.{item['product_id']}.revenue", item["total"])
+    return inc
+
+
+class OrderArchiver:
+    """Periodically archives terminal orders last updated before a cutoff.
+
+    Each batch is copied into orders_archive (idempotent upserts), removed
+    from orders and then added to the archive totals. Sales rollups are
+    untouched: they were recorded when the orders were written and stay
+    valid wherever the documents live.
+    """
+
+    def __init__(self, db, older_than_days: int = 365, batch_size: int = 1000, interval: float = 86400.0):
+        self.db = db
+        self.older_than_days = older_than_days
+        self.batch_size = batch_size
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    async def ensure_collection(self):
+        try:
+            # Cold data: trade some CPU for a smaller footprint on disk
+            await self.db.create_collection(
+                "orders_archive",
+                storageEngine={"wiredTiger": {"configString": "block_compressor=zstd"}},
+            )
+        except CollectionInvalid:
+            pass
+        await self.db.orders_archive.create_index("id", unique=True)
+        await self.db.orders.create_index([("status", 1), ("updated_at", 1)])
+
+    async def archive_batch(self, cutoff: str) -> int:
+        orders = await self.db.orders.find(
+            {"status": {"$in": list(TERMINAL_STATUSES)}, "updated_at": {"$lt": cutoff}},
+            {"_id": 0},
+        ).limit(self.batch_size).to_list(length=None)
+        if not orders:
+            return 0
+
+        archived_at = datetime.now(timezone.utc).isoformat()
+        await self.db.orders_archive.bulk_write(
+            [ReplaceOne({"id": order["id"]}, {**order, "archived_at": archived_at}, upsert=True) for order in orders],
+            ordered=False,
+        )
+        # Only orders that are still terminal and unchanged leave the hot collection
+        ids = [order["id"] for order in orders]
+        await self.db.orders.delete_many({"id": {"$in": ids}, "updated_at": {"$lt": cutoff},
+                                          "status": {"$in": list(TERMINAL_STATUSES)}})
+        still_hot = {
+            order["id"] for order in
+            await self.db.orders.find({"id": {"$in": ids}}, {"_id": 0, "id": 1}).to_list(length=None)
+        }
+        if still_hot:
+            await self.db.orders_archive.delete_many({"id": {"$in": list(still_hot)}})
+        moved = [order for order in orders if order["id"] not in still_hot]
+
+        if moved:
+            names = {
+                f"products.{item['product_id']}.name": item.get("product_name")
+                for order in moved for item in order.get("items", [])
+            }
+            await self.db.order_archive_stats.update_one(
+                {"_id": STATS_ID},
+                {"$inc": stats_increments(moved), "$set": {**names, "updated_at": archived_at}},
+                upsert=True,
+            )
+        return len(moved)
+
+    async def run_once(self) -> int:
+        """Archive everything past the cutoff, one batch at a time"""
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=self.older_than_days)).isoformat()
+        total = 0
+        async with self._lock:
+            while True:
+                moved = await self.archive_batch(cutoff)
+                total += moved
+                if moved < self.batch_size:
+                    break
+        if total:
+            logger.info("Archived %d orders last updated before %s", total, cutoff)
+        return total
+
+    async def rebuild_stats(self) -> int:
+        """Recompute the archive totals from orders_archive"""
+        async with self._lock:
+            await self.db.order_archive_stats.delete_many({})
+            count = 0
+            batch = []
+            async for order in self.db.orders_archive.find({}, {"_id": 0, "status": 1, "total_amount": 1, "items": 1}):
+                batch.append(order)
+                if len(batch) >= self.batch_size:
+                    await self.db.order_archive_stats.update_one({"_id": STATS_ID}, {"$inc": stats_increments(batch)}, upsert=True)
+                    count += len(batch)
+                    batch = []
+            if batch:
+                await self.db.order_archive_stats.update_one({"_id": STATS_ID}, {"$inc": stats_increments(batch)}, upsert=True)
+                count += len(batch)
+            return count
+
+    async def stats(self) -> Dict[str, Any]:
+        return await self.db.order_archive_stats.find_one({"_id": STATS_ID}, {"_id": 0}) or {}
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("Order archival failed")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
@@ -0,0 +1,130 @@
+"""Append-only audit trail of product and order changes"""
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from pymongo.errors import BulkWriteError, CollectionInvalid
+
+from events import ChangeEvent
+
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY = 11000
+
+
+def _path_values(values: Dict[str, Any]) -> List[Dict[str, Any]]:
+    # PATCH events key values by dotted path, which cannot be stored as field names
+    return [{"path": path, "value": value} for path, value in values.items()]
+
+
+def audit_record(event: ChangeEvent) -> Dict[str, Any]:
+    return {
+        "entity": event.entity,
+        "entity_id": event.entity_id,
+        "type": event.type,
+        "fields": event.fields,
+        "changes": _path_values(event.changes),
+        "previous": _path_values(event.previous),
+        "removed": event.removed,
+        "version": event.version,
+        "actor": event.actor,
+        "ts": event.ts,
+    }
+
+
+class AuditLog:
+    """Buffers change events in memory and bulk-inserts them into a capped collection.
+
+    Recording an event is a list append, so writers never wait on the
+    audit insert. The buffer is flushed every `flush_interval` seconds or
+    as soon as it holds `max_batch` records.
+    """
+
+    def __init__(self, db, collection: str = "audit_log", max_bytes: int = 512 * 1024 * 1024,
+                 flush_interval: float = 1.0, max_batch: int = 500):
+        self.db = db
+        self.collection_name = collection
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._buffer: List[Dict[str, Any]] = []
+        self._task: Optional[asyncio.Task] = None
+        self._flushing: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def collection(self):
+        return self.db[self.collection_name]
+
+    async def ensure_collection(self):
+        try:
+            await self.db.create_collection(self.collection_name, capped=True, size=self.max_bytes)
+        except CollectionInvalid:
+            pass  # already exists
+        await self.collection.create_index([("entity_id", 1), ("ts", -1)])
+
+    def record(self, event: ChangeEvent):
+        self._buffer.append(audit_record(event))
+        if len(self._buffer) >= self.max_batch and (self._flushing is None or self._flushing.done()):
+            self._flushing = asyncio.create_task(self.flush())
+
+    async def flush(self) -> int:
+        async with self._lock:
+            batch, self._buffer = self._buffer, []
+            if not batch:
+                return 0
+            try:
+                await self.collection.insert_many(batch, ordered=False)
+            except BulkWriteError as e:
+                # insert_many gave every record an _id, so records that already landed
+                # (here or in an earlier failed flush) come back as duplicate keys
+                failed = [
+                    batch[error["index"]] for error in e.details.get("writeErrors", [])
+                    if error.get("code") != DUPLICATE_KEY
+                ]
+                self._buffer[:0] = failed
+                if failed:
+                    raise
+                return len(batch)
+            except Exception:
+                # Keep the records for the next flush rather than losing them; any that
+                # did land are dropped as duplicate keys then
+                self._buffer[:0] = batch
+                raise
+            return len(batch)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Audit log flush failed")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("Final audit log flush failed")
+
+    async def history(self, entity_id: str, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                      limit: int = 100) -> List[Dict[str, Any]]:
+        """Newest first, served by the (entity_id, ts) index; includes records not yet flushed"""
+        await self.flush()
+        query: Dict[str, Any] = {"entity_id": entity_id}
+        if since or until:
+            query["ts"] = {}
+            if since:
+                query["ts"]["$gte"] = since
+            if until:
+                query["ts"]["$lt"] = until
+        return await self.collection.find(query, {"_id": 0}).sort("ts", -1).limit(limit).to_list(length=None)
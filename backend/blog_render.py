@@ -0,0 +1,44 @@
+"""Write-time rendering of blog post markdown into sanitized HTML"""
+import hashlib
+import html as html_lib
+import json
+from typing import Dict
+
+import bleach
+import markdown
+
+
+ALLOWED_TAGS = [
+    "a", "abbr", "b", "blockquote", "br", "code", "em", "figcaption", "figure",
+    "h1", "h2", "h3", "h4", "h5", "h6", "hr", "i", "img", "li", "ol", "p", "pre",
+    "span", "strong", "sub", "sup", "table", "tbody", "td", "th", "thead", "tr", "ul",
+]
+ALLOWED_ATTRIBUTES = {
+    "a": ["href", "title", "rel"],
+    "abbr": ["title"],
+    "img": ["src", "alt", "title", "width", "height", "loading"],
+    "td": ["align"],
+    "th": ["align"],
+    "*": ["dir", "lang"],
+}
+ALLOWED_PROTOCOLS = ["http", "https", "mailto"]
+MARKDOWN_EXTENSIONS = ["extra", "sane_lists"]
+
+
+def content_hash(content: Dict[str, str]) -> str:
+    """Stable hash of the per-language source, used to skip needless re-renders"""
+    return hashlib.sha256(json.dumps(content, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def render_html(text: str, language: str) -> str:
+    html = markdown.markdown(text, extensions=MARKDOWN_EXTENSIONS, output_format="html")
+    html = bleach.clean(html, tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRIBUTES, protocols=ALLOWED_PROTOCOLS, strip=True)
+    html = bleach.linkify(html, callbacks=[bleach.callbacks.nofollow])
+    if language == "ar":
+        return f'<div dir="rtl" lang="ar">{html}</div>'
+    return f'<div lang="{html_lib.escape(language)}">{html}</div>'
+
+
+def render_content(content: Dict[str, str]) -> Dict[str, str]:
+    """Render every language of a post's content"""
+    return {language: render_html(text, language) for language, text in content.items()}
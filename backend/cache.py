@@ -0,0 +1,106 @@
+"""In-process object caches shared by read endpoints"""
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+
+class TTLCache:
+    """LRU cache of objects by key with a per-entry time to live"""
+
+    def __init__(self, ttl: float = 60.0, max_entries: int = 10_000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def get_many(self, keys: Iterable[Hashable]) -> Tuple[Dict[Hashable, Any], List[Hashable]]:
+        """Cached values by key, plus the keys that missed"""
+        found, missing = {}, []
+        for key in keys:
+            value = self.get(key)
+            if value is None:
+                missing.append(key)
+            else:
+                found[key] = value
+        return found, missing
+
+    def put(self, key: Hashable, value: Any):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+
+class SingleFlight:
+    """Coalesces concurrent identical reads into one in-flight call per key.
+
+    The first caller for a key starts the call as its own task; callers that
+    arrive while it runs await the same task instead of querying again. The
+    task is shielded, so a caller that goes away does not cancel it for the
+    rest, and it is bounded by a per-key timeout after which every waiter
+    gets asyncio.TimeoutError.
+
+    generation is bumped by forget(); a call that sees it change while it
+    ran has read data the write may have replaced and should not cache it.
+    """
+
+    def __init__(self, timeout: float = 10.0):
+        self.timeout = timeout
+        self.generation = 0
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        self.metrics: Dict[str, Dict[str, int]] = {}
+
+    def _count(self, name: str, outcome: str):
+        counters = self.metrics.setdefault(name, {"calls": 0, "coalesced": 0, "timeouts": 0, "errors": 0})
+        counters[outcome] += 1
+
+    async def do(self, key: Hashable, call: Callable[[], Awaitable[Any]], timeout: Optional[float] = None,
+                 name: str = "default") -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            self._count(name, "calls")
+            task = asyncio.ensure_future(self._run(key, call, timeout or self.timeout, name))
+            # Retrieve the outcome even if every waiter has gone away
+            task.add_done_callback(lambda done: done.cancelled() or done.exception())
+            self._calls[key] = task
+        else:
+            self._count(name, "coalesced")
+        return await asyncio.shield(task)
+
+    async def _run(self, key: Hashable, call: Callable[[], Awaitable[Any]], timeout: float, name: str) -> Any:
+        try:
+            return await asyncio.wait_for(call(), timeout)
+        except asyncio.TimeoutError:
+            self._count(name, "timeouts")
+            raise
+        except Exception:
+            self._count(name, "errors")
+            raise
+        finally:
+            if self._calls.get(key) is asyncio.current_task():
+                del self._calls[key]
+
+    def forget(self):
+        """Let callers after a write start fresh calls instead of joining ones that began before it"""
+        self.generation += 1
+        self._calls.clear()
+
+    def status(self) -> Dict[str, Any]:
+        return {"in_flight": len(self._calls), "generation": self.generation, "keys": self.metrics}
@@ -0,0 +1,92 @@
+"""Content-addressed storage for product quality certificates"""
+import asyncio
+import hashlib
+import os
+import re
+import tempfile
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict
+from urllib.parse import quote
+
+from fastapi import UploadFile
+
+
+CERTIFICATE_TYPES = {
+    "application/pdf": "pdf",
+    "image/jpeg": "jpg",
+    "image/png": "png",
+    "image/webp": "webp",
+}
+MAX_CERTIFICATE_BYTES = 50 * 1024 * 1024
+CERTIFICATE_ID_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+def certificate_url(cert_id: str) -> str:
+    return f"/api/certificates/{cert_id}"
+
+
+def content_disposition(filename: str, disposition: str = "inline") -> str:
+    """RFC 6266 header value: an ASCII fallback plus the UTF-8 name in filename*"""
+    # Quotes, backslashes and control characters (CR/LF included) could break out of the header
+    filename = "".join(ch for ch in filename if ch not in '"\\' and ord(ch) >= 32) or "certificate"
+    fallback = filename.encode("ascii", "ignore").decode().strip() or "certificate"
+    if fallback.startswith("."):
+        fallback = "certificate" + fallback
+    return f"{disposition}; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename, safe='')}"
+
+
+class CertificateStore:
+    """Stores certificate files on local disk, deduplicated by SHA-256"""
+
+    chunk_size = 1024 * 1024
+
+    def __init__(self, db, root: Path):
+        self.db = db
+        self.root = Path(root)
+
+    def path_for(self, cert_id: str) -> Path:
+        return self.root / cert_id[:2] / cert_id
+
+    def relative_path(self, cert_id: str) -> str:
+        return f"{cert_id[:2]}/{cert_id}"
+
+    async def save(self, upload: UploadFile) -> Dict[str, Any]:
+        """Stream an upload to disk while hashing it; identical files are stored once"""
+        if upload.content_type not in CERTIFICATE_TYPES:
+            raise ValueError(f"Unsupported certificate type: {upload.content_type}")
+
+        self.root.mkdir(parents=True, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_name = tempfile.mkstemp(dir=self.root, suffix=".upload")
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                while chunk := await upload.read(self.chunk_size):
+                    size += len(chunk)
+                    if size > MAX_CERTIFICATE_BYTES:
+                        raise ValueError("Certificate file is too large")
+                    digest.update(chunk)
+                    await asyncio.to_thread(tmp.write, chunk)
+
+            cert_id = digest.hexdigest()
+            path = self.path_for(cert_id)
+            if path.exists():
+                os.unlink(tmp_name)
+            else:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(tmp_name, path)
+        except BaseException:
+            if os.path.exists(tmp_name):
+                os.unlink(tmp_name)
+            raise
+
+        record = {
+            "id": cert_id,
+            "filename": upload.filename or f"{cert_id}.{CERTIFICATE_TYPES[upload.content_type]}",
+            "content_type": upload.content_type,
+            "size": size,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+        }
+        await self.db.certificates.update_one({"id": cert_id}, {"$setOnInsert": record}, upsert=True)
+        return await self.db.certificates.find_one({"id": cert_id}, {"_id": 0})
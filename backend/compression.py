@@ -0,0 +1,198 @@
+"""Response compression and precompressed response caching"""
+import gzip
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from fastapi.encoders import jsonable_encoder
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.requests import Request
+from starlette.responses import Response
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+
+MIN_COMPRESS_SIZE = 1024
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/xml", "application/javascript")
+GZIP_LEVEL = 6
+# Dynamic responses favour speed; cached payloads are compressed once so
+# they can afford a denser setting
+BROTLI_DYNAMIC_QUALITY = 4
+BROTLI_CACHED_QUALITY = 9
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """Pick the best supported encoding from an Accept-Encoding header"""
+    accepted = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.partition(";")
+        name = name.strip()
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            accepted[name] = q
+    for encoding in ("br", "gzip"):
+        if encoding == "br" and brotli is None:
+            continue
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+def compress(body: bytes, encoding: str, cached: bool = False) -> bytes:
+    if encoding == "br":
+        quality = BROTLI_CACHED_QUALITY if cached else BROTLI_DYNAMIC_QUALITY
+        return brotli.compress(body, quality=quality)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def render_json(content: Any) -> bytes:
+    """Serialize like FastAPI's JSONResponse so cached bodies match live ones"""
+    return json.dumps(
+        jsonable_encoder(content),
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+class CachedPayload:
+    """A rendered JSON body with its compressed variants, built on demand"""
+
+    def __init__(self, body: bytes, tags: Iterable[str] = (), ttl: float = 60.0):
+        self.body = body
+        self.tags = frozenset(tags)
+        self.etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        self.expires_at = time.monotonic() + ttl
+        self.variants: Dict[str, bytes] = {}
+
+    async def encoded(self, encoding: Optional[str]) -> Tuple[bytes, Optional[str]]:
+        if encoding is None or len(self.body) < MIN_COMPRESS_SIZE:
+            return self.body, None
+        if encoding not in self.variants:
+            self.variants[encoding] = await run_in_threadpool(compress, self.body, encoding, True)
+        return self.variants[encoding], encoding
+
+    async def to_response(self, request: Request) -> Response:
+        headers = {"ETag": self.etag, "Vary": "Accept-Encoding"}
+        if request.headers.get("if-none-match") == self.etag:
+            return Response(status_code=304, headers=headers)
+        body, encoding = await self.encoded(negotiate_encoding(request.headers.get("accept-encoding", "")))
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return Response(body, media_type="application/json", headers=headers)
+
+
+class ResponseCache:
+    """LRU cache of rendered responses with TTL and tag-based invalidation"""
+
+    def __init__(self, ttl: float = 60.0, max_entries: int = 1000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, CachedPayload]" = OrderedDict()
+
+    @staticmethod
+    def key_for(request: Request, prefix: str = "") -> str:
+        """Cache key from the route path and its sorted query parameters"""
+        query = "&".join(f"{k}={v}" for k, v in sorted(request.query_params.multi_items()))
+        return f"{prefix}{request.url.path}?{query}"
+
+    def get(self, key: str) -> Optional[CachedPayload]:
+        payload = self._entries.get(key)
+        if payload is None:
+            return None
+        if payload.expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return payload
+
+    def render(self, content: Any, tags: Iterable[str] = ()) -> CachedPayload:
+        """A payload for one response that is not kept"""
+        return CachedPayload(render_json(content), tags=tags, ttl=self.ttl)
+
+    def put(self, key: str, content: Any, tags: Iterable[str] = ()) -> CachedPayload:
+        payload = self.render(content, tags)
+        self._entries[key] = payload
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return payload
+
+    def invalidate(self, *tags: str):
+        """Drop every entry carrying any of the given tags"""
+        stale = [key for key, payload in self._entries.items() if payload.tags.intersection(tags)]
+        for key in stale:
+            del self._entries[key]
+
+    def clear(self):
+        self._entries.clear()
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing complete response bodies with br or gzip.
+
+    Responses that already carry a Content-Encoding (such as cached payloads),
+    partial or binary content and streamed responses are passed through untouched.
+    """
+
+    def __init__(self, app, minimum_size: int = MIN_COMPRESS_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                start_message = message
+                headers = Headers(raw=message["headers"])
+                compressible = headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES)
+                if "content-encoding" in headers or "content-range" in headers or not compressible:
+                    passthrough = True
+                    await send(message)
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            if message.get("more_body", False) or len(body) < self.minimum_size:
+                passthrough = True
+                await send(start_message)
+                await send(message)
+                return
+
+            compressed = compress(body, encoding)
+            headers = MutableHeaders(raw=start_message["headers"])
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(compressed))
+            headers.add_vary_header("Accept-Encoding")
+            await send(start_message)
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_wrapper)
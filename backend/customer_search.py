@@ -0,0 +1,112 @@
+"""Normalized search keys for finding customers by email, phone or name"""
+import re
+import unicodedata
+from typing import Any, Dict, List, Optional
+
+from pymongo import UpdateOne
+
+
+# Harakat, Quranic marks, superscript alef and tatweel carry no meaning for matching
+ARABIC_MARKS_RE = re.compile("[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]")
+ARABIC_LETTER_MAP = str.maketrans({
+    "\u0623": "\u0627",  # alef with hamza above -> alef
+    "\u0625": "\u0627",  # alef with hamza below -> alef
+    "\u0622": "\u0627",  # alef with madda -> alef
+    "\u0671": "\u0627",  # alef wasla -> alef
+    "\u0624": "\u0648",  # waw with hamza -> waw
+    "\u0626": "\u064a",  # yeh with hamza -> yeh
+    "\u0649": "\u064a",  # alef maksura -> yeh
+    "\u0629": "\u0647",  # taa marbuta -> heh
+})
+# Arabic-Indic and Eastern Arabic-Indic digits to ASCII
+DIGIT_MAP = str.maketrans("\u0660\u0661\u0662\u0663\u0664\u0665\u0666\u0667\u0668\u0669"
+                          "\u06f0\u06f1\u06f2\u06f3\u06f4\u06f5\u06f6\u06f7\u06f8\u06f9",
+                          "01234567890123456789")
+PHONE_QUERY_RE = re.compile(r"^[\d+\-() ]+$")
+NON_DIGIT_RE = re.compile(r"\D")
+
+
+def normalize_name(value: Optional[str]) -> str:
+    """Fold case and accents, and unify alef, hamza and taa marbuta forms"""
+    if not value:
+        return ""
+    value = ARABIC_MARKS_RE.sub("", value).translate(ARABIC_LETTER_MAP)
+    # NFKD splits Latin accents into combining marks, which are then dropped
+    value = "".join(ch for ch in unicodedata.normalize("NFKD", value) if not unicodedata.combining(ch))
+    return " ".join(value.casefold().split())
+
+
+def normalize_phone(value: Optional[str]) -> str:
+    return NON_DIGIT_RE.sub("", (value or "").translate(DIGIT_MAP))
+
+
+def normalize_email(value: Optional[str]) -> str:
+    return (value or "").strip().lower()
+
+
+def search_fields(user: Dict[str, Any]) -> Dict[str, Any]:
+    """The precomputed `search` subdocument stored on a user"""
+    first, last = normalize_name(user.get("first_name")), normalize_name(user.get("last_name"))
+    full = f"{first} {last}".strip()
+    # Each name token plus the full name, so "fatima al" and "al zahra" both prefix-match
+    names = sorted({*first.split(), *last.split(), full} - {""})
+    fields = {"email": normalize_email(user.get("email")), "phone": normalize_phone(user.get("phone"))}
+    # Missing rather than empty: the sparse search.phone index then leaves out customers without a phone
+    return {**{key: value for key, value in fields.items() if value}, "names": names}
+
+
+def with_search_fields(user: Dict[str, Any]) -> Dict[str, Any]:
+    """A user document ready to write, its search keys computed from its current fields.
+
+    Every insert or replace of a user goes through this so the keys never
+    fall behind the email, phone and names they are derived from.
+    """
+    return {**user, "search": search_fields(user)}
+
+
+async def ensure_indexes(db):
+    await db.users.create_index("search.email")
+    await db.users.create_index("search.phone", sparse=True)
+    await db.users.create_index("search.names")
+
+
+def _prefix(value: str) -> Dict[str, str]:
+    # Anchored, case-sensitive regexes are answered as index range scans
+    return {"$regex": f"^{re.escape(value)}"}
+
+
+def build_query(q: str) -> Optional[Dict[str, Any]]:
+    """Pick the email, phone or name index from the shape of the query"""
+    q = q.strip()
+    if "@" in q:
+        return {"search.email": _prefix(normalize_email(q))}
+    if PHONE_QUERY_RE.match(q) and normalize_phone(q):
+        return {"search.phone": _prefix(normalize_phone(q))}
+    name = normalize_name(q)
+    if not name:
+        return None
+    tokens = name.split()
+    if len(tokens) == 1:
+        return {"search.names": _prefix(tokens[0])}
+    # Every token must prefix-match one of the customer's name keys, in any order
+    return {"$and": [{"search.names": _prefix(token)} for token in tokens]}
+
+
+async def backfill(db, batch_size: int = 1000) -> int:
+    """Store search fields on users that do not have them yet"""
+    updated = 0
+    operations: List[UpdateOne] = []
+    cursor = db.users.find(
+        {"search": {"$exists": False}},
+        {"_id": 0, "id": 1, "email": 1, "phone": 1, "first_name": 1, "last_name": 1},
+    ).batch_size(batch_size)
+    async for user in cursor:
+        operations.append(UpdateOne({"id": user["id"]}, {"$set": {"search": search_fields(user)}}))
+        if len(operations) >= batch_size:
+            await db.users.bulk_write(operations, ordered=False)
+            updated += len(operations)
+            operations = []
+    if operations:
+        await db.users.bulk_write(operations, ordered=False)
+        updated += len(operations)
+    return updated
@@ -0,0 +1,50 @@
+"""In-process change events for caches, audit and other subscribers"""
+import asyncio
+import fnmatch
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ChangeEvent:
+    """One write to an entity, listing only the fields it touched"""
+    type: str  # "<entity>.<action>", e.g. "product.updated"
+    entity_id: str
+    fields: List[str] = field(default_factory=list)
+    changes: Dict[str, Any] = field(default_factory=dict)  # new values of set fields
+    previous: Dict[str, Any] = field(default_factory=dict)  # old values, where the writer knows them
+    removed: List[str] = field(default_factory=list)
+    version: Optional[int] = None
+    actor: Optional[str] = None
+    ts: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+
+    @property
+    def entity(self) -> str:
+        return self.type.split(".", 1)[0]
+
+
+class EventBus:
+    """Dispatches events to handlers subscribed by type pattern ("product.*", "*")"""
+
+    def __init__(self):
+        self._handlers: List[Tuple[str, Callable]] = []
+
+    def subscribe(self, pattern: str, handler: Callable):
+        self._handlers.append((pattern, handler))
+
+    async def publish(self, event: ChangeEvent):
+        """Run matching handlers in subscription order; a failing handler does not stop the rest"""
+        for pattern, handler in self._handlers:
+            if not fnmatch.fnmatchcase(event.type, pattern):
+                continue
+            try:
+                result = handler(event)
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception:
+                logger.exception("Handler for %s failed", event.type)
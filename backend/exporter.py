@@ -0,0 +1,249 @@
+"""Streaming Parquet export of orders, line items and customers"""
+import asyncio
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from ids import new_id
+
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FILES = ("orders", "line_items", "customers")
+
+
+def _schemas():
+    import pyarrow as pa
+
+    ts = pa.timestamp("us", tz="UTC")
+    return {
+        "orders": pa.schema([
+            ("id", pa.string()), ("customer_id", pa.string()), ("status", pa.string()),
+            ("payment_method", pa.string()), ("coupon_code", pa.string()), ("tracking_number", pa.string()),
+            ("line_count", pa.int32()), ("units", pa.int32()),
+            ("subtotal", pa.float64()), ("tax_amount", pa.float64()), ("shipping_cost", pa.float64()),
+            ("discount_amount", pa.float64()), ("total_amount", pa.float64()),
+            ("shipping_city", pa.string()), ("shipping_country", pa.string()),
+            ("created_at", ts), ("updated_at", ts),
+        ]),
+        "line_items": pa.schema([
+            ("order_id", pa.string()), ("line_number", pa.int32()), ("product_id", pa.string()),
+            ("product_name", pa.string()), ("price", pa.float64()), ("quantity", pa.int32()),
+            ("total", pa.float64()), ("order_status", pa.string()), ("order_created_at", ts),
+        ]),
+        "customers": pa.schema([
+            ("id", pa.string()), ("email", pa.string()), ("first_name", pa.string()), ("last_name", pa.string()),
+            ("phone", pa.string()), ("preferred_language", pa.string()), ("segment", pa.string()),
+            ("total_orders", pa.int32()), ("total_spent", pa.float64()),
+            ("created_at", ts), ("updated_at", ts),
+        ]),
+    }
+
+
+def _ts(value) -> Optional[datetime]:
+    if not value:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def _order_rows(orders: List[Dict[str, Any]]):
+    order_rows, item_rows = [], []
+    for order in orders:
+        items = order.get("items", [])
+        shipping = order.get("shipping_address") or {}
+        created_at = _ts(order.get("created_at"))
+        order_rows.append({
+            "id": order["id"],
+            "customer_id": order.get("customer_id"),
+            "status": order.get("status"),
+            "payment_method": order.get("payment_method"),
+            "coupon_code": order.get("coupon_code"),
+            "tracking_number": order.get("tracking_number"),
+            "line_count": len(items),
+            "units": sum(item.get("quantity", 0) for item in items),
+            "subtotal": order.get("subtotal"),
+            "tax_amount": order.get("tax_amount"),
+            "shipping_cost": order.get("shipping_cost"),
+            "discount_amount": order.get("discount_amount"),
+            "total_amount": order.get("total_amount"),
+            "shipping_city": shipping.get("city"),
+            "shipping_country": shipping.get("country"),
+            "created_at": created_at,
+            "updated_at": _ts(order.get("updated_at")),
+        })
+        for line_number, item in enumerate(items, start=1):
+            item_rows.append({
+                "order_id": order["id"],
+                "line_number": line_number,
+                "product_id": item.get("product_id"),
+                "product_name": item.get("product_name"),
+                "price": item.get("price"),
+                "quantity": item.get("quantity"),
+                "total": item.get("total"),
+                "order_status": order.get("status"),
+                "order_created_at": created_at,
+            })
+    return order_rows, item_rows
+
+
+def _customer_rows(users: List[Dict[str, Any]]):
+    return [
+        {
+            "id": user["id"],
+            "email": user.get("email"),
+            "first_name": user.get("first_name"),
+            "last_name": user.get("last_name"),
+            "phone": user.get("phone"),
+            "preferred_language": user.get("preferred_language"),
+            "segment": user.get("segment"),
+            "total_orders": user.get("total_orders", 0),
+            "total_spent": user.get("total_spent", 0.0),
+            "created_at": _ts(user.get("created_at")),
+            "updated_at": _ts(user.get("updated_at")),
+        }
+        for user in users
+    ]
+
+
+def run_export(
+    mongo_url: str,
+    db_name: str,
+    out_dir: str,
+    since: Optional[Dict[str, str]] = None,
+    batch_size: int = 10_000,
+) -> Dict[str, Any]:
+    """Export orders and customers updated after their `since` watermarks to Parquet.
+
+    Runs in a worker process with its own synchronous client. Each cursor
+    batch becomes one row group, so memory stays bounded by batch_size.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    from pymongo import MongoClient
+
+    schemas = _schemas()
+    client = MongoClient(mongo_url)
+    db = client[db_name]
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    writers = {
+        name: pq.ParquetWriter(str(out / f"{name}.parquet"), schemas[name], compression="zstd")
+        for name in EXPORT_FILES
+    }
+    counts = {name: 0 for name in EXPORT_FILES}
+    since = since or {}
+    watermarks = dict(since)
+
+    def write(name, rows):
+        if rows:
+            writers[name].write_table(pa.Table.from_pylist(rows, schema=schemas[name]))
+            counts[name] += len(rows)
+
+    def batches(collection, query):
+        batch = []
+        for doc in collection.find(query, {"_id": 0}).sort("updated_at", 1).batch_size(batch_size):
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def changed_since(name):
+        return {"updated_at": {"$gt": since[name]}} if since.get(name) else {}
+
+    try:
+        # Archived orders never change again, so only full exports need them
+        if not since.get("orders"):
+            for batch in batches(db.orders_archive, {}):
+                order_rows, item_rows = _order_rows(batch)
+                write("orders", order_rows)
+                write("line_items", item_rows)
+        for batch in batches(db.orders, changed_since("orders")):
+            order_rows, item_rows = _order_rows(batch)
+            write("orders", order_rows)
+            write("line_items", item_rows)
+            watermarks["orders"] = batch[-1].get("updated_at") or watermarks.get("orders")
+        for batch in batches(db.users, changed_since("customers")):
+            write("customers", _customer_rows(batch))
+            watermarks["customers"] = batch[-1].get("updated_at") or watermarks.get("customers")
+    finally:
+        for writer in writers.values():
+            writer.close()
+        client.close()
+
+    return {"counts": counts, "watermarks": watermarks}
+
+
+class ExportRunner:
+    """Schedules exports on a dedicated worker process and tracks their state"""
+
+    def __init__(self, db, root: Path, mongo_url: str, db_name: str):
+        self.db = db
+        self.root = Path(root)
+        self.mongo_url = mongo_url
+        self.db_name = db_name
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._tasks = set()
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=1)
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def job_dir(self, job_id: str) -> Path:
+        return self.root / job_id
+
+    async def start(self, full: bool = False) -> Dict[str, Any]:
+        """Queue an export; incremental unless `full` or no watermark exists yet"""
+        state = await self.db.export_state.find_one({"_id": "watermarks"}) or {}
+        since = {} if full else {name: state[name] for name in ("orders", "customers") if state.get(name)}
+        job = {
+            "id": new_id(),
+            "status": "queued",
+            "since": since,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+        }
+        await self.db.export_jobs.insert_one(dict(job))
+        task = asyncio.create_task(self._run(job["id"], since))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    async def _run(self, job_id: str, since: Dict[str, str]):
+        await self.db.export_jobs.update_one({"id": job_id}, {"$set": {"status": "running"}})
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(
+                self.executor, run_export, self.mongo_url, self.db_name, str(self.job_dir(job_id)), since
+            )
+        except Exception as e:
+            logger.exception("Export %s failed", job_id)
+            await self.db.export_jobs.update_one({"id": job_id}, {"$set": {"status": "failed", "error": str(e)}})
+            return
+
+        await self.db.export_jobs.update_one(
+            {"id": job_id},
+            {"$set": {
+                "status": "completed",
+                "counts": result["counts"],
+                "watermarks": result["watermarks"],
+                "files": [f"{name}.parquet" for name in EXPORT_FILES],
+                "completed_at": datetime.now(timezone.utc).isoformat(),
+            }}
+        )
+        # Only advance the watermarks once the files are safely written
+        if result["watermarks"]:
+            await self.db.export_state.update_one(
+                {"_id": "watermarks"}, {"$set": result["watermarks"]}, upsert=True
+            )
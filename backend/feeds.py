@@ -0,0 +1,229 @@
+"""Prebuilt, gzipped sitemaps and shopping feeds for the product catalog"""
+import asyncio
+import gzip
+import logging
+import os
+import re
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from xml.sax.saxutils import escape
+
+from fastapi.concurrency import run_in_threadpool
+from pymongo import DeleteOne, UpdateOne
+
+
+logger = logging.getLogger(__name__)
+
+SITEMAP_URLS_PER_FILE = 50_000  # protocol limit
+FEED_FILE_RE = re.compile(r"^(sitemap-index\.xml|sitemap-products-[a-z]{2}-\d+\.xml\.gz|products-[a-z]{2}\.xml\.gz)$")
+
+SITEMAP_HEAD = '<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+SITEMAP_TAIL = "</urlset>\n"
+FEED_HEAD = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<rss version="2.0" xmlns:g="http://base.google.com/ns/1.0">\n<channel>\n'
+    "<title>{title}</title>\n<link>{link}</link>\n<description>{title}</description>\n"
+)
+FEED_TAIL = "</channel>\n</rss>\n"
+
+
+def product_url(site_url: str, product_id: str, lang: str) -> str:
+    return f"{site_url}/products/{product_id}?lang={lang}"
+
+
+def _price(value: float, currency: str) -> str:
+    return f"{value:.2f} {currency}"
+
+
+def render_entries(product: Dict[str, Any], lang: str, site_url: str, currency: str) -> Optional[Dict[str, str]]:
+    """Sitemap <url> and feed <item> fragments for one product in one language"""
+    translation = product.get("translations", {}).get(lang)
+    if not translation:
+        return None
+    url = escape(product_url(site_url, product["id"], lang))
+    lastmod = str(product.get("updated_at") or product.get("created_at") or "")[:10]
+    sitemap = f"<url><loc>{url}</loc>" + (f"<lastmod>{lastmod}</lastmod>" if lastmod else "") + "</url>\n"
+
+    image_url = product.get("image_url") or ""
+    if image_url.startswith("/"):
+        image_url = f"{site_url}{image_url}"
+    item = [
+        "<item>",
+        f"<g:id>{escape(product.get('sku') or product['id'])}</g:id>",
+        f"<title>{escape(translation.get('name', ''))}</title>",
+        f"<description>{escape(translation.get('short_description') or translation.get('description', ''))}</description>",
+        f"<link>{url}</link>",
+        f"<g:image_link>{escape(image_url)}</g:image_link>",
+        f"<g:availability>{'in_stock' if product.get('in_stock', True) else 'out_of_stock'}</g:availability>",
+        f"<g:price>{_price(product['price'], currency)}</g:price>",
+    ]
+    if product.get("discounted_price") is not None and product["discounted_price"] < product["price"]:
+        item.append(f"<g:sale_price>{_price(product['discounted_price'], currency)}</g:sale_price>")
+    category = getattr(product.get("category"), "value", product.get("category"))
+    if category:
+        item.append(f"<g:product_type>{escape(category)}</g:product_type>")
+    item.append("</item>\n")
+    return {"sitemap": sitemap, "feed": "".join(item)}
+
+
+class _GzipWriter:
+    """Writes a gzip file under a temporary name and moves it into place on close"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.tmp = path.with_name(f".{path.name}.tmp")
+        self._file = gzip.open(self.tmp, "wt", encoding="utf-8", compresslevel=6)
+
+    def write(self, text: str):
+        self._file.write(text)
+
+    def close(self):
+        self._file.close()
+        os.replace(self.tmp, self.path)
+
+
+class FeedBuilder:
+    """Keeps rendered per-product fragments in feed_entries and reassembles the files.
+
+    Only products whose updated_at moved past the last build are rendered
+    again; the files are then rewritten by streaming the stored fragments
+    from a cursor straight into gzip, a batch at a time.
+    """
+
+    def __init__(self, db, root: Path, site_url: str, languages: List[str], currency: str = "USD",
+                 interval: float = 900.0, batch_size: int = 1000):
+        self.db = db
+        self.root = Path(root)
+        self.site_url = site_url.rstrip("/")
+        self.languages = languages
+        self.currency = currency
+        self.interval = interval
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    async def ensure_indexes(self):
+        await self.db.feed_entries.create_index([("lang", 1), ("product_id", 1)])
+        await self.db.feed_entries.create_index("product_id")
+
+    async def _refresh_entries(self, since: Optional[str]) -> int:
+        query = {"updated_at": {"$gt": since}} if since else {}
+        projection = {"_id": 0, "id": 1, "sku": 1, "category": 1, "price": 1, "discounted_price": 1,
+                      "in_stock": 1, "image_url": 1, "translations": 1, "created_at": 1, "updated_at": 1}
+        changed = 0
+        operations = []
+        async for product in self.db.products.find(query, projection).batch_size(self.batch_size):
+            changed += 1
+            for lang in self.languages:
+                entry = render_entries(product, lang, self.site_url, self.currency)
+                key = f"{product['id']}:{lang}"
+                if entry:
+                    operations.append(UpdateOne(
+                        {"_id": key},
+                        {"$set": {"product_id": product["id"], "lang": lang, **entry}},
+                        upsert=True,
+                    ))
+                else:
+                    operations.append(DeleteOne({"_id": key}))
+            if len(operations) >= self.batch_size:
+                await self.db.feed_entries.bulk_write(operations, ordered=False)
+                operations = []
+        if operations:
+            await self.db.feed_entries.bulk_write(operations, ordered=False)
+        return changed
+
+    async def _drop_deleted(self) -> int:
+        """Deleted products leave no updated_at behind, so compare the id sets"""
+        product_ids = set(await self.db.products.distinct("id"))
+        entry_ids = set(await self.db.feed_entries.distinct("product_id"))
+        gone = list(entry_ids - product_ids)
+        if gone:
+            await self.db.feed_entries.delete_many({"product_id": {"$in": gone}})
+        return len(gone)
+
+    async def _write_language(self, lang: str) -> List[str]:
+        """Stream one language's fragments into its feed file and sitemap chunks"""
+        feed = await run_in_threadpool(_GzipWriter, self.root / f"products-{lang}.xml.gz")
+        await run_in_threadpool(feed.write, FEED_HEAD.format(title=f"Elyvra ({lang})", link=escape(self.site_url)))
+        sitemaps: List[str] = []
+        sitemap: Optional[_GzipWriter] = None
+        in_sitemap = 0
+        cursor = self.db.feed_entries.find({"lang": lang}, {"_id": 0, "sitemap": 1, "feed": 1}).sort("product_id", 1)
+        batch = await cursor.to_list(length=self.batch_size)
+        while batch:
+            await run_in_threadpool(feed.write, "".join(entry["feed"] for entry in batch))
+            while batch:
+                if sitemap is None or in_sitemap >= SITEMAP_URLS_PER_FILE:
+                    if sitemap is not None:
+                        await run_in_threadpool(sitemap.write, SITEMAP_TAIL)
+                        await run_in_threadpool(sitemap.close)
+                    name = f"sitemap-products-{lang}-{len(sitemaps) + 1}.xml.gz"
+                    sitemaps.append(name)
+                    sitemap = await run_in_threadpool(_GzipWriter, self.root / name)
+                    await run_in_threadpool(sitemap.write, SITEMAP_HEAD)
+                    in_sitemap = 0
+                room = SITEMAP_URLS_PER_FILE - in_sitemap
+                chunk, batch = batch[:room], batch[room:]
+                await run_in_threadpool(sitemap.write, "".join(entry["sitemap"] for entry in chunk))
+                in_sitemap += len(chunk)
+            batch = await cursor.to_list(length=self.batch_size)
+        await run_in_threadpool(feed.write, FEED_TAIL)
+        await run_in_threadpool(feed.close)
+        if sitemap is not None:
+            await run_in_threadpool(sitemap.write, SITEMAP_TAIL)
+            await run_in_threadpool(sitemap.close)
+        return sitemaps
+
+    def _write_index(self, sitemaps: List[str], lastmod: str):
+        lines = ['<?xml version="1.0" encoding="UTF-8"?>\n<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n']
+        for name in sitemaps:
+            lines.append(f"<sitemap><loc>{escape(self.site_url)}/api/feeds/{name}</loc><lastmod>{lastmod}</lastmod></sitemap>\n")
+        lines.append("</sitemapindex>\n")
+        path = self.root / "sitemap-index.xml"
+        tmp = path.with_name(f".{path.name}.tmp")
+        tmp.write_text("".join(lines), encoding="utf-8")
+        os.replace(tmp, path)
+        # Remove chunks left over from a larger catalog
+        for stale in self.root.glob("sitemap-products-*.xml.gz"):
+            if stale.name not in sitemaps:
+                stale.unlink()
+
+    async def build(self, full: bool = False) -> Dict[str, Any]:
+        async with self._lock:
+            started = datetime.now(timezone.utc).isoformat()
+            state = await self.db.feed_state.find_one({"_id": "products"}) or {}
+            since = None if full or not (self.root / "sitemap-index.xml").exists() else state.get("watermark")
+            if since is None:
+                await self.db.feed_entries.delete_many({})
+            changed = await self._refresh_entries(since)
+            removed = await self._drop_deleted()
+
+            if changed or removed or since is None:
+                await run_in_threadpool(self.root.mkdir, parents=True, exist_ok=True)
+                sitemaps: List[str] = []
+                for lang in self.languages:
+                    sitemaps += await self._write_language(lang)
+                await run_in_threadpool(self._write_index, sitemaps, started[:10])
+            # Products updated while this build ran are picked up by the next one
+            await self.db.feed_state.update_one(
+                {"_id": "products"}, {"$set": {"watermark": started, "built_at": started}}, upsert=True
+            )
+            return {"changed_products": changed, "removed_products": removed, "full": since is None, "built_at": started}
+
+    async def _run(self):
+        while True:
+            try:
+                await self.build()
+            except Exception:
+                logger.exception("Feed build failed")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
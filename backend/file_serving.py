@@ -0,0 +1,139 @@
+"""Conditional and byte-range responses for files stored on local disk"""
+import mmap
+import os
+import re
+from typing import Dict, Optional, Tuple
+
+import anyio
+from starlette.requests import Request
+from starlette.responses import Response
+
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single-range Range header into inclusive (start, end) offsets.
+
+    Returns None when the header is absent or not a single byte range (the
+    whole file is served), and raises ValueError when it cannot be satisfied.
+    """
+    if not header:
+        return None
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if first == "" and last == "":
+        return None
+    if first == "":
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            raise ValueError("empty suffix range")
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError("range not satisfiable")
+    return start, end
+
+
+class RangeFileResponse(Response):
+    """Streams a byte range of a file without loading it into memory"""
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, path: str, start: int, end: int, status_code: int, headers: Dict[str, str], media_type: str):
+        self.path = path
+        self.start = start
+        self.end = end
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type)
+        self.headers["Content-Length"] = str(end - start + 1)
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        remaining = self.end - self.start + 1
+        if scope.get("method") == "HEAD" or remaining <= 0:
+            await send({"type": "http.response.body", "body": b""})
+            return
+        async with await anyio.open_file(self.path, "rb") as f:
+            await f.seek(self.start)
+            while remaining > 0:
+                chunk = await f.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+        if remaining > 0:
+            await send({"type": "http.response.body", "body": b""})
+
+
+def file_response(
+    request: Request,
+    path: str,
+    media_type: str,
+    etag: str,
+    cache_control: str = "public, max-age=31536000, immutable",
+    response_class=RangeFileResponse,
+) -> Response:
+    """Serve a file honouring If-None-Match and single byte-range requests"""
+    size = os.path.getsize(path)
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Accept-Ranges": "bytes"}
+
+    if request.headers.get("if-none-match") in (etag, "*"):
+        return Response(status_code=304, headers=headers)
+
+    # A stale If-Range validator means the client must get the full file
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if if_range and if_range != etag:
+        range_header = None
+
+    try:
+        byte_range = parse_range(range_header, size)
+    except ValueError:
+        headers["Content-Range"] = f"bytes */{size}"
+        return Response(status_code=416, headers=headers)
+
+    if byte_range is None or size == 0:
+        return response_class(path, 0, size - 1, 200, headers, media_type)
+
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return response_class(path, start, end, 206, headers, media_type)
+
+
+class ZeroCopyFileResponse(RangeFileResponse):
+    """Serves a file range without per-chunk read calls on worker threads.
+
+    Servers advertising the ASGI ``http.response.zerocopysend`` extension get
+    the file descriptor and transmit the range with sendfile(2), so the bytes
+    never pass through Python. Elsewhere the file is memory-mapped and sliced
+    straight from the page cache.
+    """
+
+    chunk_size = 1024 * 1024
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        count = self.end - self.start + 1
+        if scope.get("method") == "HEAD" or count <= 0:
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        with open(self.path, "rb") as f:
+            if "http.response.zerocopysend" in scope.get("extensions", {}):
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": f,
+                    "offset": self.start,
+                    "count": count,
+                })
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                position = self.start
+                while position <= self.end:
+                    stop = min(position + self.chunk_size, self.end + 1)
+                    await send({"type": "http.response.body", "body": mapped[position:stop], "more_body": stop <= self.end})
+                    position = stop
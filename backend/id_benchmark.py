@@ -0,0 +1,74 @@
+"""Insert throughput and `id` index size for each id strategy.
+
+    python id_benchmark.py --count 500000
+
+Writes to scratch collections (idbench_*) in the configured database and
+drops them afterwards unless --keep is given.
+"""
+import argparse
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+from bson import Binary, ObjectId
+from dotenv import load_dotenv
+from pymongo import MongoClient
+
+from ids import uuid7
+
+
+STRATEGIES = {
+    "uuid4-string": lambda: str(uuid.uuid4()),
+    "uuid7-string": lambda: str(uuid7()),
+    "uuid7-binary": lambda: Binary(uuid7().bytes, 4),
+    "objectid": ObjectId,
+}
+
+
+def run(db, name, make_id, count, batch_size, payload):
+    collection = db[f"idbench_{name}"]
+    collection.drop()
+    collection.create_index("id", unique=True)
+    started = time.perf_counter()
+    for offset in range(0, count, batch_size):
+        now = datetime.now(timezone.utc).isoformat()
+        collection.insert_many(
+            [{"id": make_id(), "created_at": now, "payload": payload} for _ in range(min(batch_size, count - offset))],
+            ordered=False,
+        )
+    elapsed = time.perf_counter() - started
+    stats = db.command("collStats", collection.name)
+    return {
+        "strategy": name,
+        "inserts_per_second": round(count / elapsed),
+        "id_index_bytes": stats["indexSizes"]["id_1"],
+        "bytes_per_entry": round(stats["indexSizes"]["id_1"] / count, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=200_000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--strategies", nargs="+", choices=sorted(STRATEGIES), default=list(STRATEGIES))
+    parser.add_argument("--keep", action="store_true", help="keep the scratch collections")
+    args = parser.parse_args()
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = MongoClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    payload = "x" * 200  # stand-in for the rest of a small document
+
+    print(f"{'strategy':<14} {'inserts/s':>10} {'id index':>12} {'bytes/id':>9}")
+    for name in args.strategies:
+        result = run(db, name, STRATEGIES[name], args.count, args.batch_size, payload)
+        print(f"{name:<14} {result['inserts_per_second']:>10} {result['id_index_bytes']:>12} {result['bytes_per_entry']:>9}")
+        if not args.keep:
+            db[f"idbench_{name}"].drop()
+    client.close()
+
+
+if __name__ == "__main__":
+    main()
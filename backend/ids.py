@@ -0,0 +1,43 @@
+"""Time-ordered identifiers (UUIDv7, RFC 9562) for new documents"""
+import secrets
+import threading
+import time
+import uuid
+
+
+_lock = threading.Lock()
+_last_ms = 0
+_counter = 0
+
+
+def uuid7() -> uuid.UUID:
+    """48-bit Unix milliseconds, then a 12-bit counter that keeps ids minted
+    in the same millisecond in order, then 62 random bits"""
+    global _last_ms, _counter
+    ms = time.time_ns() // 1_000_000
+    with _lock:
+        if ms <= _last_ms:
+            ms = _last_ms
+            _counter += 1
+            if _counter > 0xFFF:
+                # Counter exhausted: borrow the next millisecond
+                ms += 1
+                _counter = 0
+        else:
+            # Start low in the range so the counter rarely overflows
+            _counter = secrets.randbits(10)
+        _last_ms = ms
+        counter = _counter
+    value = (ms << 80) | (0x7 << 76) | (counter << 64) | (0b10 << 62) | secrets.randbits(62)
+    return uuid.UUID(int=value)
+
+
+def new_id() -> str:
+    """A UUIDv7 in the canonical 36-character form.
+
+    The hex form sorts like the timestamp, so new ids append to the right
+    edge of the `id` index instead of landing on random pages. Older uuid4
+    ids have the same shape and keep working unchanged.
+    """
+    return str(uuid7())
+
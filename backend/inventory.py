@@ -0,0 +1,224 @@
+"""Per-batch supplement inventory with first-expired-first-out allocation"""
+import asyncio
+import logging
+from datetime import datetime, timezone, timedelta
+from typing import Any, Dict, List, Optional
+
+from ids import new_id
+
+
+logger = logging.getLogger(__name__)
+
+
+class InsufficientStock(Exception):
+    def __init__(self, product_id: str, requested: int):
+        super().__init__(f"Insufficient stock for product {product_id}")
+        self.product_id = product_id
+        self.requested = requested
+
+
+def _iso(value: datetime) -> str:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).isoformat()
+
+
+async def ensure_indexes(db):
+    await db.inventory_batches.create_index("id", unique=True)
+    # FEFO allocation walks a product's batches in expiry order
+    await db.inventory_batches.create_index([("product_id", 1), ("expiry_date", 1)])
+    # The sweeper only looks at batches that still hold stock
+    await db.inventory_batches.create_index(
+        "expiry_date", partialFilterExpression={"quantity": {"$gt": 0}}
+    )
+
+
+async def adjust_stock(db, product_id: str, delta: int):
+    """Apply a stock delta to the product total and point it at its current FEFO batch.
+
+    The total is kept with an arithmetic update instead of being summed
+    from the batches on every read.
+    """
+    now = datetime.now(timezone.utc).isoformat()
+    head = await db.inventory_batches.find_one(
+        {"product_id": product_id, "expiry_date": {"$gt": now}, "quantity": {"$gt": 0}},
+        {"_id": 0, "batch_number": 1, "expiry_date": 1, "manufacturing_date": 1},
+        sort=[("expiry_date", 1)],
+    ) or {}
+    await db.products.update_one(
+        {"id": product_id},
+        [
+            {"$set": {"stock_quantity": {"$add": [{"$ifNull": ["$stock_quantity", 0]}, delta]}}},
+            {"$set": {
+                "in_stock": {"$gt": ["$stock_quantity", 0]},
+                # Stored strings could start with "$" and be read as field paths
+                "batch_number": {"$literal": head.get("batch_number")},
+                "expiry_date": {"$literal": head.get("expiry_date")},
+                "manufacturing_date": {"$literal": head.get("manufacturing_date")},
+                "version": {"$add": [{"$ifNull": ["$version", 0]}, 1]},
+                "updated_at": {"$literal": now},
+            }},
+        ],
+    )
+
+
+async def receive_batch(db, product_id: str, batch: Dict[str, Any]) -> Dict[str, Any]:
+    """Record a received batch and add its quantity to the product's stock"""
+    record = {
+        "id": new_id(),
+        "product_id": product_id,
+        "batch_number": batch["batch_number"],
+        "quantity": batch["quantity"],
+        "received_quantity": batch["quantity"],
+        "expired_quantity": 0,
+        "manufacturing_date": _iso(batch["manufacturing_date"]) if batch.get("manufacturing_date") else None,
+        "expiry_date": _iso(batch["expiry_date"]),
+        "storage_conditions": batch.get("storage_conditions"),
+        "status": "active",
+        "created_at": datetime.now(timezone.utc).isoformat(),
+    }
+    await db.inventory_batches.insert_one(dict(record))
+    # The first batch makes the batches the source of truth for stock
+    await db.products.update_one(
+        {"id": product_id, "batch_tracked": {"$ne": True}},
+        {"$set": {"batch_tracked": True, "stock_quantity": 0}},
+    )
+    await adjust_stock(db, product_id, batch["quantity"])
+    return record
+
+
+async def _allocate_product(db, product_id: str, quantity: int, now: str) -> List[Dict[str, Any]]:
+    allocations = []
+    needed = quantity
+    while needed > 0:
+        batch = await db.inventory_batches.find_one(
+            {"product_id": product_id, "expiry_date": {"$gt": now}, "quantity": {"$gt": 0}},
+            {"_id": 0, "id": 1, "batch_number": 1, "quantity": 1, "expiry_date": 1},
+            sort=[("expiry_date", 1)],
+        )
+        if not batch:
+            await release(db, allocations, restock=False)
+            raise InsufficientStock(product_id, quantity)
+        take = min(needed, batch["quantity"])
+        # Conditional decrement: a concurrent checkout may have drained the batch
+        result = await db.inventory_batches.update_one(
+            {"id": batch["id"], "quantity": {"$gte": take}}, {"$inc": {"quantity": -take}}
+        )
+        if result.modified_count:
+            allocations.append({
+                "product_id": product_id,
+                "batch_id": batch["id"],
+                "batch_number": batch["batch_number"],
+                "expiry_date": batch["expiry_date"],
+                "quantity": take,
+            })
+            needed -= take
+    return allocations
+
+
+async def allocate(db, items: List[Dict[str, Any]], tracked_product_ids: set) -> List[Dict[str, Any]]:
+    """Allocate order items to unexpired batches, earliest expiry first.
+
+    Products that are not batch tracked are skipped. On shortage every
+    allocation made so far is returned to its batch and InsufficientStock
+    is raised.
+    """
+    now = datetime.now(timezone.utc).isoformat()
+    allocations: List[Dict[str, Any]] = []
+    try:
+        for item in items:
+            if item["product_id"] in tracked_product_ids:
+                allocations.extend(await _allocate_product(db, item["product_id"], item["quantity"], now))
+    except InsufficientStock:
+        await release(db, allocations, restock=False)
+        raise
+
+    totals: Dict[str, int] = {}
+    for allocation in allocations:
+        totals[allocation["product_id"]] = totals.get(allocation["product_id"], 0) + allocation["quantity"]
+    for product_id, quantity in totals.items():
+        await adjust_stock(db, product_id, -quantity)
+    return allocations
+
+
+async def release(db, allocations: List[Dict[str, Any]], restock: bool = True):
+    """Return allocated quantities to their batches (e.g. when an order is cancelled)"""
+    totals: Dict[str, int] = {}
+    for allocation in allocations:
+        await db.inventory_batches.update_one(
+            {"id": allocation["batch_id"]}, {"$inc": {"quantity": allocation["quantity"]}}
+        )
+        totals[allocation["product_id"]] = totals.get(allocation["product_id"], 0) + allocation["quantity"]
+    if restock:
+        for product_id, quantity in totals.items():
+            await adjust_stock(db, product_id, quantity)
+
+
+async def expire_batches(db, now: Optional[datetime] = None) -> int:
+    """Write off stock in expired batches; returns the number of batches expired"""
+    now_iso = (now or datetime.now(timezone.utc)).isoformat()
+    expired = 0
+    cursor = db.inventory_batches.find(
+        {"expiry_date": {"$lte": now_iso}, "quantity": {"$gt": 0}},
+        {"_id": 0, "id": 1, "product_id": 1, "quantity": 1},
+    )
+    async for batch in cursor:
+        # Only write off what is still there when we get to it
+        result = await db.inventory_batches.update_one(
+            {"id": batch["id"], "quantity": batch["quantity"]},
+            {"$set": {"quantity": 0, "status": "expired"}, "$inc": {"expired_quantity": batch["quantity"]}},
+        )
+        if result.modified_count:
+            await adjust_stock(db, batch["product_id"], -batch["quantity"])
+            expired += 1
+    return expired
+
+
+async def expiring_soon(db, days: int, limit: int = 500) -> List[Dict[str, Any]]:
+    """Batches with stock that expire within `days`, soonest first"""
+    now = datetime.now(timezone.utc)
+    return await db.inventory_batches.find(
+        {
+            "expiry_date": {"$gt": now.isoformat(), "$lte": (now + timedelta(days=days)).isoformat()},
+            "quantity": {"$gt": 0},
+        },
+        {"_id": 0},
+    ).sort("expiry_date", 1).limit(limit).to_list(length=None)
+
+
+class ExpirySweeper:
+    """Periodically writes off expired batches and logs stock nearing expiry"""
+
+    def __init__(self, db, interval: float = 3600.0, warning_days: int = 30, on_expired=None):
+        self.db = db
+        self.interval = interval
+        self.warning_days = warning_days
+        self.on_expired = on_expired
+        self._task: Optional[asyncio.Task] = None
+
+    async def sweep(self) -> Dict[str, int]:
+        expired = await expire_batches(self.db)
+        if expired and self.on_expired:
+            self.on_expired()
+        expiring = await expiring_soon(self.db, self.warning_days)
+        if expired or expiring:
+            logger.info("Inventory sweep: %d batches expired, %d expiring within %d days",
+                        expired, len(expiring), self.warning_days)
+        return {"expired": expired, "expiring_soon": len(expiring)}
+
+    async def _run(self):
+        while True:
+            try:
+                await self.sweep()
+            except Exception:
+                logger.exception("Inventory expiry sweep failed")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
@@ -0,0 +1,189 @@
+"""Product image storage and responsive derivative generation"""
+import asyncio
+import hashlib
+import io
+import os
+import re
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+
+
+# Longest edge (in px) of each derivative; originals are never upscaled
+IMAGE_VARIANTS = {
+    "thumb": 320,
+    "card": 640,
+    "detail": 1280,
+}
+IMAGE_FORMATS = {
+    "webp": "image/webp",
+    "jpg": "image/jpeg",
+}
+ORIGINAL_TYPES = {
+    "image/jpeg": "jpg",
+    "image/png": "png",
+    "image/webp": "webp",
+}
+MAX_UPLOAD_BYTES = 20 * 1024 * 1024
+IMAGE_ID_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+def variant_url(image_id: str, variant: str, fmt: str = "webp") -> str:
+    return f"/api/media/images/{image_id}/{variant}.{fmt}"
+
+
+def render_derivatives(data: bytes, out_dir: str) -> Dict[str, Any]:
+    """Decode an original and write every resized WebP/JPEG derivative.
+
+    Runs in a worker process, so it only takes and returns picklable values.
+    """
+    from PIL import Image, ImageOps
+
+    image = Image.open(io.BytesIO(data))
+    image = ImageOps.exif_transpose(image)
+    has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+    image = image.convert("RGBA" if has_alpha else "RGB")
+    os.makedirs(out_dir, exist_ok=True)
+
+    variants = {}
+    for name, edge in IMAGE_VARIANTS.items():
+        resized = image.copy()
+        resized.thumbnail((edge, edge), Image.LANCZOS)
+        targets = {
+            "webp": (resized, {"format": "WEBP", "quality": 80, "method": 4}),
+            "jpg": (resized.convert("RGB"), {"format": "JPEG", "quality": 82, "optimize": True, "progressive": True}),
+        }
+        for fmt, (frame, options) in targets.items():
+            path = os.path.join(out_dir, f"{name}.{fmt}")
+            # Concurrent renders of one image each get their own temp file
+            fd, tmp_path = tempfile.mkstemp(dir=out_dir, prefix=f".{name}.", suffix=f".{fmt}.tmp")
+            try:
+                with os.fdopen(fd, "wb") as tmp:
+                    frame.save(tmp, **options)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        variants[name] = {"width": resized.width, "height": resized.height}
+
+    return {"width": image.width, "height": image.height, "variants": variants}
+
+
+class ImageStore:
+    """Stores originals on disk or in GridFS and derivatives on local disk"""
+
+    def __init__(self, db, root: Path, storage: str = "disk", max_workers: Optional[int] = None):
+        self.db = db
+        self.root = Path(root)
+        self.storage = storage
+        self.max_workers = max_workers or max(1, (os.cpu_count() or 2) // 2)
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def original_path(self, image_id: str, ext: str) -> Path:
+        return self.root / "originals" / image_id[:2] / f"{image_id}.{ext}"
+
+    def derived_dir(self, image_id: str) -> Path:
+        return self.root / "derived" / image_id[:2] / image_id
+
+    def variant_path(self, image_id: str, variant: str, fmt: str) -> Path:
+        return self.derived_dir(image_id) / f"{variant}.{fmt}"
+
+    async def _write_original(self, image_id: str, ext: str, data: bytes, content_type: str):
+        if self.storage == "gridfs":
+            bucket = AsyncIOMotorGridFSBucket(self.db, bucket_name="images")
+            await bucket.upload_from_stream_with_id(
+                image_id, f"{image_id}.{ext}", data, metadata={"content_type": content_type}
+            )
+            return
+        path = self.original_path(image_id, ext)
+
+        def write():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as tmp:
+                    tmp.write(data)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+
+        await asyncio.to_thread(write)
+
+    async def read_original(self, record: Dict[str, Any]) -> bytes:
+        if record.get("storage") == "gridfs":
+            bucket = AsyncIOMotorGridFSBucket(self.db, bucket_name="images")
+            stream = await bucket.open_download_stream(record["id"])
+            return await stream.read()
+        return await asyncio.to_thread(self.original_path(record["id"], record["ext"]).read_bytes)
+
+    async def _render(self, image_id: str, data: bytes) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, render_derivatives, data, str(self.derived_dir(image_id)))
+
+    async def save(self, data: bytes, content_type: str) -> Dict[str, Any]:
+        """Store an uploaded original and its derivatives, deduplicated by content hash"""
+        if content_type not in ORIGINAL_TYPES:
+            raise ValueError(f"Unsupported image type: {content_type}")
+        if len(data) > MAX_UPLOAD_BYTES:
+            raise ValueError("Image is too large")
+
+        image_id = hashlib.sha256(data).hexdigest()
+        existing = await self.db.images.find_one({"id": image_id}, {"_id": 0})
+        if existing:
+            return existing
+
+        try:
+            rendered = await self._render(image_id, data)
+        except Exception as e:
+            raise ValueError(f"Could not decode image: {e}")
+
+        ext = ORIGINAL_TYPES[content_type]
+        await self._write_original(image_id, ext, data, content_type)
+        record = {
+            "id": image_id,
+            "content_type": content_type,
+            "ext": ext,
+            "size": len(data),
+            "storage": self.storage,
+            "width": rendered["width"],
+            "height": rendered["height"],
+            "variants": rendered["variants"],
+            "created_at": datetime.now(timezone.utc).isoformat(),
+        }
+        await self.db.images.update_one({"id": image_id}, {"$setOnInsert": record}, upsert=True)
+        return record
+
+    async def ensure_variant(self, image_id: str, variant: str, fmt: str) -> Optional[Path]:
+        """Path of a derivative, regenerating it from the original if it is missing locally"""
+        path = self.variant_path(image_id, variant, fmt)
+        if path.exists():
+            return path
+        record = await self.db.images.find_one({"id": image_id}, {"_id": 0})
+        if not record:
+            return None
+        await self._render(image_id, await self.read_original(record))
+        return path if path.exists() else None
+
+
+def image_urls(record: Dict[str, Any]) -> Dict[str, Any]:
+    """Public URLs of every derivative of an image record"""
+    return {
+        name: {fmt: variant_url(record["id"], name, fmt) for fmt in IMAGE_FORMATS}
+        for name in IMAGE_VARIANTS
+    }
@@ -0,0 +1,346 @@
+"""Order status emails: an outbox written with the change and a batched SMTP dispatcher"""
+import asyncio
+import logging
+import queue
+import smtplib
+import time
+from datetime import datetime, timezone, timedelta
+from email.message import EmailMessage
+from functools import lru_cache
+from string import Template
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_STATUSES = ("confirmed", "shipped", "delivered", "cancelled", "refunded")
+DEFAULT_LANGUAGE = "en"
+
+# (subject, body) per status and language; $name, $order, $total, $tracking are filled in per message
+TEMPLATES: Dict[str, Dict[str, Tuple[str, str]]] = {
+    "confirmed": {
+        "en": ("Order $order confirmed", "Hi $name,\n\nWe have confirmed your order $order ($total).\n"),
+        "ar": ("تم تأكيد الطلب $order", "مرحباً $name،\n\nتم تأكيد طلبك $order ($total).\n"),
+        "fr": ("Commande $order confirmée", "Bonjour $name,\n\nVotre commande $order ($total) est confirmée.\n"),
+    },
+    "shipped": {
+        "en": ("Order $order shipped", "Hi $name,\n\nYour order $order is on its way.\nTracking number: $tracking\n"),
+        "ar": ("تم شحن الطلب $order", "مرحباً $name،\n\nطلبك $order في الطريق إليك.\nرقم التتبع: $tracking\n"),
+        "fr": ("Commande $order expédiée", "Bonjour $name,\n\nVotre commande $order est en route.\nNuméro de suivi : $tracking\n"),
+    },
+    "delivered": {
+        "en": ("Order $order delivered", "Hi $name,\n\nYour order $order has been delivered. Enjoy!\n"),
+        "ar": ("تم توصيل الطلب $order", "مرحباً $name،\n\nتم توصيل طلبك $order.\n"),
+        "fr": ("Commande $order livrée", "Bonjour $name,\n\nVotre commande $order a été livrée.\n"),
+    },
+    "cancelled": {
+        "en": ("Order $order cancelled", "Hi $name,\n\nYour order $order has been cancelled.\n"),
+        "ar": ("تم إلغاء الطلب $order", "مرحباً $name،\n\nتم إلغاء طلبك $order.\n"),
+        "fr": ("Commande $order annulée", "Bonjour $name,\n\nVotre commande $order a été annulée.\n"),
+    },
+    "refunded": {
+        "en": ("Order $order refunded", "Hi $name,\n\nWe have refunded $total for order $order.\n"),
+        "ar": ("تم استرداد مبلغ الطلب $order", "مرحباً $name،\n\nتم استرداد $total للطلب $order.\n"),
+        "fr": ("Commande $order remboursée", "Bonjour $name,\n\nNous avons remboursé $total pour la commande $order.\n"),
+    },
+}
+
+
+@lru_cache(maxsize=None)
+def template_for(status: str, language: str) -> Tuple[Template, Template]:
+    """Compiled subject and body for a status, falling back to English"""
+    by_language = TEMPLATES[status]
+    subject, body = by_language.get(language) or by_language[DEFAULT_LANGUAGE]
+    return Template(subject), Template(body)
+
+
+def render(status: str, language: str, order: Dict[str, Any], customer: Dict[str, Any]) -> Tuple[str, str]:
+    subject, body = template_for(status, language)
+    context = {
+        "name": customer.get("first_name", ""),
+        # The leading digits of a UUIDv7 are its timestamp; the tail tells orders apart
+        "order": order["id"][-12:].upper(),
+        "total": f"{order.get('total_amount', 0.0):.2f}",
+        "tracking": order.get("tracking_number") or "-",
+    }
+    return subject.safe_substitute(context), body.safe_substitute(context)
+
+
+def outbox_messages(changes: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+    """Outbox documents for (order_id, new_status) pairs that customers hear about.
+
+    The _id makes each status email per order unique, so a retried request
+    or a status set twice queues it only once.
+    """
+    now = datetime.now(timezone.utc).isoformat()
+    return [
+        {
+            "_id": f"{order_id}:{status}",
+            "order_id": order_id,
+            "status": status,
+            "state": "pending",
+            "attempts": 0,
+            "next_attempt_at": now,
+            "created_at": now,
+        }
+        for order_id, status in changes
+        if status in NOTIFY_STATUSES
+    ]
+
+
+async def enqueue(db, changes: List[Tuple[str, str]]) -> int:
+    messages = outbox_messages(changes)
+    if not messages:
+        return 0
+    try:
+        result = await db.notification_outbox.insert_many(messages, ordered=False)
+        return len(result.inserted_ids)
+    except BulkWriteError as e:
+        # Duplicate keys are emails already queued for that status
+        return e.details["nInserted"]
+
+
+class SMTPPool:
+    """A fixed set of reusable SMTP connections, handed out to worker threads"""
+
+    def __init__(self, host: str, port: int, size: int = 2, username: Optional[str] = None,
+                 password: Optional[str] = None, starttls: bool = False, timeout: float = 30.0):
+        self.host = host
+        self.port = port
+        self.size = size
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self._idle: "queue.LifoQueue[smtplib.SMTP]" = queue.LifoQueue()
+
+    def _connect(self) -> smtplib.SMTP:
+        connection = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            connection.starttls()
+        if self.username:
+            connection.login(self.username, self.password or "")
+        return connection
+
+    def _acquire(self) -> smtplib.SMTP:
+        try:
+            connection = self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+        try:
+            if connection.noop()[0] == 250:
+                return connection
+        except (smtplib.SMTPException, OSError):
+            pass
+        self._discard(connection)
+        return self._connect()
+
+    def _discard(self, connection: smtplib.SMTP):
+        try:
+            connection.quit()
+        except (smtplib.SMTPException, OSError):
+            connection.close()
+
+    def send_many(self, messages: List[Tuple[str, EmailMessage]]) -> Dict[str, Optional[str]]:
+        """Send over one pooled connection; returns an error (or None) per outbox id"""
+        results: Dict[str, Optional[str]] = {}
+        try:
+            connection = self._acquire()
+        except (smtplib.SMTPException, OSError) as e:
+            return {message_id: f"connect: {e}" for message_id, _ in messages}
+        healthy = True
+        for message_id, message in messages:
+            if not healthy:
+                results[message_id] = "connection lost"
+                continue
+            try:
+                connection.send_message(message)
+                results[message_id] = None
+            except smtplib.SMTPRecipientsRefused as e:
+                results[message_id] = f"refused: {e.recipients}"
+            except smtplib.SMTPResponseException as e:
+                # 5xx rejects this message for good; 421 means the server is closing the connection
+                results[message_id] = f"{'rejected' if e.smtp_code >= 500 else 'deferred'}: {e.smtp_code}"
+                healthy = e.smtp_code != 421
+            except (smtplib.SMTPException, OSError) as e:
+                results[message_id] = str(e) or e.__class__.__name__
+                healthy = False
+        if healthy and self._idle.qsize() < self.size:
+            self._idle.put(connection)
+        else:
+            self._discard(connection)
+        return results
+
+    def close(self):
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+
+class NotificationDispatcher:
+    """Drains the outbox in batches, spreading each batch over the SMTP pool.
+
+    Messages are claimed with a lease, so a dispatcher that dies mid-batch
+    only delays them. Failures are retried with exponential backoff until
+    max_attempts, after which the message is marked failed.
+    """
+
+    def __init__(self, db, pool: SMTPPool, sender: str, batch_size: int = 100, interval: float = 5.0,
+                 max_attempts: int = 6, retry_base: float = 30.0, lease: float = 300.0):
+        self.db = db
+        self.pool = pool
+        self.sender = sender
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.lease = lease
+        self.metrics = {"sent": 0, "failed": 0, "retried": 0, "batches": 0, "send_seconds": 0.0}
+        self._task: Optional[asyncio.Task] = None
+        self._wake = asyncio.Event()
+
+    async def ensure_indexes(self):
+        await self.db.notification_outbox.create_index([("state", 1), ("next_attempt_at", 1)])
+
+    def notify(self):
+        """Wake the dispatcher instead of waiting for the next poll"""
+        self._wake.set()
+
+    async def _claim(self) -> List[Dict[str, Any]]:
+        now = datetime.now(timezone.utc)
+        due = {"$or": [
+            {"state": "pending", "next_attempt_at": {"$lte": now.isoformat()}},
+            {"state": "sending", "leased_until": {"$lt": now.isoformat()}},
+        ]}
+        candidates = await self.db.notification_outbox.find(due, {"_id": 1}).sort("next_attempt_at", 1) \
+            .limit(self.batch_size).to_list(length=None)
+        if not candidates:
+            return []
+        token = f"{id(self)}:{time.monotonic_ns()}"
+        await self.db.notification_outbox.update_many(
+            {"_id": {"$in": [doc["_id"] for doc in candidates]}, **due},
+            {"$set": {"state": "sending", "lease": token,
+                      "leased_until": (now + timedelta(seconds=self.lease)).isoformat()}},
+        )
+        return await self.db.notification_outbox.find({"lease": token, "state": "sending"}).to_list(length=None)
+
+    async def _build(self, claimed: List[Dict[str, Any]]):
+        order_ids = list({message["order_id"] for message in claimed})
+        orders = {
+            order["id"]: order for order in await self.db.orders.find(
+                {"id": {"$in": order_ids}},
+                {"_id": 0, "id": 1, "customer_id": 1, "total_amount": 1, "tracking_number": 1},
+            ).to_list(length=None)
+        }
+        customer_ids = list({order["customer_id"] for order in orders.values()})
+        customers = {
+            user["id"]: user for user in await self.db.users.find(
+                {"id": {"$in": customer_ids}},
+                {"_id": 0, "id": 1, "email": 1, "first_name": 1, "preferred_language": 1},
+            ).to_list(length=None)
+        }
+        ready, dropped = [], []
+        for message in claimed:
+            order = orders.get(message["order_id"])
+            customer = customers.get(order["customer_id"]) if order else None
+            if not customer or not customer.get("email"):
+                dropped.append(message["_id"])
+                continue
+            language = getattr(customer.get("preferred_language"), "value", customer.get("preferred_language"))
+            subject, body = render(message["status"], language or DEFAULT_LANGUAGE, order, customer)
+            email = EmailMessage()
+            email["From"] = self.sender
+            email["To"] = customer["email"]
+            email["Subject"] = subject
+            email.set_content(body)
+            ready.append((message["_id"], email))
+        return ready, dropped
+
+    async def dispatch_batch(self) -> int:
+        claimed = await self._claim()
+        if not claimed:
+            return 0
+        ready, dropped = await self._build(claimed)
+
+        started = time.perf_counter()
+        connections = max(1, min(self.pool.size, len(ready)))
+        chunks = [ready[i::connections] for i in range(connections)]
+        results: Dict[str, Optional[str]] = {}
+        for part in await asyncio.gather(*(run_in_threadpool(self.pool.send_many, chunk) for chunk in chunks if chunk)):
+            results.update(part)
+        self.metrics["send_seconds"] += time.perf_counter() - started
+        self.metrics["batches"] += 1
+
+        now = datetime.now(timezone.utc)
+        attempts = {message["_id"]: message.get("attempts", 0) + 1 for message in claimed}
+        operations = [
+            UpdateOne({"_id": message_id}, {"$set": {"state": "skipped", "error": "no recipient"},
+                                            "$unset": {"lease": "", "leased_until": ""}})
+            for message_id in dropped
+        ]
+        for message_id, error in results.items():
+            if error is None:
+                self.metrics["sent"] += 1
+                update = {"$set": {"state": "sent", "sent_at": now.isoformat(), "attempts": attempts[message_id]}}
+            elif attempts[message_id] >= self.max_attempts or error.startswith(("refused", "rejected")):
+                self.metrics["failed"] += 1
+                update = {"$set": {"state": "failed", "error": error, "attempts": attempts[message_id]}}
+            else:
+                self.metrics["retried"] += 1
+                delay = self.retry_base * 2 ** (attempts[message_id] - 1)
+                update = {"$set": {"state": "pending", "error": error, "attempts": attempts[message_id],
+                                   "next_attempt_at": (now + timedelta(seconds=delay)).isoformat()}}
+            update["$unset"] = {"lease": "", "leased_until": ""}
+            operations.append(UpdateOne({"_id": message_id}, update))
+        if operations:
+            await self.db.notification_outbox.bulk_write(operations, ordered=False)
+        return len(results)
+
+    async def run_once(self) -> int:
+        total = 0
+        while True:
+            handled = await self.dispatch_batch()
+            total += handled
+            if handled < self.batch_size:
+                return total
+
+    async def status(self) -> Dict[str, Any]:
+        counts = await self.db.notification_outbox.aggregate([
+            {"$group": {"_id": "$state", "count": {"$sum": 1}}}
+        ]).to_list(length=None)
+        cache = template_for.cache_info()
+        send_seconds = self.metrics["send_seconds"]
+        return {
+            **self.metrics,
+            "messages_per_second": round(self.metrics["sent"] / send_seconds, 1) if send_seconds else None,
+            "outbox": {item["_id"]: item["count"] for item in counts},
+            "template_cache": {"hits": cache.hits, "misses": cache.misses, "size": cache.currsize},
+        }
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("Notification dispatch failed")
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await run_in_threadpool(self.pool.close)
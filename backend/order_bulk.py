@@ -0,0 +1,169 @@
+"""Bulk order status and tracking updates for warehouse and carrier feeds"""
+import codecs
+import csv
+import io
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from pymongo import UpdateOne
+
+import inventory
+import sales_rollups
+
+
+# Allowed status moves; setting the current status again is always allowed
+ORDER_TRANSITIONS = {
+    "pending_payment": {"processing", "confirmed", "cancelled"},
+    "processing": {"confirmed", "shipped", "cancelled"},
+    "confirmed": {"processing", "shipped", "cancelled"},
+    "shipped": {"delivered", "refunded"},
+    "delivered": {"refunded"},
+    "cancelled": set(),
+    "refunded": set(),
+}
+
+CSV_COLUMNS = ("order_id", "status", "tracking_number")
+# Fields needed to validate a row and to apply its side effects
+ORDER_PROJECTION = {
+    "_id": 0, "id": 1, "status": 1, "created_at": 1, "total_amount": 1, "discount_amount": 1,
+    "payment_method": 1, "items.product_id": 1, "items.quantity": 1, "items.total": 1, "batch_allocations": 1,
+}
+
+
+def _plain(value):
+    return getattr(value, "value", value)
+
+
+def can_transition(current: Optional[str], new: Optional[str]) -> bool:
+    current, new = _plain(current), _plain(new)
+    return new is None or new == current or new in ORDER_TRANSITIONS.get(current, set())
+
+
+def _result(order_id, ok: bool, status=None, error: Optional[str] = None) -> Dict[str, Any]:
+    return {"order_id": order_id, "ok": ok, "status": _plain(status), "error": error}
+
+
+async def apply_updates(db, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Validate and apply a batch of {order_id, status, tracking_number} rows.
+
+    Orders are read with one $in query and written with one unordered
+    bulk_write. Each write is guarded on the status it was validated
+    against, so a concurrent change makes that row fail instead of
+    skipping a transition check. Results come back in input order.
+    """
+    ids = list({row["order_id"] for row in rows})
+    orders = {
+        order["id"]: order
+        for order in await db.orders.find({"id": {"$in": ids}}, ORDER_PROJECTION).to_list(length=None)
+    }
+    now = datetime.now(timezone.utc).isoformat()
+
+    results: List[Dict[str, Any]] = []
+    operations: List[UpdateOne] = []
+    pending: Dict[str, Dict[str, Any]] = {}
+    seen = set()
+    for row in rows:
+        order_id, status = row["order_id"], _plain(row.get("status"))
+        order = orders.get(order_id)
+        if order_id in seen:
+            results.append(_result(order_id, False, error="duplicate row"))
+            continue
+        seen.add(order_id)
+        if not order:
+            results.append(_result(order_id, False, error="order not found"))
+            continue
+        current = _plain(order.get("status"))
+        if not can_transition(current, status):
+            results.append(_result(order_id, False, current, f"cannot move from {current} to {status}"))
+            continue
+
+        update = {"updated_at": now}
+        if status:
+            update["status"] = status
+        if row.get("tracking_number"):
+            update["tracking_number"] = row["tracking_number"]
+        operations.append(UpdateOne(
+            {"id": order_id, "status": order.get("status")}, {"$set": update, "$inc": {"version": 1}}
+        ))
+        pending[order_id] = {"order": order, "status": status or order.get("status")}
+        results.append({**_result(order_id, True, status or order.get("status")), "previous_status": current})
+
+    if not operations:
+        return results
+
+    write = await db.orders.bulk_write(operations, ordered=False)
+    if write.matched_count < len(operations):
+        # Some guards missed; only rows stamped with this batch's updated_at were applied
+        stamped = await db.orders.find(
+            {"id": {"$in": list(pending)}, "updated_at": now}, {"_id": 0, "id": 1}
+        ).to_list(length=None)
+        applied = {order["id"] for order in stamped}
+        for result in results:
+            if result["ok"] and result["order_id"] not in applied:
+                result.update(ok=False, error="order changed concurrently")
+                pending.pop(result["order_id"], None)
+
+    await _apply_side_effects(db, pending)
+    return results
+
+
+async def _apply_side_effects(db, pending: Dict[str, Dict[str, Any]]):
+    voided, restored, released = [], [], []
+    for change in pending.values():
+        order, old, new = change["order"], change["order"].get("status"), change["status"]
+        was_counted, is_counted = sales_rollups.counts_as_sale(old), sales_rollups.counts_as_sale(new)
+        if was_counted and not is_counted:
+            voided.append(order)
+        elif is_counted and not was_counted:
+            restored.append(order)
+        if new == "cancelled" and old != "cancelled":
+            released.extend(order.get("batch_allocations") or [])
+    await sales_rollups.record_orders(db, voided, -1)
+    await sales_rollups.record_orders(db, restored, 1)
+    if released:
+        await inventory.release(db, released)
+
+
+async def csv_rows(chunks: AsyncIterator[bytes]) -> AsyncIterator[Dict[str, Any]]:
+    """Parse an order_id,status,tracking_number CSV as it arrives.
+
+    A header row is optional; blank status or tracking cells leave that
+    field unchanged.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    buffer = ""
+    first = True
+
+    def parse(lines):
+        nonlocal first
+        for record in csv.reader(lines):
+            if not record or not record[0].strip():
+                continue
+            if first:
+                first = False
+                if record[0].strip().lower() == "order_id":
+                    continue
+            cells = [cell.strip() for cell in record] + [""] * len(CSV_COLUMNS)
+            yield {"order_id": cells[0], "status": cells[1] or None, "tracking_number": cells[2] or None}
+
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        if "\n" not in buffer:
+            continue
+        complete, buffer = buffer.rsplit("\n", 1)
+        for row in parse(complete.split("\n")):
+            yield row
+    buffer += decoder.decode(b"", final=True)
+    for row in parse(buffer.split("\n")):
+        yield row
+
+
+def csv_results(results: List[Dict[str, Any]], header: bool = False) -> str:
+    out = io.StringIO()
+    writer = csv.writer(out)
+    if header:
+        writer.writerow(["order_id", "ok", "status", "error"])
+    for result in results:
+        writer.writerow([result["order_id"], "true" if result["ok"] else "false",
+                         result["status"] or "", result["error"] or ""])
+    return out.getvalue()
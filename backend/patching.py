@@ -0,0 +1,70 @@
+"""Partial document updates expressed as dotted field paths"""
+import copy
+from typing import Any, Dict, Iterable, List, Tuple
+
+
+MISSING = object()
+
+
+def flatten(patch: Dict[str, Any], prefix: str = "") -> Dict[str, Any]:
+    """Nested objects and dotted keys alike become {"a.b.c": value} leaves.
+
+    Lists are replaced whole. Raises ValueError for operator-like or empty
+    path segments, for paths that overlap (e.g. "a" and "a.b") and for a
+    path given twice (e.g. {"a": {"b": 1}, "a.b": 2}).
+    """
+    paths: Dict[str, Any] = {}
+    for key, value in patch.items():
+        if not isinstance(key, str) or any(not part or part.startswith("$") for part in key.split(".")):
+            raise ValueError(f"Invalid field path: {key!r}")
+        path = f"{prefix}{key}"
+        leaves = flatten(value, f"{path}.") if isinstance(value, dict) and value else {path: value}
+        for leaf, leaf_value in leaves.items():
+            if leaf in paths:
+                raise ValueError(f"Field path given twice: {leaf}")
+            paths[leaf] = leaf_value
+
+    ordered = sorted(paths)
+    for current, following in zip(ordered, ordered[1:]):
+        if following.startswith(current + "."):
+            raise ValueError(f"Field paths overlap: {current} and {following}")
+    return paths
+
+
+def get_path(doc: Dict[str, Any], path: str) -> Any:
+    for part in path.split("."):
+        if not isinstance(doc, dict) or part not in doc:
+            return MISSING
+        doc = doc[part]
+    return doc
+
+
+def apply(doc: Dict[str, Any], paths: Dict[str, Any]) -> Dict[str, Any]:
+    """A copy of doc with each path set (or removed when the value is None)"""
+    result = copy.deepcopy(doc)
+    for path, value in paths.items():
+        *parents, leaf = path.split(".")
+        target = result
+        for part in parents:
+            if not isinstance(target.get(part), dict):
+                target[part] = {}
+            target = target[part]
+        if value is None:
+            target.pop(leaf, None)
+        else:
+            target[leaf] = value
+    return result
+
+
+def diff(current: Dict[str, Any], updated: Dict[str, Any], paths: Iterable[str]) -> Tuple[Dict[str, Any], List[str]]:
+    """Minimal $set and $unset for the given paths, skipping values that did not change"""
+    to_set: Dict[str, Any] = {}
+    to_unset: List[str] = []
+    for path in paths:
+        old, new = get_path(current, path), get_path(updated, path)
+        if new is MISSING or new is None:
+            if old is not MISSING:
+                to_unset.append(path)
+        elif old != new:
+            to_set[path] = new
+    return to_set, to_unset
@@ -0,0 +1,128 @@
+"""Cancels orders whose payment never arrived and undoes what placing them did"""
+import asyncio
+import logging
+from datetime import datetime, timezone, timedelta
+from typing import Any, Dict, List, Optional
+
+from pymongo import UpdateOne
+
+import inventory
+
+
+logger = logging.getLogger(__name__)
+
+PENDING_STATUS = "pending_payment"
+EXPIRED_REASON = "payment_expired"
+PROJECTION = {"_id": 0, "id": 1, "customer_id": 1, "total_amount": 1, "coupon_code": 1,
+              "batch_allocations": 1, "created_at": 1, "version": 1}
+
+
+class PendingPaymentSweeper:
+    """Periodically cancels pending_payment orders older than a cutoff.
+
+    Candidates come oldest first from the (status, created_at) index. Each
+    batch is cancelled with one write guarded on the status still being
+    pending_payment, so an order paid in the meantime is left alone. For the
+    orders that were cancelled, reserved stock goes back to its batches and
+    the customer totals and coupon usage counted at checkout are taken back.
+    Pending orders never entered the sales rollups, so those need nothing.
+    """
+
+    def __init__(self, db, max_age_minutes: int = 1440, batch_size: int = 500, interval: float = 300.0,
+                 on_cancelled=None):
+        self.db = db
+        self.max_age_minutes = max_age_minutes
+        self.batch_size = batch_size
+        self.interval = interval
+        self.on_cancelled = on_cancelled
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    async def ensure_indexes(self):
+        await self.db.orders.create_index([("status", 1), ("created_at", 1)])
+
+    async def cancel_batch(self, cutoff: str) -> List[Dict[str, Any]]:
+        orders = await self.db.orders.find(
+            {"status": PENDING_STATUS, "created_at": {"$lt": cutoff}}, PROJECTION
+        ).sort("created_at", 1).limit(self.batch_size).to_list(length=None)
+        if not orders:
+            return []
+
+        now = datetime.now(timezone.utc).isoformat()
+        ids = [order["id"] for order in orders]
+        await self.db.orders.update_many(
+            {"id": {"$in": ids}, "status": PENDING_STATUS},
+            {"$set": {"status": "cancelled", "cancel_reason": EXPIRED_REASON, "updated_at": now},
+             "$inc": {"version": 1}},
+        )
+        # Only orders stamped by this write were cancelled here
+        stamped = {
+            order["id"] for order in await self.db.orders.find(
+                {"id": {"$in": ids}, "updated_at": now, "cancel_reason": EXPIRED_REASON}, {"_id": 0, "id": 1}
+            ).to_list(length=None)
+        }
+        cancelled = [order for order in orders if order["id"] in stamped]
+        if cancelled:
+            await self._reverse(cancelled, now)
+        return cancelled
+
+    async def _reverse(self, orders: List[Dict[str, Any]], now: str):
+        allocations = [allocation for order in orders for allocation in order.get("batch_allocations") or []]
+        if allocations:
+            await inventory.release(self.db, allocations)
+
+        customers: Dict[str, Dict[str, float]] = {}
+        coupons: Dict[str, int] = {}
+        for order in orders:
+            totals = customers.setdefault(order["customer_id"], {"total_orders": 0, "total_spent": 0.0})
+            totals["total_orders"] -= 1
+            totals["total_spent"] -= order.get("total_amount", 0.0)
+            if order.get("coupon_code"):
+                coupons[order["coupon_code"]] = coupons.get(order["coupon_code"], 0) + 1
+        await self.db.users.bulk_write([
+            UpdateOne({"id": customer_id}, {"$inc": inc, "$set": {"updated_at": now}})
+            for customer_id, inc in customers.items()
+        ], ordered=False)
+        if coupons:
+            # Coupons used before usage was counted must not go below zero
+            await self.db.coupons.bulk_write([
+                UpdateOne({"code": code}, [{"$set": {"current_usage_count": {
+                    "$max": [0, {"$subtract": [{"$ifNull": ["$current_usage_count", 0]}, count]}]
+                }}}])
+                for code, count in coupons.items()
+            ], ordered=False)
+
+    async def run_once(self) -> int:
+        """Cancel everything past the cutoff, one batch at a time"""
+        cutoff = (datetime.now(timezone.utc) - timedelta(minutes=self.max_age_minutes)).isoformat()
+        total = 0
+        async with self._lock:
+            while True:
+                cancelled = await self.cancel_batch(cutoff)
+                total += len(cancelled)
+                if cancelled and self.on_cancelled:
+                    result = self.on_cancelled(cancelled)
+                    if asyncio.iscoroutine(result):
+                        await result
+                if len(cancelled) < self.batch_size:
+                    break
+        if total:
+            logger.info("Cancelled %d orders still pending payment since before %s", total, cutoff)
+        return total
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("Pending payment sweep failed")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
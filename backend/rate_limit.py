@@ -0,0 +1,273 @@
+"""Token-bucket rate limiting and load shedding for the Elyvra API"""
+import asyncio
+import ipaddress
+import logging
+import math
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timezone, timedelta
+from typing import Iterable, List, Optional, Tuple
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from pymongo.monitoring import ConnectionPoolListener
+from starlette.responses import JSONResponse
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RateLimitRule:
+    """Limit applied to requests matching a method and path pattern"""
+    name: str
+    method: str
+    pattern: str
+    capacity: float  # burst size
+    refill_per_second: float
+    critical: bool = False  # critical routes are never shed under load
+
+    def __post_init__(self):
+        self._regex = re.compile(self.pattern)
+
+    def matches(self, method: str, path: str) -> bool:
+        return (self.method == "*" or self.method == method) and bool(self._regex.match(path))
+
+
+# Default rules, evaluated in order; the first match wins
+DEFAULT_RULES = [
+    RateLimitRule("create_order", "POST", r"^/api/orders/?$", capacity=20, refill_per_second=1.0, critical=True),
+    RateLimitRule("admin_login", "POST", r"^/api/admin/login/?$", capacity=5, refill_per_second=5 / 60),
+    RateLimitRule("create_cart", "POST", r"^/api/cart/?$", capacity=10, refill_per_second=10 / 60),
+    RateLimitRule("add_to_cart", "POST", r"^/api/cart/[^/]+/items/?$", capacity=30, refill_per_second=0.5),
+    RateLimitRule("products_batch", "POST", r"^/api/products/batch/?$", capacity=30, refill_per_second=1.0),
+    RateLimitRule("products", "GET", r"^/api/products", capacity=60, refill_per_second=2.0),
+]
+
+
+class MemoryBucketStore:
+    """Per-process token buckets kept in a bounded LRU map"""
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    async def take(self, key: str, rule: RateLimitRule) -> Tuple[bool, float]:
+        """Consume one token; returns (allowed, seconds until a token is available)"""
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(key, (rule.capacity, now))
+        tokens = min(rule.capacity, tokens + (now - updated) * rule.refill_per_second)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return allowed, 0.0 if allowed else (1 - tokens) / rule.refill_per_second
+
+
+class MongoBucketStore:
+    """Token buckets shared between workers through a MongoDB collection.
+
+    Each take is a single atomic pipeline update, so concurrent workers never
+    double-spend a token. Idle buckets are removed by a TTL index on expires_at.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def take(self, key: str, rule: RateLimitRule) -> Tuple[bool, float]:
+        now = time.time()
+        idle_seconds = rule.capacity / rule.refill_per_second
+        refilled = {"$min": [
+            rule.capacity,
+            {"$add": [
+                {"$ifNull": ["$tokens", rule.capacity]},
+                {"$multiply": [{"$subtract": [now, {"$ifNull": ["$ts", now]}]}, rule.refill_per_second]},
+            ]},
+        ]}
+        pipeline = [
+            {"$set": {"tokens": refilled, "ts": now}},
+            {"$set": {"allowed": {"$gte": ["$tokens", 1]}}},
+            {"$set": {
+                "tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", 1]}, "$tokens"]},
+                "expires_at": datetime.now(timezone.utc) + timedelta(seconds=idle_seconds),
+            }},
+        ]
+        try:
+            bucket = await self.collection.find_one_and_update(
+                {"_id": key}, pipeline, upsert=True, return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # Another worker created the bucket between our match and insert; it exists now
+            bucket = await self.collection.find_one_and_update(
+                {"_id": key}, pipeline, upsert=True, return_document=ReturnDocument.AFTER
+            )
+        if bucket["allowed"]:
+            return True, 0.0
+        return False, (1 - bucket["tokens"]) / rule.refill_per_second
+
+
+class LoadMonitor(ConnectionPoolListener):
+    """Tracks event-loop lag and MongoDB connection pool wait time.
+
+    Registered on the Motor client as a pool listener. Checkout events are
+    delivered on the executor thread that performs the checkout, so the start
+    time is kept in thread-local storage and paired with the checked-out event.
+    """
+
+    def __init__(self, interval: float = 0.25, smoothing: float = 0.2):
+        self.interval = interval
+        self.smoothing = smoothing
+        self.loop_lag = 0.0
+        self.pool_wait = 0.0
+        self._local = threading.local()
+        self._last_checkout = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def _record_pool_wait(self, wait: float):
+        self._last_checkout = time.monotonic()
+        self.pool_wait += self.smoothing * (wait - self.pool_wait)
+
+    # ConnectionPoolListener hooks
+    def connection_check_out_started(self, event):
+        self._local.started = time.monotonic()
+
+    def connection_checked_out(self, event):
+        started = getattr(self._local, "started", None)
+        if started is not None:
+            self._record_pool_wait(time.monotonic() - started)
+            self._local.started = None
+
+    def connection_check_out_failed(self, event):
+        self.connection_checked_out(event)
+
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_cleared(self, event): pass
+    def pool_closed(self, event): pass
+    def connection_created(self, event): pass
+    def connection_ready(self, event): pass
+    def connection_closed(self, event): pass
+    def connection_checked_in(self, event): pass
+
+    async def _measure_loop_lag(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self.loop_lag += self.smoothing * (lag - self.loop_lag)
+            # Pool wait decays back to zero once checkouts stop arriving
+            if time.monotonic() - self._last_checkout > self.interval:
+                self.pool_wait *= 1 - self.smoothing
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._measure_loop_lag())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+class RateLimitMiddleware:
+    """ASGI middleware applying token-bucket limits and load shedding.
+
+    Requests over their bucket get 429, non-critical requests get 503 while
+    the event loop or the Mongo pool is saturated. Both carry Retry-After.
+    """
+
+    def __init__(
+        self,
+        app,
+        store,
+        monitor: Optional[LoadMonitor] = None,
+        rules: Optional[List[RateLimitRule]] = None,
+        max_loop_lag: float = 0.5,
+        max_pool_wait: float = 0.25,
+        trusted_proxies: Iterable[str] = (),
+    ):
+        self.app = app
+        self.store = store
+        self.monitor = monitor
+        self.rules = rules if rules is not None else DEFAULT_RULES
+        self.max_loop_lag = max_loop_lag
+        self.max_pool_wait = max_pool_wait
+        self.trusted_proxies = [ipaddress.ip_network(proxy.strip(), strict=False) for proxy in trusted_proxies if proxy.strip()]
+
+    def _trusted(self, address: str) -> bool:
+        try:
+            ip = ipaddress.ip_address(address)
+        except ValueError:
+            return False
+        return any(ip in network for network in self.trusted_proxies)
+
+    def client_ip(self, scope) -> str:
+        """The peer address, or the nearest X-Forwarded-For hop not added by a trusted proxy.
+
+        Clients can put anything in X-Forwarded-For, so the header is only
+        read when the connection comes from a trusted proxy, and it is walked
+        from the right (the hops our proxies appended) rather than the left.
+        """
+        client = scope.get("client")
+        peer = client[0] if client else "unknown"
+        if not self._trusted(peer):
+            return peer
+        hops = [
+            hop.strip()
+            for name, value in scope.get("headers", []) if name == b"x-forwarded-for"
+            for hop in value.decode("latin-1").split(",")
+        ]
+        for hop in reversed(hops):
+            if hop and not self._trusted(hop):
+                return hop
+        return peer
+
+    def overloaded(self) -> bool:
+        if self.monitor is None:
+            return False
+        return self.monitor.loop_lag > self.max_loop_lag or self.monitor.pool_wait > self.max_pool_wait
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+
+        method, path = scope["method"], scope["path"]
+        rule = next((r for r in self.rules if r.matches(method, path)), None)
+        critical = rule is not None and rule.critical
+
+        if not critical and path.startswith("/api") and self.overloaded():
+            response = JSONResponse(
+                {"detail": "Service temporarily overloaded"},
+                status_code=503,
+                headers={"Retry-After": "1"},
+            )
+            await response(scope, receive, send)
+            return
+
+        if rule is not None:
+            try:
+                allowed, retry_after = await self.store.take(f"{rule.name}:{self.client_ip(scope)}", rule)
+            except Exception:
+                # Never let the limiter's own backend take the API down
+                logger.exception("Rate limit store unavailable")
+                allowed, retry_after = True, 0.0
+            if not allowed:
+                response = JSONResponse(
+                    {"detail": "Too many requests"},
+                    status_code=429,
+                    headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+                )
+                await response(scope, receive, send)
+                return
+
+        await self.app(scope, receive, send)
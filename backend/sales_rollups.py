@@ -0,0 +1,174 @@
+"""Hourly and daily pre-aggregated sales buckets maintained on order writes"""
+from datetime import datetime, timezone, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+from pymongo import UpdateOne
+
+
+GRANULARITIES = ("hour", "day", "week", "month")
+# Orders count towards sales once paid for; pending, cancelled and refunded ones do not
+PAID_STATUSES = {"processing", "confirmed", "shipped", "delivered"}
+ROLLUP_FIELDS = ("revenue", "orders", "units", "discount")
+
+
+def _plain(value):
+    """Enum members and strings alike, as the plain string stored in Mongo"""
+    return getattr(value, "value", value)
+
+
+def _as_datetime(value) -> datetime:
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def hour_start(ts: datetime) -> datetime:
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+
+def day_start(ts: datetime) -> datetime:
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def counts_as_sale(status: Optional[str]) -> bool:
+    return _plain(status) in PAID_STATUSES
+
+
+def order_increments(order: Dict[str, Any], categories: Dict[str, str], sign: int = 1) -> Dict[str, float]:
+    """$inc document for one order's contribution to a bucket"""
+    revenue = order.get("total_amount", 0.0) * sign
+    inc = {
+        "revenue": revenue,
+        "orders": sign,
+        "units": sum(item["quantity"] for item in order.get("items", [])) * sign,
+        "discount": order.get("discount_amount", 0.0) * sign,
+    }
+    for item in order.get("items", []):
+        category = categories.get(item["product_id"], "uncategorized")
+        inc[f"categories.{category}.revenue"] = inc.get(f"categories.{category}.revenue", 0.0) + item["total"] * sign
+        inc[f"categories.{category}.units"] = inc.get(f"categories.{category}.units", 0) + item["quantity"] * sign
+    method = _plain(order.get("payment_method")) or "unknown"
+    inc[f"payment_methods.{method}.revenue"] = revenue
+    inc[f"payment_methods.{method}.orders"] = sign
+    return inc
+
+
+def _merge_increments(target: Dict[str, float], inc: Dict[str, float]):
+    for key, value in inc.items():
+        target[key] = target.get(key, 0) + value
+
+
+async def category_map(db, orders: Iterable[Dict[str, Any]]) -> Dict[str, str]:
+    product_ids = list({item["product_id"] for order in orders for item in order.get("items", [])})
+    if not product_ids:
+        return {}
+    products = await db.products.find({"id": {"$in": product_ids}}, {"_id": 0, "id": 1, "category": 1}).to_list(length=None)
+    return {product["id"]: _plain(product["category"]) for product in products}
+
+
+def _bucket_updates(pending: Dict[tuple, Dict[str, float]]) -> List[UpdateOne]:
+    return [
+        UpdateOne(
+            {"_id": f"{granularity}:{bucket.isoformat()}"},
+            {"$inc": inc, "$setOnInsert": {"granularity": granularity, "bucket": bucket}},
+            upsert=True,
+        )
+        for (granularity, bucket), inc in pending.items()
+    ]
+
+
+async def record_orders(db, orders: List[Dict[str, Any]], sign: int = 1, collection: str = "sales_rollups"):
+    """Add (sign=1) or remove (sign=-1) orders from their hourly and daily buckets"""
+    if not orders:
+        return
+    categories = await category_map(db, orders)
+    pending: Dict[tuple, Dict[str, float]] = {}
+    for order in orders:
+        ts = _as_datetime(order["created_at"])
+        inc = order_increments(order, categories, sign)
+        _merge_increments(pending.setdefault(("hour", hour_start(ts)), {}), inc)
+        _merge_increments(pending.setdefault(("day", day_start(ts)), {}), inc)
+    await db[collection].bulk_write(_bucket_updates(pending), ordered=False)
+
+
+async def record_status_change(db, order: Dict[str, Any], old_status: Optional[str], new_status: Optional[str]):
+    """Adjust buckets when an order moves into or out of a paid state"""
+    was_counted, is_counted = counts_as_sale(old_status), counts_as_sale(new_status)
+    if was_counted != is_counted:
+        await record_orders(db, [order], 1 if is_counted else -1)
+
+
+async def rebuild(db, batch_size: int = 1000) -> int:
+    """Recompute every bucket from the hot and archived orders.
+
+    Buckets are built in a staging collection that then replaces
+    sales_rollups in one rename, so charts never read a half-built set.
+    """
+    staging = "sales_rollups_rebuild"
+    await db[staging].drop()
+    await db[staging].create_index([("granularity", 1), ("bucket", 1)])
+    processed = 0
+    batch = []
+    for collection in (db.orders, db.orders_archive):
+        cursor = collection.find({"status": {"$in": list(PAID_STATUSES)}}, {"_id": 0}).batch_size(batch_size)
+        async for order in cursor:
+            batch.append(order)
+            if len(batch) >= batch_size:
+                await record_orders(db, batch, collection=staging)
+                processed += len(batch)
+                batch = []
+    if batch:
+        await record_orders(db, batch, collection=staging)
+        processed += len(batch)
+    await db[staging].rename("sales_rollups", dropTarget=True)
+    return processed
+
+
+def _empty_bucket(bucket: datetime) -> Dict[str, Any]:
+    bucket_doc = {"bucket": bucket, "categories": {}, "payment_methods": {}}
+    bucket_doc.update({field: 0 for field in ROLLUP_FIELDS})
+    return bucket_doc
+
+
+def _fold(target: Dict[str, Any], source: Dict[str, Any]):
+    for field in ROLLUP_FIELDS:
+        target[field] += source.get(field, 0)
+    for group in ("categories", "payment_methods"):
+        for name, values in source.get(group, {}).items():
+            totals = target[group].setdefault(name, {})
+            for key, value in values.items():
+                totals[key] = totals.get(key, 0) + value
+
+
+def _period_start(bucket: datetime, granularity: str) -> datetime:
+    if granularity == "week":
+        return bucket - timedelta(days=bucket.weekday())
+    if granularity == "month":
+        return bucket.replace(day=1)
+    return bucket
+
+
+async def query(db, start: datetime, end: datetime, granularity: str) -> Dict[str, Any]:
+    """Buckets in [start, end); week and month are folded from daily buckets"""
+    source = "hour" if granularity == "hour" else "day"
+    start, end = _as_datetime(start), _as_datetime(end)
+    # Widen to the whole first bucket (and period) rather than dropping its partial start
+    start = hour_start(start) if source == "hour" else _period_start(day_start(start), granularity)
+    cursor = db.sales_rollups.find(
+        {"granularity": source, "bucket": {"$gte": start, "$lt": end}},
+        {"_id": 0, "granularity": 0},
+    ).sort("bucket", 1)
+
+    periods: Dict[datetime, Dict[str, Any]] = {}
+    totals = _empty_bucket(start)
+    async for doc in cursor:
+        bucket = _as_datetime(doc["bucket"])
+        period = _period_start(bucket, granularity)
+        if period not in periods:
+            periods[period] = _empty_bucket(period)
+        _fold(periods[period], doc)
+        _fold(totals, doc)
+    totals.pop("bucket")
+    return {"buckets": list(periods.values()), "totals": totals}
@@ -1,16 +1,47 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Query
+import asyncio
+from fastapi import FastAPI, APIRouter, HTTPException, Query, Request, UploadFile, File
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
-import uuid
+from pydantic import BaseModel, Field, ValidationError, model_validator
+from typing import List, Optional, Dict, Any, Tuple, Union
 from datetime import datetime, timezone, timedelta
 from enum import Enum
 import hashlib
+import secrets
+
+import analytics
+from analytics import AnalyticsEngine
+from archive import OrderArchiver
+from audit import AuditLog
+from blog_render import content_hash, render_content
+from cache import SingleFlight, TTLCache
+from certificates import CERTIFICATE_ID_RE, CertificateStore, certificate_url, content_disposition
+from compression import CompressionMiddleware, ResponseCache
+import customer_search
+from events import ChangeEvent, EventBus
+from exporter import EXPORT_FILES, ExportRunner
+from feeds import FEED_FILE_RE, FeedBuilder
+from file_serving import ZeroCopyFileResponse, file_response
+from ids import new_id
+import inventory
+import notifications
+import order_bulk
+from payment_expiry import PendingPaymentSweeper
+import patching
+from inventory import ExpirySweeper, InsufficientStock
+from notifications import NotificationDispatcher, SMTPPool
+from media import IMAGE_FORMATS, IMAGE_ID_RE, IMAGE_VARIANTS, MAX_UPLOAD_BYTES, ImageStore, image_urls, variant_url
+from rate_limit import LoadMonitor, MemoryBucketStore, MongoBucketStore, RateLimitMiddleware
+import sales_rollups
+from webhooks import WebhookEngine
 
 
 ROOT_DIR = Path(__file__).parent
@@ -18,7 +49,8 @@ load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+load_monitor = LoadMonitor()
+client = AsyncIOMotorClient(mongo_url, event_listeners=[load_monitor])
 db = client[os.environ['DB_NAME']]
 
 # Create the main app without a prefix
@@ -27,6 +59,117 @@ app = FastAPI(title="Elyvra E-commerce API", version="1.0.0")
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
+# Rendered catalog and blog responses, stored with their gzip/br variants
+catalog_cache = ResponseCache(ttl=float(os.environ.get('CATALOG_CACHE_TTL', '60')))
+
+# Product documents by id, shared by get_product and the batch endpoint
+product_cache = TTLCache(ttl=float(os.environ.get('CATALOG_CACHE_TTL', '60')))
+
+# Concurrent identical reads that miss the caches share one in-flight query
+request_coalescer = SingleFlight(timeout=float(os.environ.get('COALESCE_TIMEOUT_SECONDS', '10')))
+
+# Change events published by writes that know exactly which fields they touched
+event_bus = EventBus()
+
+# Who changed what on products and orders, flushed in batches to a capped collection
+audit_log = AuditLog(
+    db,
+    max_bytes=int(os.environ.get('AUDIT_LOG_MAX_MB', '512')) * 1024 * 1024,
+    flush_interval=float(os.environ.get('AUDIT_FLUSH_SECONDS', '1')),
+)
+event_bus.subscribe("product.*", audit_log.record)
+event_bus.subscribe("order.*", audit_log.record)
+
+# Uploaded product images: originals on disk or in GridFS (MEDIA_STORAGE=gridfs),
+# resized derivatives always on local disk
+image_store = ImageStore(
+    db,
+    root=Path(os.environ.get('MEDIA_ROOT', ROOT_DIR / 'media')),
+    storage=os.environ.get('MEDIA_STORAGE', 'disk'),
+)
+
+# Quality certificate files, stored once per content hash. When nginx fronts
+# the API, CERTIFICATE_ACCEL_PREFIX names an internal location mapped to
+# CERTIFICATE_ROOT so downloads are handed off with X-Accel-Redirect.
+certificate_store = CertificateStore(
+    db,
+    root=Path(os.environ.get('CERTIFICATE_ROOT', ROOT_DIR / 'media' / 'certificates')),
+)
+certificate_accel_prefix = os.environ.get('CERTIFICATE_ACCEL_PREFIX')
+
+# Columnar snapshot of orders/users for admin reports, refreshed in the background
+analytics_engine = AnalyticsEngine(mongo_url, os.environ['DB_NAME'], refresh_interval=float(os.environ.get('ANALYTICS_REFRESH_SECONDS', '300')))
+
+# Parquet exports for finance/BI, written by a dedicated worker process
+export_runner = ExportRunner(
+    db,
+    root=Path(os.environ.get('EXPORT_ROOT', ROOT_DIR / 'media' / 'exports')),
+    mongo_url=mongo_url,
+    db_name=os.environ['DB_NAME'],
+)
+
+# Moves delivered/cancelled/refunded orders untouched for ORDER_ARCHIVE_AFTER_DAYS
+# into orders_archive; reads fall back to it
+order_archiver = OrderArchiver(
+    db,
+    older_than_days=int(os.environ.get('ORDER_ARCHIVE_AFTER_DAYS', '365')),
+    interval=float(os.environ.get('ORDER_ARCHIVE_INTERVAL_SECONDS', '86400')),
+)
+
+# Writes off expired inventory batches and reports stock close to expiry
+expiry_sweeper = ExpirySweeper(
+    db,
+    interval=float(os.environ.get('INVENTORY_SWEEP_SECONDS', '3600')),
+    warning_days=int(os.environ.get('EXPIRY_WARNING_DAYS', '30')),
+    on_expired=lambda: invalidate_products(),
+)
+
+# Cancels orders left in pending_payment for PENDING_PAYMENT_TTL_MINUTES and releases their stock
+payment_sweeper = PendingPaymentSweeper(
+    db,
+    max_age_minutes=int(os.environ.get('PENDING_PAYMENT_TTL_MINUTES', '1440')),
+    interval=float(os.environ.get('PAYMENT_SWEEP_SECONDS', '300')),
+    on_cancelled=lambda orders: on_payments_expired(orders),
+)
+
+# Order status emails queued in notification_outbox and sent in batches over pooled
+# SMTP connections (point SMTP_HOST/SMTP_PORT at a local debugging server in development)
+notification_dispatcher = NotificationDispatcher(
+    db,
+    pool=SMTPPool(
+        host=os.environ.get('SMTP_HOST', 'localhost'),
+        port=int(os.environ.get('SMTP_PORT', '1025')),
+        size=int(os.environ.get('SMTP_POOL_SIZE', '2')),
+        username=os.environ.get('SMTP_USERNAME'),
+        password=os.environ.get('SMTP_PASSWORD'),
+        starttls=os.environ.get('SMTP_STARTTLS', 'false').lower() == 'true',
+    ),
+    sender=os.environ.get('MAIL_FROM', 'Elyvra <orders@elyvra.com>'),
+    batch_size=int(os.environ.get('NOTIFY_BATCH_SIZE', '100')),
+    interval=float(os.environ.get('NOTIFY_INTERVAL_SECONDS', '5')),
+    max_attempts=int(os.environ.get('NOTIFY_MAX_ATTEMPTS', '6')),
+)
+
+# Order and stock events pushed to registered ERP/3PL endpoints, persisted in webhook_deliveries
+webhook_engine = WebhookEngine(
+    db,
+    batch_size=int(os.environ.get('WEBHOOK_BATCH_SIZE', '50')),
+    timeout=float(os.environ.get('WEBHOOK_TIMEOUT_SECONDS', '10')),
+    max_attempts=int(os.environ.get('WEBHOOK_MAX_ATTEMPTS', '10')),
+)
+event_bus.subscribe("order.*", webhook_engine.on_event)
+event_bus.subscribe("product.*", webhook_engine.on_event)
+
+# Sitemaps and per-language shopping feeds, rebuilt incrementally from product updated_at
+feed_builder = FeedBuilder(
+    db,
+    root=Path(os.environ.get('FEED_ROOT', ROOT_DIR / 'media' / 'feeds')),
+    site_url=os.environ.get('SITE_URL', 'http://localhost:3000'),
+    languages=os.environ.get('FEED_LANGUAGES', 'ar,en,fr').split(','),
+    currency=os.environ.get('FEED_CURRENCY', 'USD'),
+    interval=float(os.environ.get('FEED_REFRESH_SECONDS', '900')),
+)
+
 
 # Enums
 class ProductCategory(str, Enum):
@@ -54,12 +197,14 @@ class ProductTranslation(BaseModel):
     usage_warnings: Optional[str] = None  # تحذيرات الاستخدام
 
 class Product(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    id: str = Field(default_factory=new_id)
     sku: str
     category: ProductCategory
     price: float
     discounted_price: Optional[float] = None
     image_url: str
+    image_id: Optional[str] = None  # uploaded image, see /admin/media/images
+    thumbnail_url: Optional[str] = None
     gallery_images: List[str] = []
     in_stock: bool = True
     stock_quantity: int = 0
@@ -72,6 +217,8 @@ class Product(BaseModel):
     manufacturing_date: Optional[datetime] = None  # تاريخ الإنتاج
     batch_number: Optional[str] = None  # رقم الدفعة
     storage_conditions: Optional[str] = None  # ظروف التخزين
+    batch_tracked: bool = False  # stock held in inventory_batches, allocated FEFO
+    version: int = 0  # bumped on every write, sent back as the ETag
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -81,6 +228,7 @@ class ProductCreate(BaseModel):
     price: float
     discounted_price: Optional[float] = None
     image_url: str
+    image_id: Optional[str] = None
     gallery_images: List[str] = []
     in_stock: bool = True
     stock_quantity: int = 0
@@ -88,6 +236,42 @@ class ProductCreate(BaseModel):
     tags: List[str] = []
     featured: bool = False
 
+# Fields PATCH /admin/products/{id} may touch (nested paths below them included)
+PRODUCT_PATCHABLE_FIELDS = set(ProductCreate.model_fields) | {
+    "certifications", "expiry_date", "manufacturing_date", "batch_number", "storage_conditions",
+}
+# Kept in step with inventory_batches once a product is batch tracked, never written directly
+BATCH_MANAGED_FIELDS = {"stock_quantity", "in_stock", "batch_number", "expiry_date", "manufacturing_date"}
+
+class ProductBatchRequest(BaseModel):
+    ids: List[str] = Field(min_length=1, max_length=500)
+    lang: Optional[Language] = None  # only return this translation
+
+class ProductBatchResponse(BaseModel):
+    products: List[Product]
+    missing: List[str]
+
+# Inventory Models
+class InventoryBatchCreate(BaseModel):
+    batch_number: str
+    quantity: int = Field(gt=0)
+    expiry_date: datetime
+    manufacturing_date: Optional[datetime] = None
+    storage_conditions: Optional[str] = None
+
+class InventoryBatch(BaseModel):
+    id: str
+    product_id: str
+    batch_number: str
+    quantity: int
+    received_quantity: int
+    expired_quantity: int = 0
+    expiry_date: datetime
+    manufacturing_date: Optional[datetime] = None
+    storage_conditions: Optional[str] = None
+    status: str = "active"
+    created_at: datetime
+
 class ProductFilter(BaseModel):
     category: Optional[ProductCategory] = None
     min_price: Optional[float] = None
@@ -102,11 +286,35 @@ class CartItem(BaseModel):
     quantity: int = 1
 
 class Cart(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    id: str = Field(default_factory=new_id)
     items: List[CartItem] = []
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class CartProductCard(BaseModel):
+    id: str
+    name: str
+    price: float
+    discounted_price: Optional[float] = None
+    unit_price: float
+    in_stock: bool
+    stock_quantity: int
+    thumbnail_url: str
+
+class CartLine(BaseModel):
+    product_id: str
+    quantity: int
+    product: Optional[CartProductCard] = None  # None when the product no longer exists
+    line_total: float = 0.0
+
+class ExpandedCart(BaseModel):
+    id: str
+    items: List[CartLine]
+    item_count: int
+    subtotal: float
+    created_at: datetime
+    updated_at: datetime
+
 # Order Status Enum
 class OrderStatus(str, Enum):
     PENDING_PAYMENT = "pending_payment"
@@ -137,7 +345,7 @@ class Address(BaseModel):
     postal_code: str
 
 class User(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    id: str = Field(default_factory=new_id)
     email: str
     first_name: str
     last_name: str
@@ -159,8 +367,15 @@ class OrderItem(BaseModel):
     quantity: int
     total: float
 
+class BatchAllocation(BaseModel):
+    product_id: str
+    batch_id: str
+    batch_number: str
+    expiry_date: datetime
+    quantity: int
+
 class Order(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    id: str = Field(default_factory=new_id)
     customer_id: str
     items: List[OrderItem]
     subtotal: float
@@ -175,9 +390,25 @@ class Order(BaseModel):
     notes: Optional[str] = None
     tracking_number: Optional[str] = None
     coupon_code: Optional[str] = None
+    batch_allocations: List[BatchAllocation] = []
+    item_count: int = 0  # units across all lines, stored for the order history index
+    version: int = 0
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+    @model_validator(mode="after")
+    def count_items(self):
+        self.item_count = sum(item.quantity for item in self.items)
+        return self
+
+class OrderSummary(BaseModel):
+    id: str
+    created_at: datetime
+    status: OrderStatus
+    total_amount: float
+    item_count: int = 0
+    tracking_number: Optional[str] = None
+
 class OrderCreate(BaseModel):
     customer_id: str
     items: List[OrderItem]
@@ -192,9 +423,49 @@ class OrderUpdate(BaseModel):
     tracking_number: Optional[str] = None
     notes: Optional[str] = None
 
+class BulkOrderUpdateRow(BaseModel):
+    order_id: str
+    status: Optional[OrderStatus] = None
+    tracking_number: Optional[str] = None
+
+class BulkOrderUpdate(BaseModel):
+    updates: List[BulkOrderUpdateRow] = Field(min_length=1, max_length=5000)
+
+class BulkOrderUpdateResult(BaseModel):
+    order_id: str
+    ok: bool
+    status: Optional[str] = None
+    error: Optional[str] = None
+
+class BulkOrderUpdateResponse(BaseModel):
+    updated: int
+    failed: int
+    results: List[BulkOrderUpdateResult]
+
+# Webhook Models
+class WebhookSubscriptionCreate(BaseModel):
+    url: str
+    events: List[str] = ["order.*", "product.stock_*"]  # event type patterns
+    ordered: bool = True  # one batch in flight, later events wait for retries
+    max_concurrency: int = Field(default=4, ge=1, le=32)
+    description: Optional[str] = None
+
+class WebhookSubscription(BaseModel):
+    id: str = Field(default_factory=new_id)
+    url: str
+    events: List[str]
+    ordered: bool = True
+    max_concurrency: int = 4
+    description: Optional[str] = None
+    active: bool = True
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class WebhookSubscriptionCreated(WebhookSubscription):
+    secret: str  # shown once, used to verify X-Webhook-Signature
+
 # Admin Models
 class Admin(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    id: str = Field(default_factory=new_id)
     username: str
     email: str
     password_hash: str
@@ -219,7 +490,7 @@ class DiscountType(str, Enum):
     FREE_SHIPPING = "free_shipping"
 
 class Coupon(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    id: str = Field(default_factory=new_id)
     code: str
     description: str
     discount_type: DiscountType
@@ -245,9 +516,11 @@ class CouponCreate(BaseModel):
 
 # Blog & Content Models
 class BlogPost(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    id: str = Field(default_factory=new_id)
     title: Dict[str, str]  # Multi-language titles
     content: Dict[str, str]  # Multi-language content
+    content_html: Dict[str, str] = {}  # Sanitized HTML rendered from content at write time
+    content_hash: Optional[str] = None
     excerpt: Dict[str, str]  # Multi-language excerpts
     featured_image: Optional[str] = None
     author: str
@@ -256,6 +529,17 @@ class BlogPost(BaseModel):
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class BlogPostSummary(BaseModel):
+    id: str
+    title: Dict[str, str]
+    excerpt: Dict[str, str]
+    featured_image: Optional[str] = None
+    author: str
+    published: bool = False
+    featured: bool = False
+    created_at: datetime
+    updated_at: datetime
+
 class BlogPostCreate(BaseModel):
     title: Dict[str, str]
     content: Dict[str, str]
@@ -265,6 +549,15 @@ class BlogPostCreate(BaseModel):
     published: bool = False
     featured: bool = False
 
+class BlogPostUpdate(BaseModel):
+    title: Optional[Dict[str, str]] = None
+    content: Optional[Dict[str, str]] = None
+    excerpt: Optional[Dict[str, str]] = None
+    featured_image: Optional[str] = None
+    author: Optional[str] = None
+    published: Optional[bool] = None
+    featured: Optional[bool] = None
+
 # Enhanced Admin Stats
 class AdminStats(BaseModel):
     total_products: int
@@ -279,6 +572,14 @@ class AdminStats(BaseModel):
     sales_chart_data: List[Dict[str, Any]]
     top_selling_products: List[Dict[str, Any]]
 
+# Storefront Models
+class StorefrontHome(BaseModel):
+    lang: Language
+    featured_products: List[Product]
+    products_by_category: Dict[str, List[Product]]
+    category_counts: Dict[str, int]
+    featured_posts: List[BlogPostSummary]
+
 
 # Helper functions
 def prepare_for_mongo(data):
@@ -304,6 +605,125 @@ def parse_from_mongo(item):
                     pass
     return item
 
+# Every field is in the customer order-history index, so summaries never touch the documents
+ORDER_SUMMARY_INDEX = [
+    ("customer_id", 1), ("created_at", -1), ("id", 1), ("status", 1),
+    ("total_amount", 1), ("item_count", 1), ("tracking_number", 1),
+]
+ORDER_SUMMARY_PROJECTION = {"_id": 0, **{field: 1 for field, _ in ORDER_SUMMARY_INDEX[1:]}}
+
+async def run_migration(name: str, migrate):
+    """Run a one-off migration in exactly one process, however many start at once"""
+    try:
+        # The insert is the claim: whoever loses the race on _id skips the work
+        await db.migrations.insert_one(
+            {"_id": name, "state": "running", "started_at": datetime.now(timezone.utc).isoformat()}
+        )
+    except DuplicateKeyError:
+        return
+    try:
+        await migrate()
+    except BaseException:
+        # Let the next startup try again
+        await db.migrations.delete_one({"_id": name, "state": "running"})
+        raise
+    await db.migrations.update_one(
+        {"_id": name}, {"$set": {"state": "done", "applied_at": datetime.now(timezone.utc).isoformat()}}
+    )
+
+async def rebuild_paid_revenue():
+    await sales_rollups.rebuild(db)
+    await order_archiver.rebuild_stats()
+
+async def backfill_order_item_counts():
+    """One-off: store item_count on orders created before it existed"""
+    await db.orders.update_many(
+        {"item_count": {"$exists": False}},
+        [{"$set": {"item_count": {"$sum": "$items.quantity"}}}]
+    )
+
+async def fetch_products_by_id(product_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Product documents by id from the product cache, loading misses with one $in query"""
+    found, missing = product_cache.get_many(product_ids)
+    if missing:
+        query = {"id": missing[0]} if len(missing) == 1 else {"id": {"$in": missing}}
+        async for product in db.products.find(query, {"_id": 0}):
+            product = parse_from_mongo(product)
+            product_cache.put(product["id"], product)
+            found[product["id"]] = product
+    return found
+
+def invalidate_products():
+    """Drop every cached product read after a catalog write"""
+    catalog_cache.invalidate("products")
+    product_cache.clear()
+    request_coalescer.forget()
+
+def on_product_changed(event: ChangeEvent):
+    """Drop only the cached copies a product change can affect"""
+    product_cache.invalidate(event.entity_id)
+    catalog_cache.invalidate("products")
+    request_coalescer.forget()
+
+event_bus.subscribe("product.*", on_product_changed)
+
+def cache_unless_stale(generation: int, cache_key: str, result: Any, tags: List[str]):
+    """Cache a coalesced read unless a write invalidated the catalog while it ran"""
+    if request_coalescer.generation != generation:
+        # Still good enough for the requests that were already waiting on it
+        return catalog_cache.render(result, tags=tags)
+    return catalog_cache.put(cache_key, result, tags=tags)
+
+async def coalesce(key: str, call, name: str, timeout: Optional[float] = None):
+    """Run call once for all concurrent requests with the same key"""
+    try:
+        return await request_coalescer.do(key, call, timeout, name)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Timed out waiting for the database")
+
+def with_image_variant(product: Product, variant: str) -> Product:
+    """Point image_url at the derivative sized for the view (card for lists, detail for pages)"""
+    if product.image_id:
+        product.image_url = variant_url(product.image_id, variant)
+        product.thumbnail_url = variant_url(product.image_id, "thumb")
+    return product
+
+def parse_if_match(request: Request) -> Optional[int]:
+    """The version a client expects from an If-Match header, or None when it is absent"""
+    header = request.headers.get("if-match")
+    if not header or header.strip() == "*":
+        return None
+    try:
+        return int(header.strip().removeprefix("W/").strip('"'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="If-Match must be a version number")
+
+def request_actor(request: Request) -> Optional[str]:
+    """The admin the frontend says is making a write, recorded in the audit log"""
+    return request.headers.get("x-admin-id")
+
+def version_filter(entity_id: str, expected_version: Optional[int]) -> Dict[str, Any]:
+    filter_dict = {"id": entity_id}
+    if expected_version is not None:
+        # Documents written before versioning have no field and count as version 0
+        filter_dict["version"] = {"$in": [0, None]} if expected_version == 0 else expected_version
+    return filter_dict
+
+async def raise_update_failed(collection, entity_id: str, name: str):
+    """Tell a missing document apart from a version conflict after a guarded update missed"""
+    current = await collection.find_one({"id": entity_id}, {"_id": 0, "version": 1})
+    if not current:
+        raise HTTPException(status_code=404, detail=f"{name} not found")
+    raise HTTPException(
+        status_code=409,
+        detail=f"{name} was modified by someone else (current version {current.get('version', 0)})"
+    )
+
+async def check_image_id(image_id: Optional[str]):
+    """Refuse product writes pointing at an image that was never uploaded"""
+    if image_id and not await db.images.find_one({"id": image_id}, {"_id": 1}):
+        raise HTTPException(status_code=422, detail=f"Unknown image_id: {image_id}")
+
 def hash_password(password: str) -> str:
     """Hash password using SHA-256"""
     return hashlib.sha256(password.encode()).hexdigest()
@@ -320,15 +740,26 @@ async def root():
 
 # Product Routes
 @api_router.post("/products", response_model=Product)
-async def create_product(product: ProductCreate):
+async def create_product(product: ProductCreate, request: Request):
+    await check_image_id(product.image_id)
     product_dict = product.dict()
     product_obj = Product(**product_dict)
     prepared_data = prepare_for_mongo(product_obj.dict())
     result = await db.products.insert_one(prepared_data)
+    invalidate_products()
+    await event_bus.publish(ChangeEvent(
+        type="product.created",
+        entity_id=product_obj.id,
+        fields=["sku", "price", "stock_quantity"],
+        changes={"sku": product_obj.sku, "price": product_obj.price, "stock_quantity": product_obj.stock_quantity},
+        version=product_obj.version,
+        actor=request_actor(request),
+    ))
     return product_obj
 
 @api_router.get("/products", response_model=List[Product])
 async def get_products(
+    request: Request,
     category: Optional[ProductCategory] = None,
     featured: Optional[bool] = None,
     min_price: Optional[float] = None,
@@ -337,6 +768,11 @@ async def get_products(
     skip: int = Query(default=0, ge=0)
 ):
     """Get products with optional filtering"""
+    cache_key = catalog_cache.key_for(request)
+    cached = catalog_cache.get(cache_key)
+    if cached:
+        return await cached.to_response(request)
+    
     filter_dict = {}
     
     if category:
@@ -351,20 +787,121 @@ async def get_products(
             price_filter["$lte"] = max_price
         filter_dict["price"] = price_filter
     
-    products = await db.products.find(filter_dict).skip(skip).limit(limit).to_list(length=None)
-    return [Product(**parse_from_mongo(product)) for product in products]
+    async def load():
+        generation = request_coalescer.generation
+        products = await db.products.find(filter_dict).skip(skip).limit(limit).to_list(length=None)
+        result = [with_image_variant(Product(**parse_from_mongo(product)), "card") for product in products]
+        return cache_unless_stale(generation, cache_key, result, ["products"])
+    
+    payload = await coalesce(cache_key, load, "products")
+    return await payload.to_response(request)
+
+@api_router.post("/products/batch", response_model=ProductBatchResponse)
+async def get_products_batch(batch: ProductBatchRequest):
+    """Get many products by id in request order, reporting ids that do not exist"""
+    product_ids = list(dict.fromkeys(batch.ids))
+    found = await fetch_products_by_id(product_ids)
+    
+    products = []
+    for product_id in product_ids:
+        product = found.get(product_id)
+        if not product:
+            continue
+        if batch.lang:
+            translation = product["translations"].get(batch.lang.value)
+            product = {**product, "translations": {batch.lang.value: translation} if translation else {}}
+        products.append(with_image_variant(Product(**product), "card"))
+    
+    return ProductBatchResponse(
+        products=products,
+        missing=[product_id for product_id in product_ids if product_id not in found]
+    )
+
+def localized_product(product: Dict[str, Any], lang: Language) -> Product:
+    """Card-sized product carrying only the requested translation (English when it is missing)"""
+    translations = product.get("translations", {})
+    translation = translations.get(lang.value) or translations.get(Language.EN.value)
+    product = {**parse_from_mongo(product), "translations": {lang.value: translation} if translation else {}}
+    return with_image_variant(Product(**product), "card")
+
+@api_router.get("/storefront/home", response_model=StorefrontHome)
+async def get_storefront_home(request: Request, lang: Language = Language.EN):
+    """Everything the landing page shows, built from concurrent queries and cached per language"""
+    cache_key = catalog_cache.key_for(request)
+    cached = catalog_cache.get(cache_key)
+    if cached:
+        return await cached.to_response(request)
+    
+    per_category = int(os.environ.get('HOME_PRODUCTS_PER_CATEGORY', '8'))
+    categories = list(ProductCategory)
+    featured, counts, posts, *by_category = await asyncio.gather(
+        db.products.find({"featured": True}, {"_id": 0}).limit(12).to_list(length=None),
+        db.products.aggregate([{"$group": {"_id": "$category", "count": {"$sum": 1}}}]).to_list(length=None),
+        db.blog_posts.find(
+            {"published": True, "featured": True}, {"_id": 0, "content": 0, "content_html": 0}
+        ).sort("created_at", -1).limit(4).to_list(length=None),
+        *[
+            db.products.find({"category": category.value}, {"_id": 0}).limit(per_category).to_list(length=None)
+            for category in categories
+        ]
+    )
+    
+    for post in posts:
+        post["title"] = {lang.value: post["title"].get(lang.value) or post["title"].get(Language.EN.value, "")}
+        post["excerpt"] = {lang.value: post["excerpt"].get(lang.value) or post["excerpt"].get(Language.EN.value, "")}
+    result = StorefrontHome(
+        lang=lang,
+        featured_products=[localized_product(product, lang) for product in featured],
+        products_by_category={
+            category.value: [localized_product(product, lang) for product in products]
+            for category, products in zip(categories, by_category)
+        },
+        category_counts={getattr(item["_id"], "value", item["_id"]): item["count"] for item in counts},
+        featured_posts=[BlogPostSummary(**parse_from_mongo(post)) for post in posts],
+    )
+    return await catalog_cache.put(cache_key, result, tags=["products", "blog"]).to_response(request)
+
+@api_router.get("/feeds/{filename}")
+async def get_feed_file(filename: str, request: Request):
+    """Prebuilt sitemap index, sitemap chunks and shopping feeds"""
+    path = feed_builder.root / filename
+    if not FEED_FILE_RE.match(filename) or not path.is_file():
+        raise HTTPException(status_code=404, detail="Feed not found")
+    stat = path.stat()
+    media_type = "application/xml" if filename.endswith(".xml") else "application/gzip"
+    return file_response(
+        request, str(path), media_type, etag=f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"',
+        cache_control="public, max-age=300"
+    )
 
 @api_router.get("/products/{product_id}", response_model=Product)
-async def get_product(product_id: str):
-    product = await db.products.find_one({"id": product_id})
-    if not product:
-        raise HTTPException(status_code=404, detail="Product not found")
-    return Product(**parse_from_mongo(product))
+async def get_product(product_id: str, request: Request):
+    cache_key = catalog_cache.key_for(request)
+    cached = catalog_cache.get(cache_key)
+    if cached:
+        return await cached.to_response(request)
+    
+    async def load():
+        generation = request_coalescer.generation
+        product = (await fetch_products_by_id([product_id])).get(product_id)
+        if not product:
+            raise HTTPException(status_code=404, detail="Product not found")
+        result = with_image_variant(Product(**product), "detail")
+        return cache_unless_stale(generation, cache_key, result, ["products"])
+    
+    payload = await coalesce(cache_key, load, "product")
+    return await payload.to_response(request)
 
 @api_router.get("/products/category/{category}", response_model=List[Product])
-async def get_products_by_category(category: ProductCategory):
+async def get_products_by_category(category: ProductCategory, request: Request):
+    cache_key = catalog_cache.key_for(request)
+    cached = catalog_cache.get(cache_key)
+    if cached:
+        return await cached.to_response(request)
+    
     products = await db.products.find({"category": category}).to_list(length=None)
-    return [Product(**parse_from_mongo(product)) for product in products]
+    result = [with_image_variant(Product(**parse_from_mongo(product)), "card") for product in products]
+    return await catalog_cache.put(cache_key, result, tags=["products"]).to_response(request)
 
 # Cart Routes
 @api_router.post("/cart", response_model=Cart)
@@ -374,13 +911,75 @@ async def create_cart():
     await db.carts.insert_one(prepared_data)
     return cart
 
-@api_router.get("/cart/{cart_id}", response_model=Cart)
-async def get_cart(cart_id: str):
+@api_router.get("/cart/{cart_id}", response_model=Union[ExpandedCart, Cart])
+async def get_cart(
+    cart_id: str,
+    expand: Optional[str] = Query(default=None, pattern="^products$"),
+    lang: Language = Language.EN
+):
+    """Get a cart; expand=products joins product cards and computes totals server-side"""
+    if expand == "products":
+        return await get_expanded_cart(cart_id, lang)
+    
     cart = await db.carts.find_one({"id": cart_id})
     if not cart:
         raise HTTPException(status_code=404, detail="Cart not found")
     return Cart(**parse_from_mongo(cart))
 
+async def get_expanded_cart(cart_id: str, lang: Language) -> ExpandedCart:
+    """Cart with product cards joined in a single $lookup on the indexed products.id"""
+    pipeline = [
+        {"$match": {"id": cart_id}},
+        {"$limit": 1},
+        {"$lookup": {
+            "from": "products",
+            "localField": "items.product_id",
+            "foreignField": "id",
+            "pipeline": [{"$project": {
+                "_id": 0, "id": 1, "price": 1, "discounted_price": 1, "in_stock": 1,
+                "stock_quantity": 1, "image_url": 1, "image_id": 1,
+                f"translations.{lang.value}.name": 1, "translations.en.name": 1
+            }}],
+            "as": "products"
+        }},
+        {"$project": {"_id": 0}}
+    ]
+    carts = await db.carts.aggregate(pipeline).to_list(length=1)
+    if not carts:
+        raise HTTPException(status_code=404, detail="Cart not found")
+    cart = parse_from_mongo(carts[0])
+    
+    products = {product["id"]: product for product in cart.pop("products", [])}
+    lines = []
+    for item in cart.get("items", []):
+        product = products.get(item["product_id"])
+        line = CartLine(product_id=item["product_id"], quantity=item["quantity"])
+        if product:
+            translations = product.get("translations", {})
+            name = (translations.get(lang.value) or translations.get("en") or {}).get("name", "")
+            unit_price = product.get("discounted_price") or product["price"]
+            line.product = CartProductCard(
+                id=product["id"],
+                name=name,
+                price=product["price"],
+                discounted_price=product.get("discounted_price"),
+                unit_price=unit_price,
+                in_stock=product.get("in_stock", True),
+                stock_quantity=product.get("stock_quantity", 0),
+                thumbnail_url=variant_url(product["image_id"], "thumb") if product.get("image_id") else product["image_url"]
+            )
+            line.line_total = round(unit_price * item["quantity"], 2)
+        lines.append(line)
+    
+    return ExpandedCart(
+        id=cart["id"],
+        items=lines,
+        item_count=sum(line.quantity for line in lines),
+        subtotal=round(sum(line.line_total for line in lines), 2),
+        created_at=cart["created_at"],
+        updated_at=cart["updated_at"]
+    )
+
 @api_router.post("/cart/{cart_id}/items")
 async def add_to_cart(cart_id: str, item: CartItem):
     cart = await db.carts.find_one({"id": cart_id})
@@ -418,6 +1017,97 @@ async def add_to_cart(cart_id: str, item: CartItem):
     return {"message": "Item added to cart", "cart": cart_obj}
 
 
+# Media Routes
+@api_router.post("/admin/media/images")
+async def upload_image(file: UploadFile = File(...)):
+    """Upload a product image and generate its resized WebP/JPEG derivatives"""
+    # Read at most one byte past the limit instead of buffering whatever was sent
+    data = await file.read(MAX_UPLOAD_BYTES + 1)
+    if len(data) > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="Image is too large")
+    try:
+        record = await image_store.save(data, file.content_type)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return {
+        "image_id": record["id"],
+        "width": record["width"],
+        "height": record["height"],
+        "variants": record["variants"],
+        "urls": image_urls(record)
+    }
+
+@api_router.get("/media/images/{image_id}/{filename}")
+async def get_image_variant(image_id: str, filename: str, request: Request):
+    """Serve an image derivative, e.g. card.webp, with range and cache headers"""
+    variant, _, fmt = filename.partition(".")
+    if not IMAGE_ID_RE.match(image_id) or variant not in IMAGE_VARIANTS or fmt not in IMAGE_FORMATS:
+        raise HTTPException(status_code=404, detail="Image not found")
+    
+    path = await image_store.ensure_variant(image_id, variant, fmt)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    
+    # Derivatives are addressed by content hash, so they never change
+    return file_response(request, str(path), IMAGE_FORMATS[fmt], etag=f'"{image_id}-{variant}-{fmt}"')
+
+@api_router.post("/admin/certificates")
+async def upload_certificate(file: UploadFile = File(...), product_id: Optional[str] = None):
+    """Upload a quality certificate, optionally attaching it to a product"""
+    if product_id and not await db.products.find_one({"id": product_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Product not found")
+    
+    try:
+        record = await certificate_store.save(file)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    url = certificate_url(record["id"])
+    if product_id:
+        await db.products.update_one(
+            {"id": product_id},
+            {
+                "$addToSet": {"certifications": url},
+                "$set": {"updated_at": datetime.now(timezone.utc).isoformat()},
+                "$inc": {"version": 1}
+            }
+        )
+        invalidate_products()
+    
+    return {"certificate_id": record["id"], "url": url, "filename": record["filename"], "size": record["size"]}
+
+@api_router.get("/certificates/{cert_id}")
+async def get_certificate(cert_id: str, request: Request):
+    """Download a certificate with range and If-None-Match support"""
+    if not CERTIFICATE_ID_RE.match(cert_id):
+        raise HTTPException(status_code=404, detail="Certificate not found")
+    
+    record = await db.certificates.find_one({"id": cert_id}, {"_id": 0})
+    path = certificate_store.path_for(cert_id)
+    if not record or not path.exists():
+        raise HTTPException(status_code=404, detail="Certificate not found")
+    
+    etag = f'"{cert_id}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "Content-Disposition": content_disposition(record["filename"])
+    }
+    if certificate_accel_prefix:
+        if request.headers.get("if-none-match") in (etag, "*"):
+            return Response(status_code=304, headers=headers)
+        # nginx serves the bytes (with sendfile and ranges) from its internal location
+        headers["X-Accel-Redirect"] = certificate_accel_prefix.rstrip("/") + "/" + certificate_store.relative_path(cert_id)
+        return Response(headers=headers, media_type=record["content_type"])
+    
+    response = file_response(
+        request, str(path), record["content_type"], etag=etag, response_class=ZeroCopyFileResponse
+    )
+    response.headers["Content-Disposition"] = headers["Content-Disposition"]
+    return response
+
+
 # Initialize some sample products
 @api_router.post("/init-products")
 async def init_sample_products():
@@ -557,6 +1247,7 @@ async def init_sample_products():
         prepared_data = prepare_for_mongo(product_obj.dict())
         await db.products.insert_one(prepared_data)
     
+    invalidate_products()
     return {"message": f"Initialized {len(sample_products)} sample products"}
 
 
@@ -604,8 +1295,12 @@ async def create_admin(admin_data: AdminCreate):
     return {"message": "Admin created successfully", "admin_id": admin_obj.id}
 
 @api_router.get("/admin/stats", response_model=AdminStats)
-async def get_admin_stats():
-    """Get enhanced admin dashboard statistics"""
+async def get_admin_stats(request: Request):
+    """Get enhanced admin dashboard statistics, computed once for concurrent requests"""
+    timeout = float(os.environ.get('ADMIN_STATS_TIMEOUT_SECONDS', '30'))
+    return await coalesce(catalog_cache.key_for(request), compute_admin_stats, "admin_stats", timeout)
+
+async def compute_admin_stats() -> AdminStats:
     # Get total products
     total_products = await db.products.count_documents({})
     
@@ -619,13 +1314,23 @@ async def get_admin_stats():
     total_orders = await db.orders.count_documents({})
     total_customers = await db.users.count_documents({})
     
-    # Calculate total revenue
+    # Calculate total revenue from paid orders only
+    paid = {"$match": {"status": {"$in": list(sales_rollups.PAID_STATUSES)}}}
     revenue_pipeline = [
+        paid,
         {"$group": {"_id": None, "total": {"$sum": "$total_amount"}}}
     ]
     revenue_result = await db.orders.aggregate(revenue_pipeline).to_list(length=None)
     total_revenue = revenue_result[0]["total"] if revenue_result else 0.0
     
+    # Archived orders only contribute their precomputed totals
+    archived = await order_archiver.stats()
+    total_orders += archived.get("orders", 0)
+    total_revenue += sum(
+        totals.get("revenue", 0.0) for status, totals in archived.get("statuses", {}).items()
+        if sales_rollups.counts_as_sale(status)
+    )
+    
     # Get products by category
     category_pipeline = [
         {"$group": {"_id": "$category", "count": {"$sum": 1}}}
@@ -639,44 +1344,46 @@ async def get_admin_stats():
     ]
     status_results = await db.orders.aggregate(status_pipeline).to_list(length=None)
     orders_by_status = {item["_id"]: item["count"] for item in status_results}
+    for status, totals in archived.get("statuses", {}).items():
+        orders_by_status[status] = orders_by_status.get(status, 0) + totals.get("orders", 0)
     
-    # Get sales chart data (last 30 days)
-    from datetime import timedelta
-    thirty_days_ago = datetime.now(timezone.utc) - timedelta(days=30)
-    
-    sales_pipeline = [
-        {"$match": {"created_at": {"$gte": thirty_days_ago.isoformat()}}},
-        {"$group": {
-            "_id": {"$dateToString": {"format": "%Y-%m-%d", "date": {"$dateFromString": {"dateString": "$created_at"}}}},
-            "sales": {"$sum": "$total_amount"},
-            "orders": {"$sum": 1}
-        }},
-        {"$sort": {"_id": 1}}
+    # Get sales chart data (last 30 days) from the daily rollups
+    now = datetime.now(timezone.utc)
+    sales_data = await sales_rollups.query(db, now - timedelta(days=30), now, "day")
+    sales_chart_data = [
+        {"date": item["bucket"].strftime("%Y-%m-%d"), "sales": item["revenue"], "orders": item["orders"]}
+        for item in sales_data["buckets"]
     ]
-    sales_data = await db.orders.aggregate(sales_pipeline).to_list(length=None)
-    sales_chart_data = [{"date": item["_id"], "sales": item["sales"], "orders": item["orders"]} for item in sales_data]
     
     # Get top selling products
     top_products_pipeline = [
+        paid,
         {"$unwind": "$items"},
         {"$group": {
             "_id": "$items.product_id",
             "product_name": {"$first": "$items.product_name"},
             "total_quantity": {"$sum": "$items.quantity"},
             "total_revenue": {"$sum": "$items.total"}
-        }},
-        {"$sort": {"total_quantity": -1}},
-        {"$limit": 5}
+        }}
     ]
     top_products_data = await db.orders.aggregate(top_products_pipeline).to_list(length=None)
-    top_selling_products = [
-        {
+    product_totals = {
+        item["_id"]: {
             "product_id": item["_id"],
             "name": item["product_name"],
             "quantity_sold": item["total_quantity"],
             "revenue": item["total_revenue"]
         } for item in top_products_data
-    ]
+    }
+    for product_id, totals in archived.get("products", {}).items():
+        if not totals.get("quantity"):
+            continue
+        entry = product_totals.setdefault(
+            product_id, {"product_id": product_id, "name": totals.get("name"), "quantity_sold": 0, "revenue": 0.0}
+        )
+        entry["quantity_sold"] += totals.get("quantity", 0)
+        entry["revenue"] += totals.get("revenue", 0.0)
+    top_selling_products = sorted(product_totals.values(), key=lambda item: item["quantity_sold"], reverse=True)[:5]
     
     # Get recent activity
     recent_orders = await db.orders.find().sort("created_at", -1).limit(5).to_list(length=None)
@@ -717,36 +1424,372 @@ async def get_admin_stats():
         top_selling_products=top_selling_products
     )
 
-@api_router.put("/admin/products/{product_id}", response_model=Product)
-async def update_product(product_id: str, product_update: ProductCreate):
-    """Update existing product"""
-    existing_product = await db.products.find_one({"id": product_id})
-    if not existing_product:
-        raise HTTPException(status_code=404, detail="Product not found")
+@api_router.get("/admin/sales")
+async def get_sales(
+    from_date: datetime = Query(alias="from"),
+    to_date: Optional[datetime] = Query(default=None, alias="to"),
+    granularity: str = Query(default="day", pattern="^(hour|day|week|month)$")
+):
+    """Sales chart for an arbitrary range, read from pre-aggregated hourly/daily buckets"""
+    if from_date.tzinfo is None:
+        from_date = from_date.replace(tzinfo=timezone.utc)
+    to_date = to_date or datetime.now(timezone.utc)
+    if to_date.tzinfo is None:
+        to_date = to_date.replace(tzinfo=timezone.utc)
+    if to_date <= from_date:
+        raise HTTPException(status_code=400, detail="'to' must be after 'from'")
+    
+    # Keep every chart to a few thousand buckets
+    max_span = timedelta(days=92) if granularity == "hour" else timedelta(days=3660)
+    if to_date - from_date > max_span:
+        raise HTTPException(status_code=400, detail=f"Range too large for {granularity} granularity")
+    
+    result = await sales_rollups.query(db, from_date, to_date, granularity)
+    return {"from": from_date, "to": to_date, "granularity": granularity, **result}
+
+@api_router.post("/admin/sales/rebuild")
+async def rebuild_sales_rollups():
+    """Recompute sales rollups from the full order history"""
+    processed = await sales_rollups.rebuild(db)
+    return {"message": "Sales rollups rebuilt", "orders": processed}
+
+# Order Archive & Background Jobs (run now instead of waiting for the schedule, or check on them)
+@api_router.post("/admin/orders/archive")
+async def archive_orders():
+    """Archive eligible orders now instead of waiting for the nightly run"""
+    archived = await order_archiver.run_once()
+    return {"message": "Orders archived", "orders": archived}
+
+@api_router.post("/admin/orders/archive/rebuild-stats")
+async def rebuild_archive_stats():
+    """Recompute the archived-order totals used by the dashboard"""
+    orders = await order_archiver.rebuild_stats()
+    return {"message": "Archive totals rebuilt", "orders": orders}
+
+@api_router.post("/admin/orders/expire-pending")
+async def expire_pending_orders():
+    """Cancel orders whose payment window has passed now instead of waiting for the sweeper"""
+    cancelled = await payment_sweeper.run_once()
+    return {"message": "Pending orders expired", "orders": cancelled}
+
+@api_router.post("/admin/feeds/rebuild")
+async def rebuild_feeds(full: bool = False):
+    """Rebuild the sitemaps and shopping feeds now; full re-renders every product"""
+    return await feed_builder.build(full=full)
+
+@api_router.get("/admin/coalescing/status")
+async def get_coalescing_status():
+    """In-flight shared reads and, per route, calls made versus requests that joined one"""
+    return request_coalescer.status()
+
+@api_router.get("/admin/notifications/status")
+async def get_notifications_status():
+    """Outbox backlog by state plus send throughput, retry and template cache counters"""
+    return await notification_dispatcher.status()
+
+@api_router.post("/admin/notifications/dispatch")
+async def dispatch_notifications():
+    """Send every due outbox message now"""
+    sent = await notification_dispatcher.run_once()
+    return {"message": "Outbox drained", "messages": sent}
+
+# Admin Reports (served from the in-memory analytics snapshot)
+@api_router.get("/admin/reports/status")
+async def get_reports_status():
+    """Size and age of the analytics snapshot"""
+    return analytics_engine.status()
+
+@api_router.post("/admin/reports/refresh")
+async def refresh_reports():
+    """Rebuild the analytics snapshot now"""
+    await analytics_engine.refresh()
+    return analytics_engine.status()
+
+@api_router.get("/admin/reports/cohort-retention")
+async def get_cohort_retention(max_months: int = Query(default=12, ge=1, le=36)):
+    """Monthly first-order cohorts and the share of each that ordered again"""
+    return {"cohorts": await analytics_engine.report(analytics.cohort_retention, max_months)}
+
+@api_router.get("/admin/reports/revenue-by-category")
+async def get_revenue_by_category(granularity: str = Query(default="month", pattern="^(day|week|month)$")):
+    """Revenue and units per product category over time"""
+    return {"granularity": granularity, "periods": await analytics_engine.report(analytics.revenue_by_category, granularity)}
+
+@api_router.get("/admin/reports/aov-by-segment")
+async def get_aov_by_segment():
+    """Average order value per customer segment"""
+    return {"segments": await analytics_engine.report(analytics.aov_by_segment)}
+
+@api_router.get("/admin/reports/discount-impact")
+async def get_discount_impact():
+    """Orders, discount and order value per coupon compared with coupon-less orders"""
+    return await analytics_engine.report(analytics.discount_impact)
+
+# Data Exports
+@api_router.post("/admin/exports")
+async def create_export(full: bool = False):
+    """Export orders, line items and customers to Parquet (incremental unless full=true)"""
+    job = await export_runner.start(full=full)
+    return job
+
+@api_router.get("/admin/exports/{job_id}")
+async def get_export(job_id: str):
+    """Get export job status"""
+    job = await db.export_jobs.find_one({"id": job_id}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Export not found")
+    return job
+
+@api_router.get("/admin/exports/{job_id}/{name}.parquet")
+async def download_export(job_id: str, name: str, request: Request):
+    """Download one Parquet file of a completed export"""
+    job = await db.export_jobs.find_one({"id": job_id, "status": "completed"}, {"_id": 0})
+    if not job or name not in EXPORT_FILES:
+        raise HTTPException(status_code=404, detail="Export not found")
     
-    # Update product
+    path = export_runner.job_dir(job_id) / f"{name}.parquet"
+    return file_response(
+        request, str(path), "application/vnd.apache.parquet", etag=f'"{job_id}-{name}"',
+        cache_control="private, max-age=3600", response_class=ZeroCopyFileResponse
+    )
+
+@api_router.put("/admin/products/{product_id}", response_model=Product)
+async def update_product(product_id: str, product_update: ProductCreate, request: Request, response: Response):
+    """Update existing product, optionally only if it is still at the If-Match version"""
+    await check_image_id(product_update.image_id)
     update_dict = product_update.dict()
     update_dict["updated_at"] = datetime.now(timezone.utc)
     prepared_data = prepare_for_mongo(update_dict)
     
-    await db.products.update_one(
-        {"id": product_id},
-        {"$set": prepared_data}
+    filter_dict = version_filter(product_id, parse_if_match(request))
+    managed = sorted(BATCH_MANAGED_FIELDS & product_update.model_fields_set)
+    if managed:
+        # Only products whose stock is still set by hand accept these
+        filter_dict["batch_tracked"] = {"$ne": True}
+    
+    # Pipeline update: batch-tracked products keep the stock their batches give them
+    tracked = {"$eq": ["$batch_tracked", True]}
+    updated_product = await db.products.find_one_and_update(
+        filter_dict,
+        [{"$set": {
+            **{key: {"$cond": [tracked, f"${key}", {"$literal": value}]} if key in BATCH_MANAGED_FIELDS
+               else {"$literal": value}
+               for key, value in prepared_data.items()},
+            "version": {"$add": [{"$ifNull": ["$version", 0]}, 1]},
+        }}],
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
     )
+    if not updated_product:
+        if managed and await db.products.find_one(
+            {"id": product_id, "batch_tracked": True}, {"_id": 1}
+        ):
+            raise HTTPException(
+                status_code=409,
+                detail=f"Stock of a batch-tracked product is managed through its batches: {', '.join(managed)}"
+            )
+        await raise_update_failed(db.products, product_id, "Product")
     
-    # Return updated product
-    updated_product = await db.products.find_one({"id": product_id})
+    invalidate_products()
+    await event_bus.publish(ChangeEvent(
+        type="product.replaced",
+        entity_id=product_id,
+        fields=sorted(prepared_data),
+        changes={key: updated_product.get(key) for key in ("price", "discounted_price", "stock_quantity", "in_stock")},
+        version=updated_product["version"],
+        actor=request_actor(request),
+    ))
+    response.headers["ETag"] = f'"{updated_product["version"]}"'
+    return Product(**parse_from_mongo(updated_product))
+
+@api_router.patch("/admin/products/{product_id}", response_model=Product)
+async def patch_product(product_id: str, patch: Dict[str, Any], request: Request, response: Response):
+    """Partially update a product; nested paths such as translations.fr.description are allowed.
+
+    Only fields whose value actually changes are written, and null removes
+    an optional field.
+    """
+    try:
+        paths = patching.flatten(patch)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    unknown = sorted({path.split(".", 1)[0] for path in paths} - PRODUCT_PATCHABLE_FIELDS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Fields cannot be patched: {', '.join(unknown)}")
+    
+    current = await db.products.find_one({"id": product_id}, {"_id": 0})
+    if not current:
+        raise HTTPException(status_code=404, detail="Product not found")
+    expected_version = parse_if_match(request)
+    current_version = current.get("version", 0)
+    if expected_version is not None and expected_version != current_version:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Product was modified by someone else (current version {current_version})"
+        )
+    if current.get("batch_tracked"):
+        managed = sorted({path.split(".", 1)[0] for path in paths} & BATCH_MANAGED_FIELDS)
+        if managed:
+            raise HTTPException(
+                status_code=409,
+                detail=f"Stock of a batch-tracked product is managed through its batches: {', '.join(managed)}"
+            )
+    
+    try:
+        candidate = Product(**patching.apply(current, paths))
+    except ValidationError as e:
+        raise HTTPException(
+            status_code=422,
+            detail=[{"loc": err["loc"], "msg": err["msg"], "type": err["type"]} for err in e.errors()]
+        )
+    to_set, to_unset = patching.diff(current, prepare_for_mongo(candidate.dict()), paths)
+    if not to_set and not to_unset:
+        response.headers["ETag"] = f'"{current_version}"'
+        return Product(**parse_from_mongo(current))
+    if "image_id" in to_set:
+        await check_image_id(to_set["image_id"])
+    
+    update = {"$set": {**to_set, "updated_at": datetime.now(timezone.utc).isoformat()}, "$inc": {"version": 1}}
+    if to_unset:
+        update["$unset"] = {path: "" for path in to_unset}
+    # Guard on the version the diff was computed against
+    updated_product = await db.products.find_one_and_update(
+        version_filter(product_id, current_version),
+        update,
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    if not updated_product:
+        await raise_update_failed(db.products, product_id, "Product")
+    
+    await event_bus.publish(ChangeEvent(
+        type="product.updated",
+        entity_id=product_id,
+        fields=sorted([*to_set, *to_unset]),
+        changes=to_set,
+        previous={path: patching.get_path(current, path) for path in [*to_set, *to_unset]
+                  if patching.get_path(current, path) is not patching.MISSING},
+        removed=to_unset,
+        version=updated_product["version"],
+        actor=request_actor(request),
+    ))
+    response.headers["ETag"] = f'"{updated_product["version"]}"'
     return Product(**parse_from_mongo(updated_product))
 
 @api_router.delete("/admin/products/{product_id}")
-async def delete_product(product_id: str):
+async def delete_product(product_id: str, request: Request):
     """Delete product"""
     result = await db.products.delete_one({"id": product_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Product not found")
     
+    invalidate_products()
+    await event_bus.publish(ChangeEvent(type="product.deleted", entity_id=product_id, actor=request_actor(request)))
     return {"message": "Product deleted successfully"}
 
+@api_router.post("/admin/products/{product_id}/batches", response_model=InventoryBatch)
+async def receive_inventory_batch(product_id: str, batch: InventoryBatchCreate, request: Request):
+    """Receive a batch of stock for a product"""
+    product = await db.products.find_one({"id": product_id}, {"_id": 0, "id": 1})
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+    
+    record = await inventory.receive_batch(db, product_id, batch.dict())
+    invalidate_products()
+    await event_bus.publish(ChangeEvent(
+        type="product.stock_received",
+        entity_id=product_id,
+        fields=["stock_quantity"],
+        changes={"batch_id": record["id"], "batch_number": record["batch_number"], "quantity": record["quantity"]},
+        actor=request_actor(request),
+    ))
+    return InventoryBatch(**parse_from_mongo(record))
+
+@api_router.get("/admin/products/{product_id}/batches", response_model=List[InventoryBatch])
+async def get_inventory_batches(product_id: str, include_empty: bool = False):
+    """Get a product's batches in FEFO order"""
+    filter_dict = {"product_id": product_id}
+    if not include_empty:
+        filter_dict["quantity"] = {"$gt": 0}
+    batches = await db.inventory_batches.find(filter_dict, {"_id": 0}).sort("expiry_date", 1).to_list(length=None)
+    return [InventoryBatch(**parse_from_mongo(batch)) for batch in batches]
+
+@api_router.get("/admin/inventory/expiring", response_model=List[InventoryBatch])
+async def get_expiring_inventory(days: int = Query(default=30, ge=1, le=365)):
+    """Get batches with stock that expire within the given number of days"""
+    batches = await inventory.expiring_soon(db, days)
+    return [InventoryBatch(**parse_from_mongo(batch)) for batch in batches]
+
+@api_router.post("/admin/inventory/sweep")
+async def sweep_inventory():
+    """Write off expired batches now instead of waiting for the sweeper"""
+    return await expiry_sweeper.sweep()
+
+@api_router.get("/admin/audit/{entity_id}")
+async def get_audit_history(
+    entity_id: str,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: int = Query(default=100, ge=1, le=1000)
+):
+    """Change history of a product or order, newest first"""
+    return await audit_log.history(entity_id, since, until, limit)
+
+@api_router.post("/admin/webhooks", response_model=WebhookSubscriptionCreated)
+async def create_webhook(subscription: WebhookSubscriptionCreate):
+    """Register an endpoint for order and stock events; the signing secret is only returned here"""
+    if not subscription.url.startswith(("https://", "http://")):
+        raise HTTPException(status_code=400, detail="Webhook URL must be http(s)")
+    if not subscription.events:
+        raise HTTPException(status_code=400, detail="Subscribe to at least one event type")
+    webhook = WebhookSubscriptionCreated(**subscription.dict(), secret=secrets.token_urlsafe(32))
+    await db.webhook_subscriptions.insert_one(prepare_for_mongo(webhook.dict()))
+    await webhook_engine.reload()
+    return webhook
+
+@api_router.get("/admin/webhooks", response_model=List[WebhookSubscription])
+async def get_webhooks():
+    """Get registered webhook endpoints"""
+    subscriptions = await db.webhook_subscriptions.find({}, {"_id": 0, "secret": 0}).to_list(length=None)
+    return [WebhookSubscription(**parse_from_mongo(subscription)) for subscription in subscriptions]
+
+@api_router.get("/admin/webhooks/status")
+async def get_webhooks_status():
+    """Delivery counts per endpoint and state, plus request and retry counters"""
+    return await webhook_engine.status()
+
+@api_router.delete("/admin/webhooks/{webhook_id}")
+async def delete_webhook(webhook_id: str):
+    """Remove an endpoint and drop its undelivered events"""
+    result = await db.webhook_subscriptions.delete_one({"id": webhook_id})
+    if result.deleted_count == 0:
+        raise HTTPException(status_code=404, detail="Webhook not found")
+    
+    await db.webhook_deliveries.delete_many({"subscription_id": webhook_id, "state": {"$in": ["pending", "sending"]}})
+    await webhook_engine.reload(webhook_id)
+    return {"message": "Webhook deleted successfully"}
+
+@api_router.get("/admin/webhooks/{webhook_id}/deliveries")
+async def get_webhook_deliveries(
+    webhook_id: str,
+    state: Optional[str] = Query(default=None, pattern="^(pending|sending|delivered|failed)$"),
+    limit: int = Query(default=50, ge=1, le=500)
+):
+    """Most recent deliveries to an endpoint with their attempts and last error"""
+    filter_dict = {"subscription_id": webhook_id}
+    if state:
+        filter_dict["state"] = state
+    return await db.webhook_deliveries.find(filter_dict).sort("_id", -1).limit(limit).to_list(length=None)
+
+@api_router.post("/admin/webhooks/{webhook_id}/redeliver")
+async def redeliver_webhook_events(webhook_id: str):
+    """Queue an endpoint's failed deliveries again"""
+    result = await db.webhook_deliveries.update_many(
+        {"subscription_id": webhook_id, "state": "failed"},
+        {"$set": {"state": "pending", "attempts": 0, "next_attempt_at": datetime.now(timezone.utc).isoformat()}},
+    )
+    return {"message": "Deliveries queued", "deliveries": result.modified_count}
+
 @api_router.get("/admin/carts", response_model=List[Cart])
 async def get_all_carts():
     """Get all carts for admin"""
@@ -773,9 +1816,11 @@ async def create_order(order: OrderCreate):
     
     # Apply coupon if provided
     discount_amount = 0.0
+    applied_coupon = None
     if order.coupon_code:
         coupon = await db.coupons.find_one({"code": order.coupon_code, "is_active": True})
         if coupon and coupon.get("valid_until") and datetime.fromisoformat(coupon["valid_until"]) > datetime.now(timezone.utc):
+            applied_coupon = coupon["code"]
             if coupon["discount_type"] == "percentage":
                 discount_amount = subtotal * (coupon["discount_value"] / 100)
             elif coupon["discount_type"] == "fixed_amount":
@@ -785,18 +1830,42 @@ async def create_order(order: OrderCreate):
     
     total_amount = subtotal + tax_amount + shipping_cost - discount_amount
     
+    # Reserve batch-tracked stock, earliest expiry first
+    products = await fetch_products_by_id([item.product_id for item in order.items])
+    tracked = {product_id for product_id, product in products.items() if product.get("batch_tracked")}
+    try:
+        allocations = await inventory.allocate(db, [item.dict() for item in order.items], tracked)
+    except InsufficientStock as e:
+        raise HTTPException(status_code=409, detail=f"Insufficient stock for product {e.product_id}")
+    if allocations:
+        invalidate_products()
+    
     order_dict = order.dict()
     order_dict.update({
         "subtotal": subtotal,
         "tax_amount": tax_amount,
         "shipping_cost": shipping_cost,
         "discount_amount": discount_amount,
-        "total_amount": total_amount
+        "total_amount": total_amount,
+        "batch_allocations": allocations,
+        "coupon_code": applied_coupon  # only coupons that were honoured count as used
     })
     
     order_obj = Order(**order_dict)
     prepared_data = prepare_for_mongo(order_obj.dict())
-    await db.orders.insert_one(prepared_data)
+    try:
+        await db.orders.insert_one(prepared_data)
+    except Exception:
+        # The order never existed, so put the stock it reserved back
+        if allocations:
+            await inventory.release(db, allocations)
+            invalidate_products()
+        raise
+    prepared_data.pop("_id", None)
+    if sales_rollups.counts_as_sale(prepared_data["status"]):
+        await sales_rollups.record_orders(db, [prepared_data])
+    if applied_coupon:
+        await db.coupons.update_one({"code": applied_coupon}, {"$inc": {"current_usage_count": 1}})
     
     # Update customer stats
     await db.users.update_one(
@@ -807,6 +1876,11 @@ async def create_order(order: OrderCreate):
         }
     )
     
+    await event_bus.publish(ChangeEvent(
+        type="order.created", entity_id=order_obj.id, fields=sorted(prepared_data), changes=prepared_data, version=0
+    ))
+    if allocations:
+        await publish_stock_changes({allocation["product_id"] for allocation in allocations})
     return order_obj
 
 @api_router.get("/orders", response_model=List[Order])
@@ -828,32 +1902,164 @@ async def get_orders(
     return [Order(**parse_from_mongo(order)) for order in orders]
 
 @api_router.get("/orders/{order_id}", response_model=Order)
-async def get_order(order_id: str):
+async def get_order(order_id: str, response: Response):
     """Get single order by ID"""
     order = await db.orders.find_one({"id": order_id})
+    if not order:
+        order = await db.orders_archive.find_one({"id": order_id})
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
+    response.headers["ETag"] = f'"{order.get("version", 0)}"'
     return Order(**parse_from_mongo(order))
 
 @api_router.put("/orders/{order_id}", response_model=Order)
-async def update_order(order_id: str, order_update: OrderUpdate):
-    """Update order status and details"""
-    existing_order = await db.orders.find_one({"id": order_id})
-    if not existing_order:
-        raise HTTPException(status_code=404, detail="Order not found")
-    
+async def update_order(order_id: str, order_update: OrderUpdate, request: Request, response: Response):
+    """Update order status and details, optionally only if it is still at the If-Match version"""
     update_dict = order_update.dict(exclude_unset=True)
     update_dict["updated_at"] = datetime.now(timezone.utc)
     prepared_data = prepare_for_mongo(update_dict)
     
-    await db.orders.update_one(
-        {"id": order_id},
-        {"$set": prepared_data}
+    # The document as it was tells us the status being replaced; the new state follows from the update
+    previous_order = await db.orders.find_one_and_update(
+        version_filter(order_id, parse_if_match(request)),
+        {"$set": prepared_data, "$inc": {"version": 1}},
+        projection={"_id": 0},
+        return_document=ReturnDocument.BEFORE
     )
+    if not previous_order:
+        await raise_update_failed(db.orders, order_id, "Order")
+    updated_order = {**previous_order, **prepared_data, "version": previous_order.get("version", 0) + 1}
+    previous_status = previous_order.get("status")
     
-    updated_order = await db.orders.find_one({"id": order_id})
+    if "status" in update_dict:
+        await sales_rollups.record_status_change(db, updated_order, previous_status, update_dict["status"])
+        # Cancelled orders give their reserved batches back
+        if (update_dict["status"] == OrderStatus.CANCELLED and previous_status != OrderStatus.CANCELLED
+                and updated_order.get("batch_allocations")):
+            await inventory.release(db, updated_order["batch_allocations"])
+            invalidate_products()
+            await publish_stock_changes({allocation["product_id"] for allocation in updated_order["batch_allocations"]})
+        new_status = getattr(update_dict["status"], "value", update_dict["status"])
+        if new_status and new_status != previous_status:
+            await queue_status_emails([(order_id, new_status)])
+    
+    await event_bus.publish(ChangeEvent(
+        type="order.updated",
+        entity_id=order_id,
+        fields=sorted(key for key in prepared_data if key != "updated_at"),
+        changes={key: value for key, value in prepared_data.items() if key != "updated_at"},
+        previous={"status": previous_status} if "status" in update_dict else {},
+        version=updated_order["version"],
+        actor=request_actor(request),
+    ))
+    response.headers["ETag"] = f'"{updated_order["version"]}"'
     return Order(**parse_from_mongo(updated_order))
 
+async def publish_stock_changes(product_ids, actor: Optional[str] = None):
+    """Tell subscribers (webhooks, caches) the stock levels a write left behind"""
+    products = await db.products.find(
+        {"id": {"$in": list(product_ids)}}, {"_id": 0, "id": 1, "stock_quantity": 1, "in_stock": 1, "version": 1}
+    ).to_list(length=None)
+    for product in products:
+        await event_bus.publish(ChangeEvent(
+            type="product.stock_changed",
+            entity_id=product["id"],
+            fields=["in_stock", "stock_quantity"],
+            changes={"stock_quantity": product.get("stock_quantity"), "in_stock": product.get("in_stock")},
+            version=product.get("version"),
+            actor=actor,
+        ))
+
+async def publish_bulk_stock_changes(results: List[Dict[str, Any]], actor: Optional[str]):
+    """Stock events (and cache invalidation through them) for orders a bulk update cancelled"""
+    cancelled = [result["order_id"] for result in results
+                 if result["ok"] and result["status"] == OrderStatus.CANCELLED
+                 and result["previous_status"] != OrderStatus.CANCELLED]
+    if not cancelled:
+        return
+    orders = await db.orders.find(
+        {"id": {"$in": cancelled}}, {"_id": 0, "batch_allocations.product_id": 1}
+    ).to_list(length=None)
+    product_ids = {allocation["product_id"] for order in orders for allocation in order.get("batch_allocations") or []}
+    await publish_stock_changes(product_ids, actor)
+
+async def queue_status_emails(changes: List[Tuple[str, str]]):
+    """Write outbox entries for status changes customers are told about and wake the dispatcher"""
+    if await notifications.enqueue(db, changes):
+        notification_dispatcher.notify()
+
+def bulk_status_changes(results: List[Dict[str, Any]]) -> List[Tuple[str, str]]:
+    return [(result["order_id"], result["status"]) for result in results
+            if result["ok"] and result["status"] != result["previous_status"]]
+
+async def on_payments_expired(orders: List[Dict[str, Any]]):
+    """Emails, events and stock updates for orders the payment sweeper cancelled"""
+    await queue_status_emails([(order["id"], OrderStatus.CANCELLED.value) for order in orders])
+    for order in orders:
+        await event_bus.publish(ChangeEvent(
+            type="order.updated",
+            entity_id=order["id"],
+            fields=["cancel_reason", "status"],
+            changes={"status": OrderStatus.CANCELLED.value, "cancel_reason": "payment_expired"},
+            previous={"status": OrderStatus.PENDING_PAYMENT.value},
+            version=order.get("version", 0) + 1,
+        ))
+    product_ids = {allocation["product_id"] for order in orders for allocation in order.get("batch_allocations") or []}
+    if product_ids:
+        await publish_stock_changes(product_ids)
+
+async def publish_bulk_order_events(rows: List[Dict[str, Any]], results: List[Dict[str, Any]], actor: Optional[str]):
+    for row, result in zip(rows, results):
+        if not result["ok"]:
+            continue
+        changes = {key: getattr(row[key], "value", row[key]) for key in ("status", "tracking_number") if row.get(key)}
+        await event_bus.publish(ChangeEvent(
+            type="order.updated",
+            entity_id=result["order_id"],
+            fields=sorted(changes),
+            changes=changes,
+            previous={"status": result["previous_status"]} if "status" in changes else {},
+            actor=actor,
+        ))
+
+@api_router.post("/admin/orders/bulk-update", response_model=BulkOrderUpdateResponse)
+async def bulk_update_orders(batch: BulkOrderUpdate, request: Request):
+    """Update status and tracking for many orders in one write"""
+    rows = [row.dict() for row in batch.updates]
+    results = await order_bulk.apply_updates(db, rows)
+    await queue_status_emails(bulk_status_changes(results))
+    await publish_bulk_order_events(rows, results, request_actor(request))
+    await publish_bulk_stock_changes(results, request_actor(request))
+    updated = sum(result["ok"] for result in results)
+    return BulkOrderUpdateResponse(updated=updated, failed=len(results) - updated, results=results)
+
+@api_router.post("/admin/orders/bulk-update.csv")
+async def bulk_update_orders_csv(request: Request):
+    """Apply an order_id,status,tracking_number CSV manifest as it uploads.
+
+    Rows are applied in batches while the body is still streaming in and
+    the per-row results come back as CSV.
+    """
+    batch_size = int(os.environ.get('BULK_UPDATE_BATCH_SIZE', '1000'))
+    parts = []
+    batch = []
+
+    async def flush():
+        results = await order_bulk.apply_updates(db, batch)
+        await queue_status_emails(bulk_status_changes(results))
+        await publish_bulk_order_events(batch, results, request_actor(request))
+        await publish_bulk_stock_changes(results, request_actor(request))
+        parts.append(order_bulk.csv_results(results, header=not parts))
+
+    async for row in order_bulk.csv_rows(request.stream()):
+        batch.append(row)
+        if len(batch) >= batch_size:
+            await flush()
+            batch = []
+    if batch or not parts:
+        await flush()
+    return Response(content="".join(parts), media_type="text/csv")
+
 # Customer Routes
 @api_router.get("/customers", response_model=List[User])
 async def get_customers(
@@ -869,6 +2075,22 @@ async def get_customers(
     customers = await db.users.find(filter_dict).sort("created_at", -1).skip(skip).limit(limit).to_list(length=None)
     return [User(**parse_from_mongo(customer)) for customer in customers]
 
+@api_router.get("/customers/search", response_model=List[User])
+async def search_customers(
+    q: str = Query(min_length=1, max_length=100),
+    limit: int = Query(default=20, ge=1, le=50)
+):
+    """Find customers by email prefix, phone prefix or name.
+
+    Names match regardless of case, accents, harakat and alef/hamza/taa
+    marbuta spelling, using the precomputed search keys.
+    """
+    query = customer_search.build_query(q)
+    if query is None:
+        return []
+    customers = await db.users.find(query, {"_id": 0, "search": 0}).limit(limit).to_list(length=None)
+    return [User(**parse_from_mongo(customer)) for customer in customers]
+
 @api_router.get("/customers/{customer_id}", response_model=User)
 async def get_customer(customer_id: str):
     """Get single customer by ID"""
@@ -877,6 +2099,29 @@ async def get_customer(customer_id: str):
         raise HTTPException(status_code=404, detail="Customer not found")
     return User(**parse_from_mongo(customer))
 
+@api_router.get("/customers/{customer_id}/orders", response_model=List[OrderSummary])
+async def get_customer_orders(
+    customer_id: str,
+    before: Optional[datetime] = None,
+    limit: int = Query(default=20, ge=1, le=100)
+):
+    """Compact order history for a customer, newest first.
+
+    Answered from the customer order-history index alone; pass the last
+    created_at as `before` to get the next page. Use /orders/{id} for details.
+    """
+    filter_dict = {"customer_id": customer_id}
+    if before:
+        if before.tzinfo is None:
+            before = before.replace(tzinfo=timezone.utc)
+        filter_dict["created_at"] = {"$lt": before.astimezone(timezone.utc).isoformat()}
+    # Same covered query on the hot and archived orders, merged by date
+    orders = []
+    for collection in (db.orders, db.orders_archive):
+        orders += await collection.find(filter_dict, ORDER_SUMMARY_PROJECTION).sort("created_at", -1).limit(limit).to_list(length=None)
+    orders.sort(key=lambda order: order["created_at"], reverse=True)
+    return [OrderSummary(**order) for order in orders[:limit]]
+
 # Coupon Routes
 @api_router.post("/coupons", response_model=Coupon)
 async def create_coupon(coupon: CouponCreate):
@@ -910,26 +2155,91 @@ async def get_coupons(
 async def create_blog_post(post: BlogPostCreate):
     """Create a new blog post"""
     post_obj = BlogPost(**post.dict())
+    post_obj.content_html = await run_in_threadpool(render_content, post_obj.content)
+    post_obj.content_hash = content_hash(post_obj.content)
     prepared_data = prepare_for_mongo(post_obj.dict())
     await db.blog_posts.insert_one(prepared_data)
+    catalog_cache.invalidate("blog")
     return post_obj
 
-@api_router.get("/blog", response_model=List[BlogPost])  
+@api_router.put("/blog/{post_id}", response_model=BlogPost)
+async def update_blog_post(post_id: str, post_update: BlogPostUpdate):
+    """Update a blog post, re-rendering its HTML only when the content changed"""
+    existing_post = await db.blog_posts.find_one({"id": post_id})
+    if not existing_post:
+        raise HTTPException(status_code=404, detail="Blog post not found")
+    
+    update_dict = post_update.dict(exclude_unset=True)
+    if "content" in update_dict:
+        new_hash = content_hash(update_dict["content"])
+        if new_hash != existing_post.get("content_hash"):
+            update_dict["content_html"] = await run_in_threadpool(render_content, update_dict["content"])
+            update_dict["content_hash"] = new_hash
+    update_dict["updated_at"] = datetime.now(timezone.utc)
+    prepared_data = prepare_for_mongo(update_dict)
+    
+    await db.blog_posts.update_one(
+        {"id": post_id},
+        {"$set": prepared_data}
+    )
+    catalog_cache.invalidate("blog")
+    
+    updated_post = await db.blog_posts.find_one({"id": post_id})
+    return BlogPost(**parse_from_mongo(updated_post))
+
+@api_router.get("/blog", response_model=List[BlogPostSummary])
 async def get_blog_posts(
+    request: Request,
     published: Optional[bool] = None,
     featured: Optional[bool] = None,
     limit: int = Query(default=20, le=100),
     skip: int = Query(default=0, ge=0)
 ):
-    """Get blog posts with optional filtering"""
+    """Get blog post summaries (title and excerpt only) with optional filtering"""
+    cache_key = catalog_cache.key_for(request)
+    cached = catalog_cache.get(cache_key)
+    if cached:
+        return await cached.to_response(request)
+    
     filter_dict = {}
     if published is not None:
         filter_dict["published"] = published
     if featured is not None:
         filter_dict["featured"] = featured
     
-    posts = await db.blog_posts.find(filter_dict).sort("created_at", -1).skip(skip).limit(limit).to_list(length=None)
-    return [BlogPost(**parse_from_mongo(post)) for post in posts]
+    posts = await db.blog_posts.find(
+        filter_dict, {"_id": 0, "content": 0, "content_html": 0}
+    ).sort("created_at", -1).skip(skip).limit(limit).to_list(length=None)
+    result = [BlogPostSummary(**parse_from_mongo(post)) for post in posts]
+    return await catalog_cache.put(cache_key, result, tags=["blog"]).to_response(request)
+
+@api_router.get("/blog/{post_id}", response_model=BlogPost)
+async def get_blog_post(post_id: str, request: Request, lang: Optional[Language] = None):
+    """Get a single blog post with its pre-rendered HTML, optionally for one language"""
+    cache_key = catalog_cache.key_for(request)
+    cached = catalog_cache.get(cache_key)
+    if cached:
+        return await cached.to_response(request)
+    
+    post = await db.blog_posts.find_one({"id": post_id}, {"_id": 0})
+    if not post:
+        raise HTTPException(status_code=404, detail="Blog post not found")
+    
+    # Posts written before HTML pre-rendering are rendered once and backfilled
+    if post.get("content_hash") != content_hash(post["content"]):
+        post["content_html"] = await run_in_threadpool(render_content, post["content"])
+        post["content_hash"] = content_hash(post["content"])
+        await db.blog_posts.update_one(
+            {"id": post_id},
+            {"$set": {"content_html": post["content_html"], "content_hash": post["content_hash"]}}
+        )
+    
+    if lang:
+        for field in ("title", "excerpt", "content", "content_html"):
+            post[field] = {lang.value: post.get(field, {}).get(lang.value, "")}
+    
+    result = BlogPost(**parse_from_mongo(post))
+    return await catalog_cache.put(cache_key, result, tags=["blog"]).to_response(request)
 
 @api_router.post("/admin/init-sample-data")
 async def init_sample_data():
@@ -959,8 +2269,8 @@ async def init_sample_data():
         )
         
         # Insert customers
-        await db.users.insert_one(prepare_for_mongo(customer_1.dict()))
-        await db.users.insert_one(prepare_for_mongo(customer_2.dict()))
+        for customer in (customer_1, customer_2):
+            await db.users.insert_one(customer_search.with_search_fields(prepare_for_mongo(customer.dict())))
         
         # Get products for orders
         products = await db.products.find().to_list(length=None)
@@ -1023,8 +2333,10 @@ async def init_sample_data():
         )
         
         # Insert orders
-        await db.orders.insert_one(prepare_for_mongo(order_1.dict()))
-        await db.orders.insert_one(prepare_for_mongo(order_2.dict()))
+        sample_orders = [prepare_for_mongo(order_1.dict()), prepare_for_mongo(order_2.dict())]
+        for order_data in sample_orders:
+            await db.orders.insert_one(order_data)
+        await sales_rollups.record_orders(db, sample_orders)
         
         return {
             "message": "Sample data initialized successfully",
@@ -1065,6 +2377,25 @@ async def init_default_admin():
 # Include the router in the main app
 app.include_router(api_router)
 
+# Rate limiting: per-process buckets by default, shared through Mongo when
+# several workers serve the same clients (RATE_LIMIT_BACKEND=mongo)
+if os.environ.get('RATE_LIMIT_BACKEND', 'memory') == 'mongo':
+    rate_limit_store = MongoBucketStore(db.rate_limits)
+else:
+    rate_limit_store = MemoryBucketStore()
+
+app.add_middleware(
+    RateLimitMiddleware,
+    store=rate_limit_store,
+    monitor=load_monitor,
+    max_loop_lag=float(os.environ.get('LOAD_SHED_MAX_LOOP_LAG_MS', '500')) / 1000,
+    max_pool_wait=float(os.environ.get('LOAD_SHED_MAX_POOL_WAIT_MS', '250')) / 1000,
+    # Addresses/CIDRs of the reverse proxies whose X-Forwarded-For hops are believed
+    trusted_proxies=os.environ.get('TRUSTED_PROXIES', '').split(','),
+)
+
+app.add_middleware(CompressionMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -1080,6 +2411,59 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def create_indexes():
+    await db.products.create_index("id", unique=True)
+    # Single-order writes, bulk updates, archiving and the sweepers all look orders up by id
+    await db.orders.create_index("id", unique=True)
+    await db.users.create_index("id", unique=True)
+    await db.carts.create_index("id", unique=True)
+    await db.blog_posts.create_index("id", unique=True)
+    await db.blog_posts.create_index([("published", 1), ("featured", 1), ("created_at", -1)])
+    await db.sales_rollups.create_index([("granularity", 1), ("bucket", 1)])
+    await db.orders.create_index("updated_at")
+    await db.orders.create_index(ORDER_SUMMARY_INDEX, name="customer_order_history")
+    await run_migration("order_item_count", backfill_order_item_counts)
+    await order_archiver.ensure_collection()
+    await db.orders_archive.create_index(ORDER_SUMMARY_INDEX, name="customer_order_history")
+    await customer_search.ensure_indexes(db)
+    await run_migration("customer_search_fields", lambda: customer_search.backfill(db))
+    await db.users.create_index("updated_at")
+    await payment_sweeper.ensure_indexes()
+    # Revenue used to include pending_payment orders; recount it from paid ones
+    await run_migration("paid_only_revenue", rebuild_paid_revenue)
+    await db.export_jobs.create_index("id", unique=True)
+    await inventory.ensure_indexes(db)
+    await audit_log.ensure_collection()
+    await feed_builder.ensure_indexes()
+    await notification_dispatcher.ensure_indexes()
+    await webhook_engine.ensure_indexes()
+
+@app.on_event("startup")
+async def start_background_tasks():
+    load_monitor.start()
+    analytics_engine.start()
+    expiry_sweeper.start()
+    audit_log.start()
+    order_archiver.start()
+    feed_builder.start()
+    notification_dispatcher.start()
+    webhook_engine.start()
+    payment_sweeper.start()
+    if isinstance(rate_limit_store, MongoBucketStore):
+        await rate_limit_store.ensure_indexes()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await load_monitor.stop()
+    await analytics_engine.stop()
+    await expiry_sweeper.stop()
+    await audit_log.stop()
+    await order_archiver.stop()
+    await feed_builder.stop()
+    await notification_dispatcher.stop()
+    await webhook_engine.stop()
+    await payment_sweeper.stop()
+    image_store.shutdown()
+    export_runner.shutdown()
     client.close()
\ No newline at end of file
@@ -0,0 +1,322 @@
+"""Signed, batched, retried delivery of change events to registered webhook endpoints"""
+import asyncio
+import fnmatch
+import hashlib
+import hmac
+import json
+import logging
+import random
+import time
+from datetime import datetime, timezone, timedelta
+from typing import Any, Dict, List, Optional
+
+import httpx
+from pymongo import UpdateOne
+
+from events import ChangeEvent
+from ids import new_id
+
+
+logger = logging.getLogger(__name__)
+
+# 408 and 429 are worth retrying; any other 4xx will not get better
+RETRYABLE_STATUS = {408, 429}
+
+
+def sign(secret: str, timestamp: str, body: bytes) -> str:
+    """HMAC-SHA256 over "<timestamp>.<body>", the value of X-Webhook-Signature"""
+    digest = hmac.new(secret.encode(), timestamp.encode() + b"." + body, hashlib.sha256).hexdigest()
+    return f"sha256={digest}"
+
+
+def event_payload(event: ChangeEvent) -> Dict[str, Any]:
+    return {
+        "type": event.type,
+        "entity_id": event.entity_id,
+        "changes": event.changes,
+        "previous": event.previous,
+        "removed": event.removed,
+        "version": event.version,
+        "occurred_at": event.ts.isoformat(),
+    }
+
+
+class WebhookEngine:
+    """Fans events out to matching subscriptions and delivers them per endpoint.
+
+    Every (subscription, event) pair is stored in webhook_deliveries with a
+    time-ordered id before the publishing request returns. One worker per
+    endpoint claims due deliveries in id order, posts them in batches over
+    that endpoint's own connection pool with at most max_concurrency
+    requests in flight, and records the outcome. Ordered subscriptions send
+    one batch at a time and hold later events back while a batch is being
+    retried.
+    """
+
+    def __init__(self, db, batch_size: int = 50, interval: float = 2.0, timeout: float = 10.0,
+                 max_attempts: int = 10, retry_base: float = 5.0, retry_max: float = 3600.0, lease: float = 120.0):
+        self.db = db
+        self.batch_size = batch_size
+        self.interval = interval
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.lease = lease
+        self.metrics = {"events_queued": 0, "events_delivered": 0, "events_failed": 0,
+                        "requests": 0, "request_errors": 0, "retries": 0, "request_seconds": 0.0}
+        self._subscriptions: Optional[List[Dict[str, Any]]] = None
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._workers: Dict[str, asyncio.Task] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._wake = asyncio.Event()
+
+    async def ensure_indexes(self):
+        await self.db.webhook_subscriptions.create_index("id", unique=True)
+        await self.db.webhook_deliveries.create_index([("subscription_id", 1), ("state", 1), ("_id", 1)])
+        await self.db.webhook_deliveries.create_index([("state", 1), ("next_attempt_at", 1)])
+
+    async def subscriptions(self) -> List[Dict[str, Any]]:
+        if self._subscriptions is None:
+            self._subscriptions = await self.db.webhook_subscriptions.find(
+                {"active": True}, {"_id": 0}
+            ).to_list(length=None)
+        return self._subscriptions
+
+    async def reload(self, subscription_id: Optional[str] = None):
+        """Forget cached subscriptions and the pool of one that changed"""
+        self._subscriptions = None
+        client = self._clients.pop(subscription_id, None) if subscription_id else None
+        if client is not None:
+            await client.aclose()
+
+    async def on_event(self, event: ChangeEvent):
+        """Event bus handler: persist one delivery per matching subscription"""
+        matching = [
+            subscription for subscription in await self.subscriptions()
+            if any(fnmatch.fnmatchcase(event.type, pattern) for pattern in subscription["events"])
+        ]
+        if not matching:
+            return
+        payload = event_payload(event)
+        now = datetime.now(timezone.utc).isoformat()
+        deliveries = []
+        for subscription in matching:
+            event_id = new_id()
+            deliveries.append({
+                "_id": event_id,
+                "subscription_id": subscription["id"],
+                "event": {"id": event_id, **payload},
+                "state": "pending",
+                "attempts": 0,
+                "next_attempt_at": now,
+                "created_at": now,
+            })
+        await self.db.webhook_deliveries.insert_many(deliveries)
+        self.metrics["events_queued"] += len(deliveries)
+        self._wake.set()
+
+    def _client(self, subscription: Dict[str, Any]) -> httpx.AsyncClient:
+        client = self._clients.get(subscription["id"])
+        if client is None:
+            size = subscription.get("max_concurrency", 4)
+            client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=size, max_keepalive_connections=size),
+            )
+            self._clients[subscription["id"]] = client
+        return client
+
+    async def _claim(self, subscription: Dict[str, Any], limit: int) -> List[Dict[str, Any]]:
+        now = datetime.now(timezone.utc)
+        due = {"$or": [
+            {"state": "pending", "next_attempt_at": {"$lte": now.isoformat()}},
+            {"state": "sending", "leased_until": {"$lt": now.isoformat()}},
+        ]}
+        ordered = subscription.get("ordered", True)
+        if ordered:
+            # Only the run of due events at the head of the queue: nothing overtakes
+            # an older undelivered event, even while it waits for a retry
+            queued = await self.db.webhook_deliveries.find(
+                {"subscription_id": subscription["id"], "state": {"$in": ["pending", "sending"]}},
+                {"_id": 1, "state": 1, "next_attempt_at": 1, "leased_until": 1},
+            ).sort("_id", 1).limit(limit).to_list(length=None)
+            candidates = []
+            for doc in queued:
+                if not self._due(doc, now):
+                    break
+                candidates.append(doc)
+        else:
+            candidates = await self.db.webhook_deliveries.find(
+                {"subscription_id": subscription["id"], **due}, {"_id": 1}
+            ).sort("_id", 1).limit(limit).to_list(length=None)
+        if not candidates:
+            return []
+        token = new_id()
+        await self.db.webhook_deliveries.update_many(
+            {"_id": {"$in": [doc["_id"] for doc in candidates]}, **due},
+            {"$set": {"state": "sending", "lease": token,
+                      "leased_until": (now + timedelta(seconds=self.lease)).isoformat()}},
+        )
+        claimed = await self.db.webhook_deliveries.find(
+            {"lease": token, "state": "sending"}
+        ).sort("_id", 1).to_list(length=None)
+        if ordered:
+            # Another worker may have taken part of the run; keep only our unbroken prefix
+            prefix = 0
+            while prefix < len(claimed) and claimed[prefix]["_id"] == candidates[prefix]["_id"]:
+                prefix += 1
+            if prefix < len(claimed):
+                await self.db.webhook_deliveries.update_many(
+                    {"_id": {"$in": [doc["_id"] for doc in claimed[prefix:]]}, "lease": token},
+                    {"$set": {"state": "pending"}, "$unset": {"lease": "", "leased_until": ""}},
+                )
+                claimed = claimed[:prefix]
+        return claimed
+
+    @staticmethod
+    def _due(doc: Dict[str, Any], now: datetime) -> bool:
+        if doc["state"] == "pending":
+            return doc.get("next_attempt_at", "") <= now.isoformat()
+        return doc.get("leased_until", "") < now.isoformat()
+
+    def _retry_delay(self, attempts: int) -> float:
+        # Full jitter keeps endpoints that come back from being hit by every retry at once
+        return random.uniform(0, min(self.retry_max, self.retry_base * 2 ** (attempts - 1)))
+
+    async def _post(self, subscription: Dict[str, Any], batch: List[Dict[str, Any]]) -> Optional[str]:
+        """Send one batch; returns None on success, "retry: ..." or "fail: ..." otherwise"""
+        body = json.dumps(
+            {"subscription_id": subscription["id"], "events": [delivery["event"] for delivery in batch]},
+            default=str, separators=(",", ":"),
+        ).encode()
+        timestamp = str(int(time.time()))
+        headers = {
+            "Content-Type": "application/json",
+            "X-Webhook-Id": batch[0]["_id"],
+            "X-Webhook-Timestamp": timestamp,
+            "X-Webhook-Signature": sign(subscription["secret"], timestamp, body),
+        }
+        started = time.perf_counter()
+        self.metrics["requests"] += 1
+        try:
+            response = await self._client(subscription).post(subscription["url"], content=body, headers=headers)
+        except httpx.HTTPError as e:
+            self.metrics["request_errors"] += 1
+            return f"retry: {e.__class__.__name__}"
+        finally:
+            self.metrics["request_seconds"] += time.perf_counter() - started
+        if response.is_success:
+            return None
+        self.metrics["request_errors"] += 1
+        if response.status_code >= 500 or response.status_code in RETRYABLE_STATUS:
+            return f"retry: HTTP {response.status_code}"
+        return f"fail: HTTP {response.status_code}"
+
+    def _outcome(self, delivery: Dict[str, Any], error: Optional[str], now: datetime, delay: float) -> UpdateOne:
+        attempts = delivery.get("attempts", 0) + 1
+        update: Dict[str, Any] = {"attempts": attempts, "last_attempt_at": now.isoformat()}
+        if error is None:
+            self.metrics["events_delivered"] += 1
+            update.update(state="delivered", delivered_at=now.isoformat())
+        elif error.startswith("fail") or attempts >= self.max_attempts:
+            self.metrics["events_failed"] += 1
+            update.update(state="failed", error=error)
+        else:
+            self.metrics["retries"] += 1
+            update.update(state="pending", error=error, next_attempt_at=(now + timedelta(seconds=delay)).isoformat())
+        return UpdateOne({"_id": delivery["_id"]}, {"$set": update, "$unset": {"lease": "", "leased_until": ""}})
+
+    async def deliver(self, subscription: Dict[str, Any]) -> int:
+        """Deliver what is due for one endpoint; returns the number of events attempted"""
+        ordered = subscription.get("ordered", True)
+        concurrency = 1 if ordered else subscription.get("max_concurrency", 4)
+        claimed = await self._claim(subscription, self.batch_size * concurrency)
+        if not claimed:
+            return 0
+        batches = [claimed[i:i + self.batch_size] for i in range(0, len(claimed), self.batch_size)]
+        results = []
+        if ordered:
+            for index, batch in enumerate(batches):
+                error = await self._post(subscription, batch)
+                results.append((batch, error))
+                if error is not None:
+                    # Release the rest untouched so they go out after this batch
+                    for later in batches[index + 1:]:
+                        results.append((later, "held"))
+                    break
+        else:
+            errors = await asyncio.gather(*(self._post(subscription, batch) for batch in batches))
+            results = list(zip(batches, errors))
+
+        now = datetime.now(timezone.utc)
+        operations = []
+        for batch, error in results:
+            # One delay per batch, so a retried batch comes due again all at once and in order
+            delay = self._retry_delay(max(delivery.get("attempts", 0) for delivery in batch) + 1)
+            for delivery in batch:
+                if error == "held":
+                    operations.append(UpdateOne(
+                        {"_id": delivery["_id"]}, {"$set": {"state": "pending"}, "$unset": {"lease": "", "leased_until": ""}}
+                    ))
+                else:
+                    operations.append(self._outcome(delivery, error, now, delay))
+        await self.db.webhook_deliveries.bulk_write(operations, ordered=False)
+        return len(claimed)
+
+    async def _endpoint_worker(self, subscription: Dict[str, Any]):
+        try:
+            while await self.deliver(subscription) >= self.batch_size:
+                pass
+        except Exception:
+            logger.exception("Webhook delivery to %s failed", subscription["url"])
+        finally:
+            self._workers.pop(subscription["id"], None)
+
+    async def run_once(self):
+        """Start a worker for every endpoint that is not already being served"""
+        for subscription in await self.subscriptions():
+            if subscription["id"] not in self._workers:
+                self._workers[subscription["id"]] = asyncio.create_task(self._endpoint_worker(subscription))
+
+    async def status(self) -> Dict[str, Any]:
+        counts = await self.db.webhook_deliveries.aggregate([
+            {"$group": {"_id": {"subscription_id": "$subscription_id", "state": "$state"}, "count": {"$sum": 1}}}
+        ]).to_list(length=None)
+        endpoints: Dict[str, Dict[str, int]] = {}
+        for item in counts:
+            endpoints.setdefault(item["_id"]["subscription_id"], {})[item["_id"]["state"]] = item["count"]
+        requests, seconds = self.metrics["requests"], self.metrics["request_seconds"]
+        return {
+            **self.metrics,
+            "mean_request_ms": round(seconds / requests * 1000, 1) if requests else None,
+            "active_workers": len(self._workers),
+            "deliveries": endpoints,
+        }
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("Webhook dispatch failed")
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for worker in list(self._workers.values()):
+            worker.cancel()
+        self._workers.clear()
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients.clear()
@@ -1,7 +1,7 @@
 import requests
 import sys
 import json
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 
 class ElyvraAPITester:
     def __init__(self, base_url="https://shop-elyvra.preview.emergentagent.com"):
@@ -11,6 +11,7 @@ class ElyvraAPITester:
         self.tests_passed = 0
         self.cart_id = None
         self.product_ids = []
+        self.order_id = None
 
     def run_test(self, name, method, endpoint, expected_status, data=None, params=None):
         """Run a single API test"""
@@ -28,6 +29,8 @@ class ElyvraAPITester:
                 response = requests.post(url, json=data, headers=headers)
             elif method == 'PUT':
                 response = requests.put(url, json=data, headers=headers)
+            elif method == 'PATCH':
+                response = requests.patch(url, json=data, headers=headers)
             elif method == 'DELETE':
                 response = requests.delete(url, headers=headers)
 
@@ -241,6 +244,178 @@ class ElyvraAPITester:
         
         return success
 
+    def test_get_cart_expanded(self):
+        """Test getting cart with product details joined"""
+        if not self.cart_id:
+            print("❌ No cart ID available for expanded cart test")
+            return False
+            
+        success, response = self.run_test(
+            "Get Expanded Cart",
+            "GET",
+            f"cart/{self.cart_id}",
+            200,
+            params={"expand": "products", "lang": "ar"}
+        )
+        
+        if success and isinstance(response, dict):
+            missing = [item['product_id'] for item in response.get('items', []) if not item.get('product')]
+            if missing:
+                print(f"   ⚠️  Lines without product details: {missing}")
+            print(f"   Cart subtotal: {response.get('subtotal')} for {response.get('item_count')} items")
+        
+        return success
+
+    def test_patch_product(self):
+        """Test partial product updates with nested translation paths"""
+        if not self.product_ids:
+            print("❌ No product IDs available for patch test")
+            return False
+            
+        product_id = self.product_ids[0]
+        success, product = self.run_test(
+            "Patch Product Translation",
+            "PATCH",
+            f"admin/products/{product_id}",
+            200,
+            data={"translations": {"fr": {"short_description": "Mise à jour partielle"}}}
+        )
+        if success:
+            translations = product.get("translations", {})
+            if translations.get("fr", {}).get("short_description") != "Mise à jour partielle":
+                print("   ⚠️  Patched field was not updated")
+                return False
+            missing = [lang for lang in ("en", "ar") if lang not in translations]
+            if missing:
+                print(f"   ⚠️  Patch dropped translations: {missing}")
+                return False
+        
+        invalid_patches = [
+            ("Patch Unknown Field", {"id": "other-id"}, 400),
+            ("Patch Overlapping Paths", {"translations": {"fr": {"name": "x"}}, "translations.fr": {"name": "y"}}, 400),
+            ("Patch Invalid Value", {"price": "free"}, 422),
+        ]
+        all_passed = success
+        for name, patch, expected_status in invalid_patches:
+            passed, _ = self.run_test(name, "PATCH", f"admin/products/{product_id}", expected_status, data=patch)
+            all_passed = all_passed and passed
+        return all_passed
+
+    def test_batch_inventory(self):
+        """Test receiving batches and FEFO allocation on checkout"""
+        if not self.product_ids:
+            print("❌ No product IDs available for batch inventory test")
+            return False
+            
+        product_id = self.product_ids[-1]
+        now = datetime.now(timezone.utc)
+        all_passed = True
+        for batch_number, days, quantity in [("TEST-LATE", 300, 5), ("TEST-SOON", 30, 3)]:
+            success, _ = self.run_test(
+                f"Receive Batch {batch_number}",
+                "POST",
+                f"admin/products/{product_id}/batches",
+                200,
+                data={"batch_number": batch_number, "quantity": quantity,
+                      "expiry_date": (now + timedelta(days=days)).isoformat()}
+            )
+            all_passed = all_passed and success
+        
+        success, batches = self.run_test(
+            "Get Batches in FEFO Order",
+            "GET",
+            f"admin/products/{product_id}/batches",
+            200
+        )
+        if success:
+            expiries = [batch["expiry_date"] for batch in batches]
+            if expiries != sorted(expiries):
+                print(f"   ⚠️  Batches not in expiry order: {expiries}")
+                all_passed = False
+        
+        address = {"street": "1 Test St", "city": "Dubai", "state": "Dubai", "country": "AE", "postal_code": "00000"}
+        success, order = self.run_test(
+            "Create Order Allocating Soonest Batch",
+            "POST",
+            "orders",
+            200,
+            data={
+                "customer_id": "backend-test",
+                "items": [{"product_id": product_id, "product_name": "Test", "price": 10.0, "quantity": 1, "total": 10.0}],
+                "shipping_address": address,
+                "billing_address": address,
+                "payment_method": "credit_card"
+            }
+        )
+        if success:
+            self.order_id = order["id"]
+            allocations = order.get("batch_allocations", [])
+            print(f"   Allocated from: {[a['batch_number'] for a in allocations]}")
+            if allocations and allocations[0]["expiry_date"] != batches[0]["expiry_date"]:
+                print("   ⚠️  Order was not allocated from the earliest-expiring batch")
+                all_passed = False
+        all_passed = all_passed and success
+        
+        success, _ = self.run_test(
+            "Reject Direct Stock Edit of Batch-Tracked Product",
+            "PATCH",
+            f"admin/products/{product_id}",
+            409,
+            data={"stock_quantity": 999}
+        )
+        return all_passed and success
+
+    def test_bulk_order_update(self):
+        """Test updating status and tracking for several orders in one request"""
+        if not self.order_id:
+            print("❌ No order ID available for bulk update test")
+            return False
+            
+        success, response = self.run_test(
+            "Bulk Update Orders",
+            "POST",
+            "admin/orders/bulk-update",
+            200,
+            data={"updates": [
+                {"order_id": self.order_id, "status": "processing", "tracking_number": "TRK-TEST-1"},
+                {"order_id": "missing-order", "status": "shipped"}
+            ]}
+        )
+        if success:
+            print(f"   Updated: {response.get('updated')}, failed: {response.get('failed')}")
+            results = {result["order_id"]: result for result in response.get("results", [])}
+            if not results.get(self.order_id, {}).get("ok") or results.get("missing-order", {}).get("ok"):
+                print(f"   ⚠️  Unexpected per-row results: {response.get('results')}")
+                return False
+        
+        success, order = self.run_test(
+            "Get Bulk-Updated Order",
+            "GET",
+            f"orders/{self.order_id}",
+            200
+        )
+        if success and (order.get("status") != "processing" or order.get("tracking_number") != "TRK-TEST-1"):
+            print(f"   ⚠️  Order not updated: {order.get('status')} / {order.get('tracking_number')}")
+            return False
+        return success
+
+    def test_coalescing_status(self):
+        """Test the request coalescing counters after the catalog reads above"""
+        success, response = self.run_test(
+            "Get Coalescing Status",
+            "GET",
+            "admin/coalescing/status",
+            200
+        )
+        if success:
+            for field in ("in_flight", "generation", "keys"):
+                if field not in response:
+                    print(f"   ⚠️  Missing field in status: {field}")
+                    return False
+            for key, counters in response["keys"].items():
+                print(f"   {key}: {counters.get('calls')} calls, {counters.get('coalesced')} coalesced")
+        return success
+
     def test_invalid_endpoints(self):
         """Test invalid endpoints return proper errors"""
         invalid_tests = [
@@ -286,6 +461,14 @@ def main():
     test_results.append(("Create Cart", tester.test_create_cart()))
     test_results.append(("Get Cart", tester.test_get_cart()))
     test_results.append(("Add to Cart", tester.test_add_to_cart()))
+    test_results.append(("Get Expanded Cart", tester.test_get_cart_expanded()))
+    
+    # Admin product and inventory tests
+    test_results.append(("Patch Product", tester.test_patch_product()))
+    test_results.append(("Batch Inventory", tester.test_batch_inventory()))
+    test_results.append(("Bulk Order Update", tester.test_bulk_order_update()))
+    
+    test_results.append(("Coalescing Status", tester.test_coalescing_status()))
     
     # Error handling tests
     test_results.append(("Invalid Endpoints", tester.test_invalid_endpoints()))
@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+from pymongo.errors import BulkWriteError
+
+from audit import AuditLog, audit_record
+from events import ChangeEvent
+
+
+class FlakyCollection:
+    """Stores inserts by _id like Mongo and fails the records at the given positions once"""
+
+    def __init__(self, fail_at=(), code=None):
+        self.docs = {}
+        self.fail_at = set(fail_at)
+        self.code = code
+
+    async def insert_many(self, docs, ordered=True):
+        errors = []
+        for index, doc in enumerate(docs):
+            doc.setdefault("_id", id(doc))
+            if doc["_id"] in self.docs:
+                errors.append({"index": index, "code": 11000, "errmsg": "duplicate key"})
+            elif index in self.fail_at:
+                errors.append({"index": index, "code": self.code, "errmsg": "failed"})
+            else:
+                self.docs[doc["_id"]] = doc
+        self.fail_at = set()
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nInserted": len(docs) - len(errors)})
+
+
+def event(n):
+    return ChangeEvent(type="product.updated", entity_id=f"p{n}", changes={"price": n})
+
+
+def test_partial_failure_requeues_only_the_records_that_did_not_land():
+    collection = FlakyCollection(fail_at={1}, code=91)
+    audit = AuditLog({"audit_log": collection})
+    for n in range(3):
+        audit.record(event(n))
+
+    with pytest.raises(BulkWriteError):
+        asyncio.run(audit.flush())
+    assert [record["entity_id"] for record in audit._buffer] == ["p1"]
+
+    assert asyncio.run(audit.flush()) == 1
+    assert audit._buffer == []
+    assert sorted(doc["entity_id"] for doc in collection.docs.values()) == ["p0", "p1", "p2"]
+
+
+def test_records_that_already_landed_are_dropped_as_duplicates():
+    collection = FlakyCollection()
+    audit = AuditLog({"audit_log": collection})
+    audit.record(event(0))
+    asyncio.run(audit.flush())
+    # A flush that failed after writing puts the same records (with their _id) back
+    audit._buffer = list(collection.docs.values())
+    audit.record(event(1))
+
+    assert asyncio.run(audit.flush()) == 2
+    assert audit._buffer == []
+    assert len(collection.docs) == 2
+
+
+def test_dotted_patch_paths_are_stored_as_path_value_pairs():
+    record = audit_record(ChangeEvent(
+        type="product.updated", entity_id="p",
+        changes={"translations.fr.description": "new"}, previous={"translations.fr.description": "old"},
+    ))
+    assert record["changes"] == [{"path": "translations.fr.description", "value": "new"}]
+    assert record["previous"] == [{"path": "translations.fr.description", "value": "old"}]
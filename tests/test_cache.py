@@ -0,0 +1,119 @@
+import asyncio
+
+import pytest
+
+from cache import SingleFlight
+
+
+def test_concurrent_calls_for_one_key_share_a_single_call():
+    async def main():
+        flight = SingleFlight()
+        calls = []
+
+        async def load():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "value"
+
+        results = await asyncio.gather(*[flight.do("k", load, name="reads") for _ in range(5)])
+        return results, calls, flight.status()
+
+    results, calls, status = asyncio.run(main())
+    assert results == ["value"] * 5
+    assert len(calls) == 1
+    assert status["in_flight"] == 0
+    assert status["keys"]["reads"] == {"calls": 1, "coalesced": 4, "timeouts": 0, "errors": 0}
+
+
+def test_different_keys_do_not_coalesce():
+    async def main():
+        flight = SingleFlight()
+
+        async def load(value):
+            await asyncio.sleep(0.01)
+            return value
+
+        return await asyncio.gather(flight.do("a", lambda: load("a")), flight.do("b", lambda: load("b")))
+
+    assert asyncio.run(main()) == ["a", "b"]
+
+
+def test_errors_reach_every_waiter_and_are_not_kept():
+    async def main():
+        flight = SingleFlight()
+        attempts = []
+
+        async def fail():
+            attempts.append(1)
+            await asyncio.sleep(0.01)
+            raise RuntimeError("down")
+
+        results = await asyncio.gather(*[flight.do("k", fail) for _ in range(3)], return_exceptions=True)
+        # The next caller starts a fresh call instead of reusing the failure
+        with pytest.raises(RuntimeError):
+            await flight.do("k", fail)
+        return results, attempts, flight.metrics["default"]["errors"]
+
+    results, attempts, errors = asyncio.run(main())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert len(attempts) == 2
+    assert errors == 2
+
+
+def test_timeout_is_raised_to_every_waiter():
+    async def main():
+        flight = SingleFlight(timeout=0.01)
+
+        async def hang():
+            await asyncio.sleep(1)
+
+        results = await asyncio.gather(*[flight.do("k", hang) for _ in range(3)], return_exceptions=True)
+        return results, flight.status()
+
+    results, status = asyncio.run(main())
+    assert all(isinstance(result, asyncio.TimeoutError) for result in results)
+    assert status["in_flight"] == 0
+    assert status["keys"]["default"]["timeouts"] == 1
+
+
+def test_a_waiter_going_away_does_not_cancel_the_call():
+    async def main():
+        flight = SingleFlight()
+        finished = asyncio.Event()
+
+        async def load():
+            await asyncio.sleep(0.02)
+            finished.set()
+            return "value"
+
+        first = asyncio.ensure_future(flight.do("k", load))
+        second = asyncio.ensure_future(flight.do("k", load))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second, finished.is_set()
+
+    assert asyncio.run(main()) == ("value", True)
+
+
+def test_forget_starts_fresh_calls_and_bumps_the_generation():
+    async def main():
+        flight = SingleFlight()
+        started = []
+
+        async def load():
+            generation = flight.generation
+            started.append(generation)
+            await asyncio.sleep(0.02)
+            return generation, flight.generation
+
+        before = asyncio.ensure_future(flight.do("k", load))
+        await asyncio.sleep(0.005)
+        flight.forget()
+        after = await flight.do("k", load)
+        return await before, after, started
+
+    before, after, started = asyncio.run(main())
+    # The call that began before forget() can tell its result is stale
+    assert before == (0, 1)
+    assert after == (1, 1)
+    assert started == [0, 1]
@@ -0,0 +1,42 @@
+import pytest
+
+import compression
+from compression import negotiate_encoding
+
+
+@pytest.fixture(params=[True, False], ids=["with-brotli", "without-brotli"])
+def brotli_available(request, monkeypatch):
+    if request.param and compression.brotli is None:
+        pytest.skip("brotli is not installed")
+    if not request.param:
+        monkeypatch.setattr(compression, "brotli", None)
+    return request.param
+
+
+@pytest.mark.parametrize("header", ["", "identity", "deflate", "gzip;q=0", "*;q=0"])
+def test_nothing_acceptable(header, monkeypatch):
+    monkeypatch.setattr(compression, "brotli", None)
+    assert negotiate_encoding(header) is None
+
+
+def test_brotli_preferred_when_available(brotli_available):
+    expected = "br" if brotli_available else "gzip"
+    assert negotiate_encoding("gzip, deflate, br") == expected
+    assert negotiate_encoding("*") == expected
+
+
+@pytest.mark.parametrize("header", ["br;q=0, gzip", "br; q=0, gzip;q=0.5", "GZIP", "br;q=0, *;q=0.1"])
+def test_q_values_and_case(header, brotli_available):
+    assert negotiate_encoding(header) == "gzip"
+
+
+def test_explicit_zero_overrides_wildcard(brotli_available):
+    assert negotiate_encoding("gzip;q=0, *") == ("br" if brotli_available else None)
+
+
+def test_malformed_q_counts_as_refused():
+    assert negotiate_encoding("br;q=high, gzip;q=abc") is None
+
+
+def test_whitespace_around_names():
+    assert negotiate_encoding(" br ;q=0 , gzip ;q=1") == "gzip"
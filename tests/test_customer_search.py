@@ -0,0 +1,60 @@
+import pytest
+
+from customer_search import build_query, normalize_email, normalize_name, normalize_phone, search_fields
+
+
+@pytest.mark.parametrize("raw, expected", [
+    ("أحمد", "احمد"),        # alef with hamza above
+    ("إيمان", "ايمان"),      # alef with hamza below
+    ("آمنة", "امنه"),        # alef with madda, taa marbuta
+    ("فاطمة", "فاطمه"),      # taa marbuta
+    ("مُحَمَّد", "محمد"),       # harakat
+    ("محـــمد", "محمد"),     # tatweel
+    ("مصطفى", "مصطفي"),     # alef maksura
+    ("مؤمن", "مومن"),        # waw with hamza
+    ("هانئ", "هاني"),        # yeh with hamza
+    ("  José  MARÍA ", "jose maria"),
+    ("Straße", "strasse"),
+    (None, ""),
+])
+def test_normalize_name(raw, expected):
+    assert normalize_name(raw) == expected
+
+
+def test_spelling_variants_normalize_alike():
+    assert normalize_name("أحمد") == normalize_name("احمد") == normalize_name("إحمد")
+    assert normalize_name("الزهراء") == normalize_name("الزهرآء")
+
+
+@pytest.mark.parametrize("raw, expected", [
+    ("+971 50-123 4567", "971501234567"),
+    ("٠٥٠١٢٣٤٥٦٧", "0501234567"),   # Arabic-Indic digits
+    ("۰۵۰۱۲۳", "050123"),           # Eastern Arabic-Indic digits
+    ("(050) ١٢٣", "050123"),
+    (None, ""),
+])
+def test_normalize_phone(raw, expected):
+    assert normalize_phone(raw) == expected
+
+
+def test_normalize_email():
+    assert normalize_email("  Fatima.Z@Mail.COM ") == "fatima.z@mail.com"
+
+
+def test_search_fields_leave_out_empty_keys():
+    fields = search_fields({"first_name": "فاطمة", "last_name": "الزهراء", "email": "", "phone": None})
+    assert fields == {"names": ["الزهراء", "فاطمه", "فاطمه الزهراء"]}
+
+
+def test_build_query_picks_the_index_from_the_query_shape():
+    assert build_query("Fatima@") == {"search.email": {"$regex": "^fatima@"}}
+    assert build_query("+٩٧١ 50") == {"search.phone": {"$regex": "^97150"}}
+    assert build_query("أحمد") == {"search.names": {"$regex": "^احمد"}}
+    assert build_query("fat zah") == {"$and": [
+        {"search.names": {"$regex": "^fat"}}, {"search.names": {"$regex": "^zah"}},
+    ]}
+    assert build_query("  ") is None
+
+
+def test_build_query_escapes_regex_characters():
+    assert build_query("a.b+c@x") == {"search.email": {"$regex": r"^a\.b\+c@x"}}
@@ -0,0 +1,39 @@
+import pytest
+
+from file_serving import parse_range
+
+
+@pytest.mark.parametrize("header", [None, "", "bytes=-", "items=0-1", "bytes=0-1,4-5", "bytes=a-b", "bytes=1-2 3"])
+def test_whole_file_for_missing_or_unsupported_ranges(header):
+    assert parse_range(header, 100) is None
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-9", (0, 9)),
+    ("bytes=10-", (10, 99)),
+    (" bytes=99-99 ", (99, 99)),
+    ("bytes=90-1000", (90, 99)),  # end past the file is clamped
+])
+def test_byte_ranges(header, expected):
+    assert parse_range(header, 100) == expected
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=-10", (90, 99)),
+    ("bytes=-100", (0, 99)),
+    ("bytes=-5000", (0, 99)),  # suffix longer than the file means the whole file
+])
+def test_suffix_ranges(header, expected):
+    assert parse_range(header, 100) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=100-", "bytes=500-600", "bytes=20-10", "bytes=-0"])
+def test_unsatisfiable_ranges(header):
+    with pytest.raises(ValueError):
+        parse_range(header, 100)
+
+
+@pytest.mark.parametrize("header", ["bytes=0-", "bytes=-10"])
+def test_no_range_of_an_empty_file_is_satisfiable(header):
+    with pytest.raises(ValueError):
+        parse_range(header, 0)
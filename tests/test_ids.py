@@ -0,0 +1,60 @@
+import threading
+import uuid
+
+import pytest
+
+import ids
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    # Other tests mint ids at the real time, which is later than the frozen clocks here
+    monkeypatch.setattr(ids, "_last_ms", 0)
+    monkeypatch.setattr(ids, "_counter", 0)
+
+
+def freeze_clock(monkeypatch, ms):
+    monkeypatch.setattr(ids.time, "time_ns", lambda: ms * 1_000_000)
+
+
+def test_version_variant_and_timestamp(monkeypatch):
+    freeze_clock(monkeypatch, 1_760_000_000_123)
+    value = ids.uuid7()
+    assert value.version == 7
+    assert value.variant == uuid.RFC_4122
+    assert value.int >> 80 == 1_760_000_000_123
+
+
+def test_ids_within_one_millisecond_are_strictly_increasing(monkeypatch):
+    freeze_clock(monkeypatch, 1_760_000_000_000)
+    minted = [ids.new_id() for _ in range(5000)]  # more than the 12-bit counter holds
+    assert minted == sorted(minted)
+    assert len(set(minted)) == len(minted)
+
+
+def test_clock_going_backwards_keeps_order(monkeypatch):
+    freeze_clock(monkeypatch, 1_760_000_000_500)
+    first = ids.new_id()
+    freeze_clock(monkeypatch, 1_760_000_000_100)
+    assert ids.new_id() > first
+
+
+def test_concurrent_threads_never_collide(monkeypatch):
+    freeze_clock(monkeypatch, 1_760_000_001_000)
+    minted = []
+
+    def mint():
+        minted.extend(ids.new_id() for _ in range(500))
+
+    threads = [threading.Thread(target=mint) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(set(minted)) == len(minted)
+
+
+def test_canonical_form():
+    value = ids.new_id()
+    assert len(value) == 36
+    assert str(uuid.UUID(value)) == value
@@ -0,0 +1,107 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+import inventory
+from inventory import InsufficientStock
+
+
+NOW = datetime.now(timezone.utc)
+
+
+def run(scenario):
+    async def main():
+        db = mongomock_motor.AsyncMongoMockClient()["test"]
+        await db.products.insert_many([
+            {"id": "tracked", "stock_quantity": 0},
+            {"id": "plain", "stock_quantity": 10},
+        ])
+        return await scenario(db)
+    return asyncio.run(main())
+
+
+async def receive(db, *batches):
+    for batch_number, days, quantity in batches:
+        await inventory.receive_batch(db, "tracked", {
+            "batch_number": batch_number,
+            "quantity": quantity,
+            "expiry_date": NOW + timedelta(days=days),
+        })
+
+
+async def batch_quantities(db):
+    batches = await db.inventory_batches.find({}, {"_id": 0}).sort("expiry_date", 1).to_list(length=None)
+    return {batch["batch_number"]: batch["quantity"] for batch in batches}
+
+
+def test_allocates_earliest_expiry_first():
+    async def scenario(db):
+        await receive(db, ("LATE", 300, 5), ("SOON", 10, 3), ("MID", 100, 4))
+        allocations = await inventory.allocate(db, [{"product_id": "tracked", "quantity": 5}], {"tracked"})
+        product = await db.products.find_one({"id": "tracked"})
+        return allocations, await batch_quantities(db), product
+
+    allocations, quantities, product = run(scenario)
+    assert [(a["batch_number"], a["quantity"]) for a in allocations] == [("SOON", 3), ("MID", 2)]
+    assert quantities == {"SOON": 0, "MID": 2, "LATE": 5}
+    assert product["stock_quantity"] == 7
+    assert product["batch_number"] == "MID"
+    assert product["batch_tracked"] is True
+
+
+def test_expired_batches_are_never_allocated():
+    async def scenario(db):
+        await receive(db, ("OLD", -1, 10), ("NEW", 30, 2))
+        return await inventory.allocate(db, [{"product_id": "tracked", "quantity": 2}], {"tracked"})
+
+    assert [a["batch_number"] for a in run(scenario)] == ["NEW"]
+
+
+def test_shortage_puts_everything_back():
+    async def scenario(db):
+        await receive(db, ("A", 10, 3), ("B", 20, 1))
+        with pytest.raises(InsufficientStock) as raised:
+            await inventory.allocate(db, [{"product_id": "tracked", "quantity": 5}], {"tracked"})
+        product = await db.products.find_one({"id": "tracked"})
+        return raised.value, await batch_quantities(db), product
+
+    error, quantities, product = run(scenario)
+    assert (error.product_id, error.requested) == ("tracked", 5)
+    assert quantities == {"A": 3, "B": 1}
+    assert product["stock_quantity"] == 4
+
+
+def test_untracked_products_are_skipped():
+    async def scenario(db):
+        await receive(db, ("A", 10, 3))
+        allocations = await inventory.allocate(db, [{"product_id": "plain", "quantity": 50}], {"tracked"})
+        return allocations, await db.products.find_one({"id": "plain"})
+
+    allocations, product = run(scenario)
+    assert allocations == []
+    assert product["stock_quantity"] == 10
+
+
+def test_release_restocks_batches_and_product():
+    async def scenario(db):
+        await receive(db, ("A", 10, 3), ("B", 20, 4))
+        allocations = await inventory.allocate(db, [{"product_id": "tracked", "quantity": 5}], {"tracked"})
+        await inventory.release(db, allocations)
+        product = await db.products.find_one({"id": "tracked"})
+        return await batch_quantities(db), product
+
+    quantities, product = run(scenario)
+    assert quantities == {"A": 3, "B": 4}
+    assert product["stock_quantity"] == 7
+    assert product["batch_number"] == "A"
+
+
+def test_batch_numbers_are_stored_literally():
+    async def scenario(db):
+        await receive(db, ("$stock_quantity", 10, 2))
+        return await db.products.find_one({"id": "tracked"})
+
+    assert run(scenario)["batch_number"] == "$stock_quantity"
@@ -0,0 +1,67 @@
+import pytest
+
+import patching
+from patching import MISSING
+
+
+def test_flatten_nested_and_dotted_keys():
+    paths = patching.flatten({"price": 10, "translations": {"fr": {"name": "Nom"}}, "a.b": 1})
+    assert paths == {"price": 10, "translations.fr.name": "Nom", "a.b": 1}
+
+
+def test_flatten_keeps_lists_and_empty_objects_whole():
+    assert patching.flatten({"tags": ["a", "b"], "meta": {}}) == {"tags": ["a", "b"], "meta": {}}
+
+
+@pytest.mark.parametrize("patch", [
+    {"$set": {"price": 1}},
+    {"translations": {"$where": 1}},
+    {"a..b": 1},
+    {"": 1},
+])
+def test_flatten_rejects_operator_and_empty_segments(patch):
+    with pytest.raises(ValueError, match="Invalid field path"):
+        patching.flatten(patch)
+
+
+def test_flatten_rejects_overlapping_paths():
+    with pytest.raises(ValueError, match="overlap"):
+        patching.flatten({"translations": {"fr": {"name": "x"}}, "translations.fr": {}})
+    with pytest.raises(ValueError, match="overlap"):
+        patching.flatten({"a": 1, "a.b": 2})
+
+
+def test_flatten_rejects_a_path_given_twice():
+    with pytest.raises(ValueError, match="given twice"):
+        patching.flatten({"translations": {"fr": {"name": "x"}}, "translations.fr": {"name": "y"}})
+
+
+def test_get_path():
+    doc = {"a": {"b": 1}, "c": None}
+    assert patching.get_path(doc, "a.b") == 1
+    assert patching.get_path(doc, "c") is None
+    assert patching.get_path(doc, "a.x") is MISSING
+    assert patching.get_path(doc, "a.b.c") is MISSING
+
+
+def test_apply_sets_creates_and_removes_without_touching_the_original():
+    doc = {"price": 10, "translations": {"en": {"name": "A", "description": "d"}}, "sku": "S"}
+    result = patching.apply(doc, {"price": 12, "translations.en.description": None, "translations.fr.name": "B", "sku": None})
+    assert result == {"price": 12, "translations": {"en": {"name": "A"}, "fr": {"name": "B"}}}
+    assert doc["translations"]["en"]["description"] == "d"
+    assert doc["sku"] == "S"
+
+
+def test_diff_skips_unchanged_values():
+    current = {"price": 10, "translations": {"en": {"name": "A"}}, "tags": ["x"]}
+    updated = {"price": 10, "translations": {"en": {"name": "B"}}, "tags": ["x", "y"]}
+    to_set, to_unset = patching.diff(current, updated, ["price", "translations.en.name", "tags"])
+    assert to_set == {"translations.en.name": "B", "tags": ["x", "y"]}
+    assert to_unset == []
+
+
+def test_diff_unsets_only_fields_that_exist():
+    current = {"batch_number": "B1", "storage_conditions": None}
+    to_set, to_unset = patching.diff(current, {}, ["batch_number", "storage_conditions", "expiry_date"])
+    assert to_set == {}
+    assert to_unset == ["batch_number", "storage_conditions"]
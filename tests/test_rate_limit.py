@@ -0,0 +1,48 @@
+import pytest
+
+from rate_limit import MemoryBucketStore, RateLimitMiddleware
+
+
+def scope(peer, forwarded=None):
+    headers = [(b"x-forwarded-for", value.encode()) for value in forwarded or []]
+    return {"type": "http", "client": (peer, 12345), "headers": headers}
+
+
+def middleware(*trusted):
+    return RateLimitMiddleware(app=None, store=MemoryBucketStore(), trusted_proxies=trusted)
+
+
+def test_forwarded_for_is_ignored_without_trusted_proxies():
+    assert middleware().client_ip(scope("203.0.113.9", ["1.2.3.4"])) == "203.0.113.9"
+
+
+def test_forwarded_for_is_ignored_from_an_untrusted_peer():
+    limiter = middleware("10.0.0.0/8")
+    assert limiter.client_ip(scope("203.0.113.9", ["1.2.3.4"])) == "203.0.113.9"
+
+
+def test_nearest_untrusted_hop_behind_trusted_proxies():
+    limiter = middleware("10.0.0.0/8", "192.168.1.5")
+    # The client forged the left-most hop; our proxies appended the rest
+    forwarded = ["6.6.6.6, 198.51.100.7, 192.168.1.5"]
+    assert limiter.client_ip(scope("10.1.2.3", forwarded)) == "198.51.100.7"
+
+
+def test_repeated_headers_are_read_in_order():
+    limiter = middleware("10.0.0.0/8")
+    assert limiter.client_ip(scope("10.1.2.3", ["198.51.100.7", "10.0.0.2"])) == "198.51.100.7"
+
+
+@pytest.mark.parametrize("forwarded", [None, ["10.0.0.2"], ["", " "]])
+def test_peer_is_used_when_every_hop_is_trusted_or_missing(forwarded):
+    assert middleware("10.0.0.0/8").client_ip(scope("10.1.2.3", forwarded)) == "10.1.2.3"
+
+
+def test_malformed_hops_are_not_trusted():
+    limiter = middleware("10.0.0.0/8")
+    assert limiter.client_ip(scope("10.1.2.3", ["not-an-ip"])) == "not-an-ip"
+
+
+def test_ipv6_proxies():
+    limiter = middleware("2001:db8::/32", "")
+    assert limiter.client_ip(scope("2001:db8::1", ["2001:db9::5"])) == "2001:db9::5"
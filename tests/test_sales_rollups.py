@@ -0,0 +1,54 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+import sales_rollups
+
+
+ORDER = {
+    "id": "o1", "status": "processing", "created_at": "2026-03-04T10:05:00+00:00", "total_amount": 50.0,
+    "discount_amount": 0.0, "payment_method": "paypal",
+    "items": [{"product_id": "p1", "quantity": 2, "total": 50.0}],
+}
+
+
+def run(scenario):
+    async def main():
+        db = mongomock_motor.AsyncMongoMockClient()["test"]
+        await db.products.insert_one({"id": "p1", "category": "vitality"})
+        return await scenario(db)
+    return asyncio.run(main())
+
+
+@pytest.mark.parametrize("granularity, start", [
+    ("hour", datetime(2026, 3, 4, 10, 30, tzinfo=timezone.utc)),
+    ("day", datetime(2026, 3, 4, 18, 0, tzinfo=timezone.utc)),
+    ("week", datetime(2026, 3, 6, tzinfo=timezone.utc)),
+    ("month", datetime(2026, 3, 20, tzinfo=timezone.utc)),
+])
+def test_query_includes_the_bucket_the_start_falls_in(granularity, start):
+    async def scenario(db):
+        await sales_rollups.record_orders(db, [ORDER])
+        return await sales_rollups.query(db, start, datetime(2026, 4, 1, tzinfo=timezone.utc), granularity)
+
+    result = run(scenario)
+    assert result["totals"]["revenue"] == 50.0
+    assert result["totals"]["categories"] == {"vitality": {"revenue": 50.0, "units": 2}}
+
+
+def test_rebuild_replaces_buckets_from_paid_orders():
+    async def scenario(db):
+        await db.orders.insert_many([dict(ORDER), {**ORDER, "id": "o2", "status": "pending_payment"}])
+        # Stale counts from before the rebuild
+        await sales_rollups.record_orders(db, [ORDER, ORDER, ORDER])
+        processed = await sales_rollups.rebuild(db)
+        day = await db.sales_rollups.find_one({"granularity": "day"})
+        return processed, day, await db.list_collection_names()
+
+    processed, day, collections = run(scenario)
+    assert processed == 1
+    assert (day["orders"], day["revenue"]) == (1, 50.0)
+    assert "sales_rollups_rebuild" not in collections